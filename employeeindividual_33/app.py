@@ -1,13 +1,41 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
-from flask_mysqldb import MySQL
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, Response, stream_with_context, jsonify, abort
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import safe_join
+from db import Database, PoolTimeout
+from instrumentation import Instrumentation
+from credentials import CredentialService, CredentialsBusy, RateLimiter
+from session_store import MemoryStore, SQLiteStore, ServerSessionInterface
+from ingest import ingest_events
+from employee_import import import_employees, iter_export_csv, write_export_excel
+import rollups
+import rules
+import archive
+import attendance_bulk
+from dashboard_cache import DailySummaryCache
+import migrations
+import assets
+import data_versions
 import MySQLdb.cursors
 import re
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, date, timedelta
-import pandas as pd
-from fpdf import FPDF
+from datetime import datetime, date, time, timedelta
 import os
-from io import BytesIO
+import csv
+import functools
+import hmac
+import mimetypes
+import click
+import multiprocessing
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from io import StringIO
+from urllib.parse import urlsplit
+from reporting import (PDF_GROUPS, REPORT_COLUMNS, REPORT_EXTENSIONS, REPORT_MIMETYPES, apply_report_retention,
+                       evict_report_cache, fail_report_job, fetch_data_version, format_time,
+                       invalidate_report_cache, iter_report_rows, previous_period, report_cache_path,
+                       report_date_range, report_row_values, run_report_job, set_report_status, touch_report)
 
 app = Flask(__name__)
 
@@ -16,6 +44,8 @@ app.config['MYSQL_HOST'] = 'localhost'
 app.config['MYSQL_USER'] = 'root'
 app.config['MYSQL_PASSWORD'] = ''  # Enter your MySQL password here
 app.config['MYSQL_DB'] = 'kate33'
+app.config['DB_POOL_SIZE'] = 10
+app.config['DB_POOL_TIMEOUT'] = 5.0  # seconds to wait for a free connection
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['UPLOAD_FOLDER'] = 'static/reports'
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
@@ -24,8 +54,103 @@ app.config['REPORT_TYPES'] = {
     'weekly': 'Weekly Attendance Summary',
     'monthly': 'Monthly Attendance Report'
 }
+# Attendance rules (see rules.py): a default and per-department overrides,
+# e.g. 'departments': {'Support': {'shift_start': time(7, 0), 'timezone': 'Asia/Manila'}}
+app.config['ATTENDANCE_RULES'] = {
+    'default': {
+        'shift_start': time(9, 0),
+        'grace_minutes': 0,  # time-ins after shift start + grace are late
+        'half_day_hours': None,  # days with less worked time become half-days; None disables
+        'workdays': (0, 1, 2, 3, 4),  # Monday = 0; `flask attendance mark-absent` skips other days
+        'timezone': None,  # IANA zone name; None = the server's local time
+    },
+    'departments': {},
+}
+app.config['KIOSK_TOKEN'] = None  # shared secret for /api/time_in_out kiosks, None disables
+app.config['ATTENDANCE_PAGE_SIZE'] = 50
+app.config['ATTENDANCE_BULK_MAX_ROWS'] = 1000  # records one bulk delete or status change may select
+app.config['DASHBOARD_CACHE_TTL'] = 30  # seconds; bounds staleness across workers
+app.config['INGEST_CHUNK_SIZE'] = 5000  # attendance rows per bulk-ingest transaction
+app.config['ARCHIVE_FOLDER'] = 'archive'  # Parquet files of archived attendance months
+app.config['ARCHIVE_KEEP_MONTHS'] = 13  # closed months `flask archive run` leaves in MySQL; covers the API history
+app.config['EMPLOYEE_IMPORT_CHUNK_SIZE'] = 1000  # rows per executemany in employee imports
+app.config['PASSWORD_HASH_WORKERS'] = None  # processes for import password hashing, None = CPU count
+app.config['PASSWORD_HASH_METHOD'] = 'scrypt'  # werkzeug method string, e.g. 'scrypt:65536:8:1'; old hashes upgrade on login
+app.config['CREDENTIAL_WORKERS'] = 2  # processes hashing and checking passwords for login/register
+app.config['CREDENTIAL_MAX_PENDING'] = 32  # queued + running hash jobs before logins get a 503
+app.config['CREDENTIAL_TIMEOUT'] = 10.0  # seconds a request waits for its hash job
+app.config['LOGIN_ACCOUNT_LIMIT'] = (5, 300)  # failed logins per username per N seconds
+app.config['LOGIN_IP_LIMIT'] = (30, 60)  # failed logins per client address per N seconds
+app.config['PROXY_COUNT'] = 0  # reverse proxies in front of the app; their X-Forwarded-For/-Proto are trusted
+app.config['ATTENDANCE_STATUSES'] = ('present', 'late', 'absent', 'half-day')
+app.config['REPORT_CHUNK_SIZE'] = 1000
+app.config['REPORT_WORKERS'] = 2
+app.config['REPORT_JOB_TIMEOUT'] = 600  # seconds before a queued/running job is considered dead
+app.config['REPORT_CACHE_MAX_BYTES'] = 500 * 1024 * 1024
+app.config['REPORT_SCHEDULE_FORMATS'] = ('excel', 'pdf')  # formats `flask reports schedule` pre-renders
+app.config['REPORT_RETENTION_DAYS'] = 90  # report files unused and report rows older than this are removed
+app.config['METRICS_TOKEN'] = None  # bearer token for Prometheus scrapes of /metrics; admins can always read it
+app.config['PROFILE_SLOW_REQUESTS'] = None  # seconds; requests slower than this dump sampled stacks
+app.config['PROFILE_FOLDER'] = 'profiles'
+app.config['ASSETS_FOLDER'] = 'static/dist'  # output of `flask assets build`
+app.config['ASSETS_MAX_AGE'] = 365 * 24 * 3600  # bundles are fingerprinted, so cache them for good
+app.config['API_HISTORY_MAX_DAYS'] = 366  # largest ?limit for /api/v1/employees/<id>/attendance
+app.config['API_POLL_INTERVAL'] = 15  # seconds between dashboard polls of the JSON API
+app.config['SESSION_BACKEND'] = 'memory'  # 'memory' for one worker, 'sqlite' to share sessions between workers
+app.config['SESSION_SQLITE_PATH'] = 'sessions.sqlite3'
+app.config['SESSION_TTL'] = 8 * 3600  # seconds of inactivity before a session expires
+app.config['SESSION_MAX_ENTRIES'] = 50000  # memory backend: sessions + profiles kept, least recently used dropped
+
+# Behind a proxy, remote_addr would be the proxy's address for everyone
+if app.config['PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'], x_proto=app.config['PROXY_COUNT'])
+
+db = Database(app)
+instrumentation = Instrumentation(app, db)
+
+# Server-side sessions with the user's profile cached (see session_store.py)
+PROFILE_QUERY = '''
+    SELECT u.username, u.role, e.id AS employee_pk, e.employee_id, e.full_name, e.department
+    FROM users u
+    LEFT JOIN employees e ON e.user_id = u.id
+    WHERE u.id = %s
+    ORDER BY e.id LIMIT 1
+'''
+
+def load_session_profile(user_id):
+    cursor = db.cursor()
+    cursor.execute(PROFILE_QUERY, (user_id,))
+    return cursor.fetchone()
+
+if app.config['SESSION_BACKEND'] == 'sqlite':
+    session_backend = SQLiteStore(app.config['SESSION_SQLITE_PATH'])
+else:
+    session_backend = MemoryStore(app.config['SESSION_MAX_ENTRIES'])
+app.session_interface = ServerSessionInterface(session_backend, load_session_profile, app.config['SESSION_TTL'])
+
+# Compiled once; every status decision goes through it
+attendance_rules = rules.RuleSet(**app.config['ATTENDANCE_RULES'])
+
+# Admin dashboard counters, updated in place by clock-ins
+dashboard_cache = DailySummaryCache(ttl=app.config['DASHBOARD_CACHE_TTL'])
 
-mysql = MySQL(app)
+def data_changed(*datasets):
+    # After committing a write to employees and/or attendance: drop the
+    # dashboard counters and move the API's ETags (see data_versions.py)
+    dashboard_cache.invalidate()
+    data_versions.bump(db.connection, *datasets)
+
+# Password hashing runs in its own process pool (see credentials.py)
+credentials = CredentialService(method=app.config['PASSWORD_HASH_METHOD'],
+                                workers=app.config['CREDENTIAL_WORKERS'],
+                                max_pending=app.config['CREDENTIAL_MAX_PENDING'],
+                                timeout=app.config['CREDENTIAL_TIMEOUT'])
+login_account_limiter = RateLimiter(*app.config['LOGIN_ACCOUNT_LIMIT'])
+login_ip_limiter = RateLimiter(*app.config['LOGIN_IP_LIMIT'])
+
+# Background report rendering (see reporting.run_report_job)
+report_executor = None
+report_jobs_lock = threading.Lock()
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -33,6 +158,26 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def redirect_back(endpoint):
+    # Return to the page (and filters) the form was posted from, local paths only
+    # Browsers read a backslash as a slash, so "/\evil.com" is "//evil.com"
+    next_url = request.form.get('next', '')
+    parts = urlsplit(next_url)
+    if (next_url.startswith('/') and not next_url.startswith('//') and '\\' not in next_url
+            and not parts.scheme and not parts.netloc):
+        return redirect(next_url)
+    return redirect(url_for(endpoint))
+
+@app.errorhandler(PoolTimeout)
+def database_busy(error):
+    # Every pooled connection stayed busy for DB_POOL_TIMEOUT seconds
+    return 'The server is busy, please try again in a moment.', 503, {'Retry-After': '5'}
+
+@app.errorhandler(CredentialsBusy)
+def credentials_busy(error):
+    # The hashing pool is full or too slow; shed load rather than queue
+    return 'The server is busy, please try again in a moment.', 503, {'Retry-After': '2'}
+
 @app.route('/')
 def home():
     if 'loggedin' in session:
@@ -42,28 +187,42 @@ def home():
     return redirect(url_for('login'))
 
 # Authentication Routes
+USER_QUERY = 'SELECT * FROM users WHERE username = %s'
+
 @app.route('/login/', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST' and 'username' in request.form and 'password' in request.form:
         username = request.form['username']
         password = request.form['password']
         
-        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute('SELECT * FROM users WHERE username = %s', (username,))
+        # Throttled attempts are turned away before any hashing or queries.
+        # Only failures count, so a whole office clocking in from one
+        # address at shift start is never throttled.
+        account_key = username.lower()
+        wait = max(login_ip_limiter.retry_after(request.remote_addr),
+                   login_account_limiter.retry_after(account_key))
+        if wait:
+            flash(f'Too many login attempts. Please try again in {wait} seconds.', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(wait)}
+        
+        cursor = db.cursor()
+        cursor.execute(USER_QUERY, (username,))
         account = cursor.fetchone()
         
-        if account and check_password_hash(account['password'], password):
+        matches, new_hash = credentials.verify(account['password'], password) if account else (False, None)
+        if matches:
+            login_account_limiter.reset(account_key)
+            if new_hash:
+                # Hash method or cost changed since this password was set
+                cursor.execute('UPDATE users SET password = %s WHERE id = %s AND password = %s',
+                               (new_hash, account['id'], account['password']))
+                db.commit()
+            
+            session.regenerate()
             session['loggedin'] = True
             session['id'] = account['id']
-            session['username'] = account['username']
-            session['role'] = account['role']
-            
-            # Get employee details if exists
-            cursor.execute('SELECT * FROM employees WHERE user_id = %s', (account['id'],))
-            employee = cursor.fetchone()
-            if employee:
-                session['employee_id'] = employee['employee_id']
-                session['full_name'] = employee['full_name']
+            # Username, role and employee details come from the cached profile
+            session.update(app.session_interface.profile(account['id']))
             
             flash('Logged in successfully!', 'success')
             
@@ -71,6 +230,8 @@ def login():
                 return redirect(url_for('admin_dashboard'))
             return redirect(url_for('dashboard'))
         else:
+            login_account_limiter.hit(account_key)
+            login_ip_limiter.hit(request.remote_addr)
             flash('Incorrect username/password!', 'danger')
     
     return render_template('login.html')
@@ -79,6 +240,45 @@ def login():
 def favicon():
     return send_file(os.path.join(app.root_path, 'static', 'favicon.ico'))
 
+# Static bundles (see assets.py). Without a build, pages load the source
+# files one by one through the normal static route.
+asset_manifest = assets.load_manifest(app.root_path, app.config['ASSETS_FOLDER'])
+
+@app.template_global()
+def asset_urls(name):
+    if asset_manifest and name in asset_manifest:
+        return [url_for('asset', filename=asset_manifest[name])]
+    return [url_for('static', filename=source) for source in assets.BUNDLES[name]]
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    path = safe_join(os.path.join(app.root_path, app.config['ASSETS_FOLDER']), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0]
+    # Serve the precompressed copy the client accepts, smallest first
+    encoding = None
+    for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[name] and os.path.isfile(path + suffix):
+            path, encoding = path + suffix, name
+            break
+    response = send_file(path, mimetype=mimetype, max_age=app.config['ASSETS_MAX_AGE'])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.cli.group('assets', help='Static asset bundles.')
+def assets_commands():
+    pass
+
+@assets_commands.command('build', help='Write trimmed, fingerprinted, compressed bundles and their manifest.')
+def assets_build_command():
+    # Restart the app afterwards to pick up the new manifest
+    assets.build(app.root_path, app.config['ASSETS_FOLDER'], log=click.echo)
+
 
 @app.route('/register/', methods=['GET', 'POST'])
 def register():
@@ -89,8 +289,8 @@ def register():
         full_name = request.form['full_name']
         employee_id = request.form['employee_id']
         
-        cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute('SELECT * FROM users WHERE username = %s', (username,))
+        cursor = db.cursor()
+        cursor.execute(USER_QUERY, (username,))
         account = cursor.fetchone()
         
         if account:
@@ -102,7 +302,7 @@ def register():
         elif not username or not password or not email:
             flash('Please fill out the form!', 'danger')
         else:
-            hashed_password = generate_password_hash(password)
+            hashed_password = credentials.hash_password(password)
             cursor.execute('INSERT INTO users (username, email, password) VALUES (%s, %s, %s)', 
                           (username, email, hashed_password))
             user_id = cursor.lastrowid
@@ -113,13 +313,32 @@ def register():
                 VALUES (%s, %s, %s)
             ''', (user_id, employee_id, full_name))
             
-            mysql.connection.commit()
+            db.commit()
+            data_changed('employees')
             flash('You have successfully registered!', 'success')
             return redirect(url_for('login'))
     
     return render_template('register.html')
 
 # Employee Dashboard
+def current_employee_pk():
+    # Internal employees.id, from the session's cached profile
+    return session.get('employee_pk')
+
+DASHBOARD_TODAY_QUERY = 'SELECT * FROM attendance WHERE employee_id = %s AND date = %s'
+
+DASHBOARD_HISTORY_QUERY = '''
+    SELECT * FROM attendance
+    WHERE employee_id = %s
+    ORDER BY date DESC LIMIT 7
+'''
+
+DASHBOARD_MONTHLY_QUERY = '''
+    SELECT * FROM attendance_employee_monthly
+    WHERE employee_id = %s AND month >= %s
+    ORDER BY month DESC
+'''
+
 @app.route('/dashboard/')
 def dashboard():
     if 'loggedin' not in session:
@@ -128,115 +347,438 @@ def dashboard():
     if session['role'] == 'admin':
         return redirect(url_for('admin_dashboard'))
     
+    employee_pk = current_employee_pk()
+    
     # Get today's attendance status
     today = date.today()
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute('''
-        SELECT * FROM attendance 
-        WHERE employee_id = (SELECT id FROM employees WHERE user_id = %s) 
-        AND date = %s
-    ''', (session['id'], today))
+    cursor = db.cursor()
+    cursor.execute(DASHBOARD_TODAY_QUERY, (employee_pk, today))
     today_attendance = cursor.fetchone()
     
     # Get attendance history (last 7 days)
-    cursor.execute('''
-        SELECT * FROM attendance 
-        WHERE employee_id = (SELECT id FROM employees WHERE user_id = %s)
-        ORDER BY date DESC LIMIT 7
-    ''', (session['id'],))
+    cursor.execute(DASHBOARD_HISTORY_QUERY, (employee_pk,))
     attendance_history = cursor.fetchall()
     
+    # Monthly totals (last 6 months) from the rollups
+    cursor.execute(DASHBOARD_MONTHLY_QUERY,
+                   (employee_pk, (today.replace(day=1) - timedelta(days=150)).replace(day=1)))
+    monthly_summary = cursor.fetchall()
+    
     return render_template('dashboard.html', 
                          today_attendance=today_attendance,
-                         attendance_history=attendance_history)
+                         attendance_history=attendance_history,
+                         monthly_summary=monthly_summary)
+
+# One statement per punch: the first one today inserts the row (time in),
+# the second fills time_out, any later one changes nothing. The unique
+# (employee_id, date) key makes concurrent clicks safe. Affected rows tell
+# the cases apart: 1 = inserted, 2 = updated, 0 = unchanged.
+PUNCH_QUERY = '''
+    INSERT INTO attendance (employee_id, date, time_in, status)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE time_out = IF(time_out IS NULL, VALUES(time_in), time_out)
+'''
+
+PUNCH_ACTIONS = {1: 'time_in', 2: 'time_out', 0: 'already_timed_out'}
+
+KIOSK_EMPLOYEE_QUERY = 'SELECT id, full_name, department FROM employees WHERE employee_id = %s'
+
+def record_punch(employee_pk, employee_code, full_name, department):
+    # Dates and times are the department's local ones
+    now = attendance_rules.now(department)
+    current_time = now.time().replace(microsecond=0)
+    status = attendance_rules.status(department, current_time)
+    
+    cursor = db.cursor(MySQLdb.cursors.Cursor)
+    affected = cursor.execute(PUNCH_QUERY, (employee_pk, now.date(), current_time, status))
+    restated = 0
+    if affected:
+        # The row is locked by the upsert; a time out only filled time_out,
+        # and may turn the day into a half-day
+        new_rows = rollups.fetch_rows(db.connection, 'a.employee_id = %s AND a.date = %s',
+                                      (employee_pk, now.date()))
+        old_rows = []
+        if affected == 2:
+            old_rows = [dict(new_rows[0], time_out=None)]
+            restated = rules.update_statuses(db.connection, new_rows, attendance_rules)
+            status = new_rows[0]['status']
+        rollups.apply_changes(db.connection, old_rows, new_rows, attendance_rules)
+        # Last, so the counter row is only locked for the commit
+        data_versions.bump(db.connection, 'attendance', commit=False)
+    db.commit()
+    if affected:
+        # Cached reports of today are also served by id (report_status,
+        # the report files page), so they go even though their name
+        # already carries the data version. Usually no report was written
+        # since the last punch, and this is a stat of the folder.
+        invalidate_report_cache(app.config['UPLOAD_FOLDER'], now.date())
+    
+    # Keep the admin dashboard's counters current without re-aggregating;
+    # cached times are timedeltas, as MySQLdb returns TIME columns
+    if affected == 1:
+        dashboard_cache.record_time_in(now.date(), {
+            'employee_id': employee_code,
+            'full_name': full_name,
+            'date': now.date(),
+            'time_in': rules.since_midnight(current_time),
+            'time_out': None,
+            'status': status,
+        })
+    elif restated:
+        dashboard_cache.invalidate()  # the day's status counts moved
+    elif affected == 2:
+        dashboard_cache.record_time_out(now.date(), employee_code, rules.since_midnight(current_time))
+    return {
+        'action': PUNCH_ACTIONS[affected],
+        'date': now.date().isoformat(),
+        'time': current_time.isoformat(),
+        'status': status if affected else None,
+    }
 
 @app.route('/time_in_out/', methods=['POST'])
 def time_in_out():
     if 'loggedin' not in session or session['role'] == 'admin':
         return redirect(url_for('login'))
     
-    current_time = datetime.now().time()
-    today = date.today()
-    
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    employee_pk = current_employee_pk()
+    if employee_pk is None:
+        flash('Your account is not linked to an employee record!', 'danger')
+        return redirect(url_for('dashboard'))
     
-    # Check if attendance record exists for today
-    cursor.execute('''
-        SELECT * FROM attendance 
-        WHERE employee_id = (SELECT id FROM employees WHERE user_id = %s) 
-        AND date = %s
-    ''', (session['id'], today))
-    attendance = cursor.fetchone()
-    
-    if attendance:
-        # Time out if already timed in
-        if attendance['time_out'] is None:
-            cursor.execute('''
-                UPDATE attendance SET time_out = %s 
-                WHERE id = %s
-            ''', (current_time, attendance['id']))
-            flash('Successfully timed out!', 'success')
-        else:
-            flash('You have already timed out for today!', 'warning')
-    else:
-        # Time in for the first time today
-        # Check if late (after 9:00 AM)
-        status = 'present'
-        if current_time > datetime.strptime('09:00:00', '%H:%M:%S').time():
-            status = 'late'
-        
-        cursor.execute('''
-            INSERT INTO attendance (employee_id, date, time_in, status)
-            VALUES ((SELECT id FROM employees WHERE user_id = %s), %s, %s, %s)
-        ''', (session['id'], today, current_time, status))
+    punch = record_punch(employee_pk, session.get('employee_id'), session.get('full_name'),
+                         session.get('department'))
+    if punch['action'] == 'time_in':
         flash('Successfully timed in!', 'success')
-    
-    mysql.connection.commit()
+    elif punch['action'] == 'time_out':
+        flash('Successfully timed out!', 'success')
+    else:
+        flash('You have already timed out for today!', 'warning')
     return redirect(url_for('dashboard'))
 
-# Admin Routes
-@app.route('/admin/dashboard/')
-def admin_dashboard():
-    if 'loggedin' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
+def kiosk_authorized():
+    token = app.config['KIOSK_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Kiosk-Token', ''), token)
+
+@app.route('/api/time_in_out', methods=['POST'])
+def api_time_in_out():
+    # Kiosks and badge readers send {"employee_id": "<code>"} with the
+    # X-Kiosk-Token header; a logged-in employee can post with no body.
+    if kiosk_authorized():
+        payload = request.get_json(silent=True) or {}
+        employee_code = payload.get('employee_id')
+        if not employee_code:
+            return jsonify(error='employee_id is required'), 400
+        cursor = db.cursor()
+        cursor.execute(KIOSK_EMPLOYEE_QUERY, (employee_code,))
+        employee = cursor.fetchone()
+        if not employee:
+            return jsonify(error='Unknown employee'), 404
+        employee_pk = employee['id']
+        full_name = employee['full_name']
+        department = employee['department']
+    elif 'loggedin' in session and session['role'] != 'admin':
+        employee_code = session.get('employee_id')
+        full_name = session.get('full_name')
+        department = session.get('department')
+        employee_pk = current_employee_pk()
+        if employee_pk is None:
+            return jsonify(error='Account is not linked to an employee record'), 404
+    else:
+        return jsonify(error='Unauthorized'), 401
     
-    today = date.today()
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    punch = record_punch(employee_pk, employee_code, full_name, department)
+    punch['employee_id'] = employee_code
+    return jsonify(punch), 409 if punch['action'] == 'already_timed_out' else 200
+
+# Bulk punch ingestion (badge readers upload buffered events in bursts)
+def import_punches(text, format_type):
+    # Chunks commit one at a time; if a later one fails, the days of the
+    # committed ones are still invalidated before the error propagates
+    committed = set()
+    try:
+        return ingest_events(db.connection, text, format_type, attendance_rules,
+                             app.config['INGEST_CHUNK_SIZE'], on_commit=committed.update)
+    finally:
+        if committed:
+            invalidate_report_cache(app.config['UPLOAD_FOLDER'], *committed)
+            data_changed('attendance')
+
+@app.route('/api/attendance/bulk', methods=['POST'])
+def api_attendance_bulk():
+    if not kiosk_authorized() and not ('loggedin' in session and session['role'] == 'admin'):
+        return jsonify(error='Unauthorized'), 401
     
-    # Get today's attendance summary
-    cursor.execute('''
-        SELECT 
-            COUNT(*) AS total_employees,
-            SUM(CASE WHEN a.id IS NOT NULL THEN 1 ELSE 0 END) AS present_count,
-            SUM(CASE WHEN a.status = 'late' THEN 1 ELSE 0 END) AS late_count,
-            SUM(CASE WHEN a.id IS NULL THEN 1 ELSE 0 END) AS absent_count
-        FROM employees e
-        LEFT JOIN attendance a ON e.id = a.employee_id AND a.date = %s
-    ''', (today,))
+    format_type = 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'ndjson'
+    result = import_punches(request.get_data(as_text=True), format_type)
+    return jsonify(result), 200 if not result['rejected'] else 207
+
+@app.cli.command('import-punches')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format_type', type=click.Choice(['ndjson', 'csv']),
+              help='Defaults to csv for .csv files, ndjson otherwise.')
+def import_punches_command(path, format_type):
+    # flask import-punches events.ndjson
+    if format_type is None:
+        format_type = 'csv' if path.lower().endswith('.csv') else 'ndjson'
+    with open(path, encoding='utf-8') as f:
+        result = import_punches(f.read(), format_type)
+    click.echo(f"{result['received']} events received, {result['accepted']} accepted, "
+               f"{result['days_written']} attendance days written, {len(result['rejected'])} rejected")
+    for reject in result['rejected']:
+        click.echo(f"  line {reject['line']}: {reject['reason']}", err=True)
+
+# Schema commands: flask db upgrade | flask db version | flask db explain
+@app.cli.group('db', help='Database schema migrations and query plan checks.')
+def db_commands():
+    pass
+
+@db_commands.command('upgrade', help='Apply pending schema migrations.')
+@click.option('--target', type=int, help='Stop after this version.')
+def db_upgrade_command(target):
+    applied = migrations.upgrade(db.connection, target, log=click.echo)
+    if migrations.ROLLUPS_VERSION in applied:
+        rebuild_rollups()
+    click.echo(f'Schema at version {migrations.current_version(db.connection)}'
+               + ('' if applied else ' (nothing to apply)'))
+
+@db_commands.command('version', help='Show the applied schema version.')
+def db_version_command():
+    version = migrations.current_version(db.connection)
+    latest = migrations.MIGRATIONS[-1][0]
+    click.echo(f'Schema at version {version} of {latest}')
+
+@db_commands.command('explain', help='EXPLAIN the hot route queries; fails on unindexed full scans.')
+def db_explain_command():
+    queries = migrations.module_queries() + ROUTE_QUERIES
+    problems, warnings = migrations.explain_queries(db.connection, queries)
+    for name, table, detail in warnings:
+        click.echo(f'warning: {name}: {table}: {detail}', err=True)
+    for name, table, detail in problems:
+        click.echo(f'error: {name}: {table}: {detail}', err=True)
+    if problems:
+        raise SystemExit(1)
+    click.echo(f'{len(queries)} queries checked, no unindexed full scans')
+
+# Rollups: flask rollups rebuild [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+def rebuild_rollups(start=None, end=None):
+    first, last = rollups.attendance_span(db.connection)
+    start, end = start or first, end or last
+    if start is None or end is None:
+        click.echo('No attendance to roll up')
+        return
+    archived = []
+    if migrations.current_version(db.connection) >= migrations.ARCHIVE_VERSION:
+        archived = archive.archived_months(db.connection, start, end)
+    months = rollups.backfill(db.connection, start, end, attendance_rules, log=click.echo, skip_months=archived)
+    data_changed('attendance')
+    click.echo(f'Rebuilt rollups for {len(months)} month(s)')
+
+@app.cli.group('rollups', help='Attendance rollup tables.')
+def rollups_commands():
+    pass
+
+@rollups_commands.command('rebuild', help='Recompute rollups from attendance, whole months at a time.')
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']), help='Defaults to the first attendance date.')
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='Defaults to the last attendance date.')
+def rollups_rebuild_command(start, end):
+    rebuild_rollups(start and start.date(), end and end.date())
+
+# Attendance rules in batch (see rules.py):
+#   flask attendance evaluate --start YYYY-MM-DD [--end YYYY-MM-DD]
+#   flask attendance mark-absent [--date YYYY-MM-DD]   (nightly, from cron)
+@app.cli.group('attendance', help='Apply the attendance rules to stored attendance.')
+def attendance_commands():
+    pass
+
+@attendance_commands.command('evaluate', help='Recompute statuses from the current rules, one transaction per month.')
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']), help='Defaults to the first attendance date.')
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='Defaults to the last attendance date.')
+def attendance_evaluate_command(start, end):
+    first, last = rollups.attendance_span(db.connection)
+    start, end = (start and start.date()) or first, (end and end.date()) or last
+    if start is None or end is None:
+        click.echo('No attendance to evaluate')
+        return
+    total = 0
+    changed_dates = set()
+    month = rollups.month_start(start)
+    while month <= end:
+        first_day, last_day = max(month, start), min(rollups.month_end(month), end)
+        try:
+            rows = rollups.fetch_rows(db.connection, 'a.date BETWEEN %s AND %s', (first_day, last_day), lock=True)
+            old_rows = [dict(row) for row in rows]
+            changed = rules.update_statuses(db.connection, rows, attendance_rules)
+            if changed:
+                pairs = [(old, new) for old, new in zip(old_rows, rows) if old['status'] != new['status']]
+                rollups.apply_changes(db.connection, [old for old, _ in pairs], [new for _, new in pairs],
+                                      attendance_rules)
+                changed_dates.update(new['date'] for _, new in pairs)
+            db.commit()
+        except Exception:
+            db.connection.rollback()
+            raise
+        click.echo(f'{month:%Y-%m}: {len(rows)} attendance rows, {changed} status(es) changed')
+        total += changed
+        month = rollups.month_end(month) + timedelta(days=1)
+    if total:
+        invalidate_report_cache(app.config['UPLOAD_FOLDER'], *changed_dates)
+        data_changed('attendance')
+    click.echo(f'{total} status(es) changed')
+
+# Employees with no attendance row for the day get an 'absent' row, in one
+# statement. Departments whose rules do not work that day are skipped, and
+# so are employees hired after it.
+ABSENT_QUERY = """
+    INSERT INTO attendance (employee_id, date, status)
+    SELECT e.id, %s, 'absent'
+    FROM employees e
+    LEFT JOIN attendance a ON a.employee_id = e.id AND a.date = %s
+    WHERE a.id IS NULL AND (e.hire_date IS NULL OR e.hire_date <= %s){departments}
+"""
+
+@attendance_commands.command('mark-absent', help='Insert absent rows for employees with no punch on a working day.')
+@click.option('--date', 'day', type=click.DateTime(['%Y-%m-%d']), help='Defaults to yesterday.')
+def attendance_mark_absent_command(day):
+    day = day.date() if day else date.today() - timedelta(days=1)
+    if archive.is_archived(db.connection, day):
+        raise click.ClickException(f'{day:%Y-%m} is archived; restore it first')
+    default_works, differing = attendance_rules.working_departments(day)
+    if not default_works and not differing:
+        click.echo(f'{day}: not a working day')
+        return
+    departments = ''
+    params = [day, day, day]
+    if differing:
+        placeholders = ', '.join(['%s'] * len(differing))
+        departments = f" AND COALESCE(e.department, '') {'NOT IN' if default_works else 'IN'} ({placeholders})"
+        params += differing
+
+    # Rollups take the inserted rows: absent rows without a time in, after
+    # minus before
+    where = "a.date = %s AND a.status = 'absent' AND a.time_in IS NULL"
+    try:
+        before = {row['employee_id'] for row in rollups.fetch_rows(db.connection, where, (day,), lock=True)}
+        cursor = db.cursor(MySQLdb.cursors.Cursor)
+        inserted = cursor.execute(ABSENT_QUERY.format(departments=departments), params)
+        if inserted:
+            new_rows = [row for row in rollups.fetch_rows(db.connection, where, (day,))
+                        if row['employee_id'] not in before]
+            rollups.apply_changes(db.connection, [], new_rows, attendance_rules)
+        db.commit()
+    except Exception:
+        db.connection.rollback()
+        raise
+    if inserted:
+        invalidate_report_cache(app.config['UPLOAD_FOLDER'], day)
+        data_changed('attendance')
+    click.echo(f'{day}: {inserted} employee(s) marked absent')
+
+# Archive (see archive.py):
+#   flask archive run [--keep-months N]   every closed month older than N months
+#   flask archive month YYYY-MM | flask archive restore YYYY-MM | flask archive list
+def archive_changed(month):
+    days = (rollups.month_end(month) - month).days + 1
+    invalidate_report_cache(app.config['UPLOAD_FOLDER'], *[month + timedelta(days=day) for day in range(days)])
+    data_changed('attendance')
+
+@app.cli.group('archive', help='Move closed attendance months to Parquet files and back.')
+def archive_commands():
+    pass
+
+@archive_commands.command('run', help='Archive every closed month older than the ones kept in MySQL.')
+@click.option('--keep-months', type=int, help='Defaults to ARCHIVE_KEEP_MONTHS.')
+def archive_run_command(keep_months):
+    keep_months = app.config['ARCHIVE_KEEP_MONTHS'] if keep_months is None else keep_months
+    cutoff = rollups.month_start(date.today())
+    for _ in range(keep_months):
+        cutoff = rollups.month_start(cutoff - timedelta(days=1))
+    months = archive.hot_months(db.connection, cutoff)
+    for month in months:
+        count = archive.archive_month(db.connection, app.config['ARCHIVE_FOLDER'], month)
+        archive_changed(month)
+        click.echo(f'{month:%Y-%m}: {count} rows archived')
+    click.echo(f'Archived {len(months)} month(s) before {cutoff:%Y-%m}')
+
+@archive_commands.command('month', help='Archive one closed month.')
+@click.argument('month', type=click.DateTime(['%Y-%m']))
+def archive_month_command(month):
+    try:
+        count = archive.archive_month(db.connection, app.config['ARCHIVE_FOLDER'], month.date())
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    archive_changed(month.date())
+    click.echo(f'{month:%Y-%m}: {count} rows archived')
+
+@archive_commands.command('restore', help='Move an archived month back into the attendance table.')
+@click.argument('month', type=click.DateTime(['%Y-%m']))
+def archive_restore_command(month):
+    try:
+        restored, dropped = archive.restore_month(db.connection, app.config['ARCHIVE_FOLDER'], month.date())
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    archive_changed(month.date())
+    click.echo(f'{month:%Y-%m}: {restored} rows restored'
+               + (f', {dropped} of deleted employees dropped' if dropped else ''))
+
+@archive_commands.command('list', help='Show the archived months.')
+def archive_list_command():
+    rows = archive.archive_status(db.connection)
+    for month, row_count, file_path, archived_at in rows:
+        click.echo(f'{month:%Y-%m}  {row_count:>9} rows  {file_path}  archived {archived_at}')
+    if not rows:
+        click.echo('No archived months')
+
+# Admin Routes
+# Today's attendance summary from the department rollups
+SUMMARY_QUERY = '''
+    SELECT
+        (SELECT COUNT(*) FROM employees) AS total_employees,
+        COALESCE(SUM(days_recorded), 0) AS present_count,
+        COALESCE(SUM(late_count), 0) AS late_count
+    FROM attendance_department_daily
+    WHERE date = %s
+'''
+
+RECENT_QUERY = '''
+    SELECT e.employee_id, e.full_name, a.date, a.time_in, a.time_out, a.status
+    FROM attendance a
+    JOIN employees e ON a.employee_id = e.id
+    ORDER BY a.date DESC, a.time_in DESC
+    LIMIT 10
+'''
+
+def load_dashboard_summary(today):
+    cursor = db.cursor()
+    cursor.execute(SUMMARY_QUERY, (today,))
     today_summary = cursor.fetchone()
+    today_summary['absent_count'] = max(today_summary['total_employees'] - today_summary['present_count'], 0)
     
     # Get recent attendance records
-    cursor.execute('''
-        SELECT e.employee_id, e.full_name, a.date, a.time_in, a.time_out, a.status
-        FROM attendance a
-        JOIN employees e ON a.employee_id = e.id
-        ORDER BY a.date DESC, a.time_in DESC
-        LIMIT 10
-    ''')
+    cursor.execute(RECENT_QUERY)
     recent_attendance = cursor.fetchall()
+    return today_summary, recent_attendance
+
+@app.route('/admin/dashboard/')
+def admin_dashboard():
+    if 'loggedin' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+    
+    today_summary, recent_attendance = dashboard_cache.get(date.today(), load_dashboard_summary)
     
     return render_template('admin_dashboard.html',
                          today_summary=today_summary,
                          recent_attendance=recent_attendance)
 
 # Employee CRUD
+EMPLOYEE_LIST_QUERY = 'SELECT * FROM employees ORDER BY full_name'
+
 @app.route('/admin/employees')
 def manage_employees():
     if 'loggedin' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
     
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute('SELECT * FROM employees ORDER BY full_name')
+    cursor = db.cursor()
+    cursor.execute(EMPLOYEE_LIST_QUERY)
     employees = cursor.fetchall()
     return render_template('manage_employees.html', employees=employees)
 
@@ -255,13 +797,14 @@ def add_employee():
         email = request.form['email']
         address = request.form['address']
         
-        cursor = mysql.connection.cursor()
+        cursor = db.cursor(MySQLdb.cursors.Cursor)
         cursor.execute('''
             INSERT INTO employees 
             (employee_id, full_name, department, position, hire_date, contact_number, email, address)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
         ''', (employee_id, full_name, department, position, hire_date, contact_number, email, address))
-        mysql.connection.commit()
+        db.commit()
+        data_changed('employees')
         flash('Employee added successfully!', 'success')
         return redirect(url_for('manage_employees'))
     
@@ -272,7 +815,7 @@ def edit_employee(id):
     if 'loggedin' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
     
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    cursor = db.cursor()
     
     if request.method == 'POST':
         employee_id = request.form['employee_id']
@@ -284,6 +827,13 @@ def edit_employee(id):
         email = request.form['email']
         address = request.form['address']
         
+        # A department change moves the employee's days between department rollups
+        cursor.execute('SELECT department, user_id FROM employees WHERE id = %s FOR UPDATE', (id,))
+        current = cursor.fetchone()
+        moved = current is not None and (current['department'] or '') != department
+        if moved:
+            old_rows = rollups.fetch_rows(db.connection, 'a.employee_id = %s', (id,), lock=True)
+        
         cursor.execute('''
             UPDATE employees SET
             employee_id = %s,
@@ -296,7 +846,13 @@ def edit_employee(id):
             address = %s
             WHERE id = %s
         ''', (employee_id, full_name, department, position, hire_date, contact_number, email, address, id))
-        mysql.connection.commit()
+        if moved:
+            new_rows = rollups.fetch_rows(db.connection, 'a.employee_id = %s', (id,))
+            rollups.apply_changes(db.connection, old_rows, new_rows, attendance_rules)
+        db.commit()
+        data_changed('employees')
+        if current is not None:
+            app.session_interface.invalidate_profile(current['user_id'])
         flash('Employee updated successfully!', 'success')
         return redirect(url_for('manage_employees'))
     
@@ -309,33 +865,273 @@ def delete_employee(id):
     if 'loggedin' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
     
-    cursor = mysql.connection.cursor()
+    # Attendance goes with the employee (ON DELETE CASCADE), so take it out
+    # of the department rollups first
+    old_rows = rollups.fetch_rows(db.connection, 'a.employee_id = %s', (id,), lock=True)
+    rollups.apply_changes(db.connection, old_rows, [], attendance_rules)
+    cursor = db.cursor()
+    cursor.execute('SELECT user_id FROM employees WHERE id = %s', (id,))
+    employee = cursor.fetchone()
     cursor.execute('DELETE FROM employees WHERE id = %s', (id,))
-    mysql.connection.commit()
+    db.commit()
+    data_changed('employees', 'attendance')
+    if employee is not None:
+        app.session_interface.invalidate_profile(employee['user_id'])
     flash('Employee deleted successfully!', 'success')
     return redirect(url_for('manage_employees'))
 
+# Bulk employee import / export
+def employee_file_format(filename):
+    return 'excel' if filename.lower().endswith(('.xlsx', '.xls')) else 'csv'
+
+def run_employee_import(data, format_type, dry_run=False):
+    result = import_employees(db.connection, data, format_type, attendance_rules,
+                              app.config['EMPLOYEE_IMPORT_CHUNK_SIZE'], app.config['PASSWORD_HASH_WORKERS'],
+                              app.config['PASSWORD_HASH_METHOD'], dry_run)
+    if not dry_run:
+        data_changed('employees')
+        # Imports can rename employees or link them to logins
+        app.session_interface.clear_profiles()
+    return result
+
+@app.route('/admin/employees/import', methods=['POST'])
+def import_employees_upload():
+    if 'loggedin' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+    
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    upload = request.files.get('file')
+    if upload is None or upload.filename == '':
+        if wants_json:
+            return jsonify(error='No file uploaded'), 400
+        flash('Choose a CSV or XLSX file to import', 'danger')
+        return redirect(url_for('manage_employees'))
+    
+    dry_run = bool(request.form.get('dry_run'))
+    try:
+        result = run_employee_import(upload.read(), employee_file_format(upload.filename), dry_run)
+    except ValueError as e:
+        if wants_json:
+            return jsonify(error=str(e)), 400
+        flash(f'Import failed: {e}', 'danger')
+        return redirect(url_for('manage_employees'))
+    
+    if wants_json:
+        return jsonify(result), 200 if not result['rejected'] else 207
+    summary = (f"{result['inserted']} added, {result['updated']} updated, {result['unchanged']} unchanged, "
+               f"{result['accounts_created']} logins created, {len(result['rejected'])} rejected")
+    flash(('Dry run: ' if dry_run else 'Import finished: ') + summary, 'warning' if result['rejected'] else 'success')
+    for reject in result['rejected'][:10]:
+        flash(f"Line {reject['line']}: {reject['reason']}", 'danger')
+    return redirect(url_for('manage_employees'))
+
+@app.route('/admin/employees/export')
+def export_employees():
+    if 'loggedin' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+    
+    filename = f"employees_{date.today():%Y%m%d}"
+    if request.args.get('format') == 'excel':
+        # xlsxwriter's constant_memory mode flushes rows to temp files
+        output = tempfile.TemporaryFile()
+        write_export_excel(db.connection, output, app.config['EMPLOYEE_IMPORT_CHUNK_SIZE'])
+        output.seek(0)
+        return send_file(output, as_attachment=True, download_name=filename + '.xlsx',
+                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    
+    return Response(stream_with_context(iter_export_csv(db.connection, app.config['EMPLOYEE_IMPORT_CHUNK_SIZE'])),
+                    mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}.csv'})
+
+@app.cli.command('import-employees')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format_type', type=click.Choice(['csv', 'excel']),
+              help='Defaults to excel for .xlsx files, csv otherwise.')
+@click.option('--dry-run', is_flag=True, help='Validate and diff only; write nothing.')
+def import_employees_command(path, format_type, dry_run):
+    # flask import-employees staff.csv
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        result = run_employee_import(data, format_type or employee_file_format(path), dry_run)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{result['received']} rows received, {result['inserted']} inserted, {result['updated']} updated, "
+               f"{result['unchanged']} unchanged, {result['accounts_created']} logins created, "
+               f"{len(result['rejected'])} rejected{' (dry run)' if dry_run else ''}")
+    for reject in result['rejected']:
+        click.echo(f"  line {reject['line']}: {reject['reason']}", err=True)
+
+@app.cli.command('export-employees')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+def export_employees_command(path):
+    # flask export-employees staff.csv (or staff.xlsx)
+    chunk_size = app.config['EMPLOYEE_IMPORT_CHUNK_SIZE']
+    if employee_file_format(path) == 'excel':
+        write_export_excel(db.connection, path, chunk_size)
+    else:
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            for text in iter_export_csv(db.connection, chunk_size):
+                f.write(text)
+    click.echo(f'Exported employees to {path}')
+
 # Attendance CRUD (Admin)
+def parse_attendance_cursor(value):
+    # Cursor format: "<date>_<time_in or empty>_<id>"
+    try:
+        cursor_date, cursor_time, cursor_id = value.split('_')
+        datetime.strptime(cursor_date, '%Y-%m-%d')
+        if cursor_time:
+            datetime.strptime(cursor_time, '%H:%M:%S')
+        return cursor_date, cursor_time or None, int(cursor_id)
+    except ValueError:
+        return None
+
+app.add_template_filter(format_time, 'format_time')
+
+def make_attendance_cursor(record):
+    return f"{record['date']}_{format_time(record['time_in']) or ''}_{record['id']}"
+
+def attendance_seek_condition(cursor_value, forward=True):
+    # Rows strictly past the cursor in ORDER BY date DESC, time_in DESC, id DESC
+    # (forward) or strictly before it (backward). A NULL time_in sorts lowest.
+    cursor_date, cursor_time, cursor_id = cursor_value
+    if forward:
+        if cursor_time is None:
+            same_day = 'a.time_in IS NULL AND a.id < %s'
+            params = [cursor_id]
+        else:
+            same_day = 'a.time_in < %s OR a.time_in IS NULL OR (a.time_in = %s AND a.id < %s)'
+            params = [cursor_time, cursor_time, cursor_id]
+        condition = f'(a.date < %s OR (a.date = %s AND ({same_day})))'
+    else:
+        if cursor_time is None:
+            same_day = 'a.time_in IS NOT NULL OR a.id > %s'
+            params = [cursor_id]
+        else:
+            same_day = 'a.time_in > %s OR (a.time_in = %s AND a.id > %s)'
+            params = [cursor_time, cursor_time, cursor_id]
+        condition = f'(a.date > %s OR (a.date = %s AND ({same_day})))'
+    return condition, [cursor_date, cursor_date] + params
+
+# {where}: filters and the seek condition; {order}: DESC forward, ASC back
+ATTENDANCE_PAGE_QUERY = '''
+    SELECT a.*, e.employee_id, e.full_name
+    FROM attendance a
+    JOIN employees e ON a.employee_id = e.id
+    {where}
+    ORDER BY a.date {order}, a.time_in {order}, a.id {order}
+    LIMIT %s
+'''
+
+EMPLOYEE_OPTIONS_QUERY = 'SELECT id, employee_id, full_name FROM employees ORDER BY full_name'
+
+DEPARTMENTS_QUERY = '''
+    SELECT DISTINCT department FROM employees
+    WHERE department IS NOT NULL AND department <> ''
+    ORDER BY department
+'''
+
 @app.route('/admin/attendance')
 def manage_attendance():
     if 'loggedin' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
     
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute('''
-        SELECT a.*, e.employee_id, e.full_name 
-        FROM attendance a
-        JOIN employees e ON a.employee_id = e.id
-        ORDER BY a.date DESC, a.time_in DESC
-    ''')
-    attendance_records = cursor.fetchall()
-    
-    cursor.execute('SELECT id, employee_id, full_name FROM employees ORDER BY full_name')
+    page_size = app.config['ATTENDANCE_PAGE_SIZE']
+    filters = {
+        'employee': request.args.get('employee', type=int),
+        'department': request.args.get('department') or None,
+        'status': request.args.get('status') or None,
+        'date_from': request.args.get('date_from') or None,
+        'date_to': request.args.get('date_to') or None,
+    }
+    if filters['status'] not in app.config['ATTENDANCE_STATUSES']:
+        filters['status'] = None
+    for key in ('date_from', 'date_to'):
+        try:
+            filters[key] = filters[key] and date.fromisoformat(filters[key]).isoformat()
+        except ValueError:
+            filters[key] = None
+    
+    # Filters go into the WHERE clause so only one page is ever read
+    conditions = []
+    params = []
+    if filters['employee']:
+        conditions.append('a.employee_id = %s')
+        params.append(filters['employee'])
+    if filters['department']:
+        conditions.append('e.department = %s')
+        params.append(filters['department'])
+    if filters['status']:
+        conditions.append('a.status = %s')
+        params.append(filters['status'])
+    if filters['date_from']:
+        conditions.append('a.date >= %s')
+        params.append(filters['date_from'])
+    if filters['date_to']:
+        conditions.append('a.date <= %s')
+        params.append(filters['date_to'])
+    
+    after = parse_attendance_cursor(request.args.get('after', ''))
+    before = None if after else parse_attendance_cursor(request.args.get('before', ''))
+    if after or before:
+        condition, cursor_params = attendance_seek_condition(after or before, forward=bool(after))
+        conditions.append(condition)
+        params.extend(cursor_params)
+    
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    order = 'ASC' if before else 'DESC'
+    
+    cursor = db.cursor()
+    cursor.execute(ATTENDANCE_PAGE_QUERY.format(where=where, order=order), params + [page_size + 1])
+    attendance_records = list(cursor.fetchall())
+    
+    # Archived months can only hold rows for this page if they reach past
+    # the cursor and, when MySQL filled the page, up to its last row
+    months = archive.archived_months(db.connection, filters['date_from'] or date.min, filters['date_to'] or date.max)
+    seek = after or before
+    boundary = attendance_records[page_size]['date'] if len(attendance_records) > page_size else None
+    if before:
+        months = [month for month in months
+                  if rollups.month_end(month) >= date.fromisoformat(seek[0])
+                  and (boundary is None or month <= boundary)]
+    else:
+        months = [month for month in months
+                  if (seek is None or month <= date.fromisoformat(seek[0]))
+                  and (boundary is None or rollups.month_end(month) >= boundary)]
+    if months:
+        archived = archive.listing_rows(db.connection, app.config['ARCHIVE_FOLDER'], months, filters, seek,
+                                        forward=not before, limit=page_size + 1)
+        attendance_records = sorted(attendance_records + archived, key=archive.listing_key,
+                                    reverse=not before)[:page_size + 1]
+    
+    # The extra row only tells us whether there is another page that way
+    has_more = len(attendance_records) > page_size
+    attendance_records = attendance_records[:page_size]
+    if before:
+        attendance_records.reverse()
+    
+    next_cursor = prev_cursor = None
+    if attendance_records:
+        if has_more or before:
+            next_cursor = make_attendance_cursor(attendance_records[-1])
+        if after or (before and has_more):
+            prev_cursor = make_attendance_cursor(attendance_records[0])
+    
+    cursor.execute(EMPLOYEE_OPTIONS_QUERY)
     employees = cursor.fetchall()
     
+    cursor.execute(DEPARTMENTS_QUERY)
+    departments = [row['department'] for row in cursor.fetchall()]
+    
     return render_template('manage_attendance.html', 
                          attendance_records=attendance_records,
-                         employees=employees)
+                         employees=employees,
+                         departments=departments,
+                         statuses=app.config['ATTENDANCE_STATUSES'],
+                         filters={key: value for key, value in filters.items() if value},
+                         next_cursor=next_cursor,
+                         prev_cursor=prev_cursor)
 
 @app.route('/admin/attendance/add', methods=['POST'])
 def add_attendance():
@@ -343,38 +1139,59 @@ def add_attendance():
         return redirect(url_for('login'))
     
     employee_id = request.form['employee_id']
-    date = request.form['date']
     time_in = request.form['time_in']
     time_out = request.form['time_out']
     status = request.form['status']
     notes = request.form['notes']
+    try:
+        day = date.fromisoformat(request.form['date'])
+    except ValueError:
+        flash('Invalid date!', 'danger')
+        return redirect_back('manage_attendance')
     
-    cursor = mysql.connection.cursor()
+    if archive.is_archived(db.connection, day):
+        flash(f'{day:%Y-%m} is archived; restore it before adding attendance to it.', 'danger')
+        return redirect_back('manage_attendance')
+    
+    cursor = db.cursor(MySQLdb.cursors.Cursor)
     try:
         cursor.execute('''
             INSERT INTO attendance 
             (employee_id, date, time_in, time_out, status, notes)
             VALUES (%s, %s, %s, %s, %s, %s)
-        ''', (employee_id, date, time_in, time_out, status, notes))
-        mysql.connection.commit()
+        ''', (employee_id, day, time_in, time_out, status, notes))
+        new_rows = rollups.fetch_rows(db.connection, 'a.id = %s', (cursor.lastrowid,))
+        rollups.apply_changes(db.connection, [], new_rows, attendance_rules)
+        db.commit()
+        invalidate_report_cache(app.config['UPLOAD_FOLDER'], day)
+        data_changed('attendance')
         flash('Attendance record added successfully!', 'success')
     except MySQLdb.IntegrityError:
         flash('Attendance record for this employee and date already exists!', 'danger')
     
-    return redirect(url_for('manage_attendance'))
+    return redirect_back('manage_attendance')
 
 @app.route('/admin/attendance/edit/<int:id>', methods=['POST'])
 def edit_attendance(id):
     if 'loggedin' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
     
-    date = request.form['date']
     time_in = request.form['time_in']
     time_out = request.form['time_out']
     status = request.form['status']
     notes = request.form['notes']
+    try:
+        day = date.fromisoformat(request.form['date'])
+    except ValueError:
+        flash('Invalid date!', 'danger')
+        return redirect_back('manage_attendance')
     
-    cursor = mysql.connection.cursor()
+    if archive.is_archived(db.connection, day):
+        flash(f'{day:%Y-%m} is archived; restore it before moving attendance into it.', 'danger')
+        return redirect_back('manage_attendance')
+    
+    old_rows = rollups.fetch_rows(db.connection, 'a.id = %s', (id,), lock=True)
+    cursor = db.cursor(MySQLdb.cursors.Cursor)
     cursor.execute('''
         UPDATE attendance SET
         date = %s,
@@ -383,23 +1200,260 @@ def edit_attendance(id):
         status = %s,
         notes = %s
         WHERE id = %s
-    ''', (date, time_in, time_out, status, notes, id))
-    mysql.connection.commit()
+    ''', (day, time_in, time_out, status, notes, id))
+    new_rows = rollups.fetch_rows(db.connection, 'a.id = %s', (id,))
+    rollups.apply_changes(db.connection, old_rows, new_rows, attendance_rules)
+    db.commit()
+    invalidate_report_cache(app.config['UPLOAD_FOLDER'], day, *[row['date'] for row in old_rows])
+    data_changed('attendance')
     flash('Attendance record updated successfully!', 'success')
-    return redirect(url_for('manage_attendance'))
+    return redirect_back('manage_attendance')
 
 @app.route('/admin/attendance/delete/<int:id>', methods=['POST'])
 def delete_attendance(id):
     if 'loggedin' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
     
-    cursor = mysql.connection.cursor()
+    old_rows = rollups.fetch_rows(db.connection, 'a.id = %s', (id,), lock=True)
+    cursor = db.cursor(MySQLdb.cursors.Cursor)
     cursor.execute('DELETE FROM attendance WHERE id = %s', (id,))
-    mysql.connection.commit()
+    rollups.apply_changes(db.connection, old_rows, [], attendance_rules)
+    db.commit()
+    invalidate_report_cache(app.config['UPLOAD_FOLDER'], *[row['date'] for row in old_rows])
+    data_changed('attendance')
     flash('Attendance record deleted successfully!', 'success')
-    return redirect(url_for('manage_attendance'))
+    return redirect_back('manage_attendance')
+
+# Bulk changes from the listing (see attendance_bulk.py). They answer with
+# JSON describing the changed rows, which script.js patches into the table.
+def bulk_attendance_response(result):
+    invalidate_report_cache(app.config['UPLOAD_FOLDER'], *result['dates'])
+    if result['affected']:
+        data_changed('attendance')
+    return jsonify(batch=result['batch'], action=result['action'], affected=result['affected'],
+                   rows=[api_record(row) for row in result['rows']])
+
+def bulk_attendance_ids():
+    # -> (ids, None) or (None, error response)
+    try:
+        ids = [int(value) for value in request.form.getlist('ids')]
+    except ValueError:
+        return None, (jsonify(error='ids must be attendance record ids'), 400)
+    if not ids:
+        return None, (jsonify(error='No attendance records selected'), 400)
+    if len(ids) > app.config['ATTENDANCE_BULK_MAX_ROWS']:
+        return None, (jsonify(error=f"Select at most {app.config['ATTENDANCE_BULK_MAX_ROWS']} records at a time"), 400)
+    return ids, None
+
+@app.route('/admin/attendance/bulk/delete', methods=['POST'])
+def bulk_delete_attendance():
+    denied = api_admin_only()
+    if denied:
+        return denied
+    ids, error = bulk_attendance_ids()
+    if error:
+        return error
+    return bulk_attendance_response(
+        attendance_bulk.delete_rows(db.connection, ids, session['id'], attendance_rules))
+
+@app.route('/admin/attendance/bulk/status', methods=['POST'])
+def bulk_status_attendance():
+    denied = api_admin_only()
+    if denied:
+        return denied
+    ids, error = bulk_attendance_ids()
+    if error:
+        return error
+    status = request.form.get('status')
+    if status not in app.config['ATTENDANCE_STATUSES']:
+        return jsonify(error='Unknown status'), 400
+    return bulk_attendance_response(
+        attendance_bulk.set_status(db.connection, ids, status, session['id'], attendance_rules))
+
+@app.route('/admin/attendance/bulk/correct', methods=['POST'])
+def correct_attendance():
+    # Everyone in one department on one date; blank fields are left alone
+    denied = api_admin_only()
+    if denied:
+        return denied
+    department = request.form.get('department', '')
+    status = request.form.get('status') or None
+    fields = {field: request.form.get(field) or None for field in ('time_in', 'time_out', 'notes')}
+    try:
+        day = date.fromisoformat(request.form.get('date', ''))
+        for field in ('time_in', 'time_out'):
+            if fields[field]:
+                time.fromisoformat(fields[field])
+    except ValueError:
+        return jsonify(error='A valid date and HH:MM times are required'), 400
+    if status is not None and status not in app.config['ATTENDANCE_STATUSES']:
+        return jsonify(error='Unknown status'), 400
+    if status is None and not any(fields.values()):
+        return jsonify(error='Nothing to correct'), 400
+    if archive.is_archived(db.connection, day):
+        return jsonify(error=f'{day:%Y-%m} is archived; restore it first'), 409
+    return bulk_attendance_response(attendance_bulk.correct_department(
+        db.connection, department, day, session['id'], attendance_rules, status=status, **fields))
 
 # Reports
+def report_db_config():
+    # Connection settings for report workers, which run outside Flask
+    return dict(db.pool.connect_args)
+
+def get_report_executor():
+    global report_executor
+    if report_executor is None:
+        report_executor = ProcessPoolExecutor(max_workers=app.config['REPORT_WORKERS'],
+                                              mp_context=multiprocessing.get_context('spawn'))
+    return report_executor
+
+def report_job_finished(report_id, future):
+    global report_executor
+    error = future.exception()
+    if error is None:
+        evict_report_cache(app.config['UPLOAD_FOLDER'], app.config['REPORT_CACHE_MAX_BYTES'])
+        return
+    if isinstance(error, BrokenProcessPool):
+        with report_jobs_lock:
+            report_executor = None
+    # No-op if the worker already marked the job as failed
+    fail_report_job(report_db_config(), report_id, repr(error))
+
+LIVE_REPORT_QUERY = '''
+    SELECT id FROM reports
+    WHERE file_path = %s AND status IN ('queued', 'running')
+    AND created_at > NOW() - INTERVAL %s SECOND
+    ORDER BY id DESC LIMIT 1
+'''
+
+def live_report_job(filepath):
+    # Id of a queued or running job rendering `filepath`, or None
+    cursor = db.cursor()
+    cursor.execute(LIVE_REPORT_QUERY, (filepath, app.config['REPORT_JOB_TIMEOUT']))
+    existing = cursor.fetchone()
+    return existing['id'] if existing else None
+
+def enqueue_report(report_type, format_type, start_date, end_date, filepath, group_by=None):
+    # Identical requests share the job that is already queued or running. The
+    # cache path encodes report type, format, date range and options.
+    with report_jobs_lock:
+        existing = live_report_job(filepath)
+        if existing:
+            return existing
+        
+        cursor = db.cursor()
+        cursor.execute('''
+            INSERT INTO reports (report_type, format, start_date, end_date, status, generated_by, file_path)
+            VALUES (%s, %s, %s, %s, 'queued', %s, %s)
+        ''', (report_type, format_type, start_date, end_date, session['id'], filepath))
+        report_id = cursor.lastrowid
+        db.commit()
+        
+        future = get_report_executor().submit(
+            run_report_job, report_db_config(), report_id, app.config['REPORT_TYPES'][report_type],
+            format_type, start_date, end_date, filepath, app.config['REPORT_CHUNK_SIZE'], group_by,
+            app.config['ARCHIVE_FOLDER'])
+    future.add_done_callback(functools.partial(report_job_finished, report_id))
+    return report_id
+
+def stream_csv_report(report_id, filepath, start_date, end_date):
+    # Every chunk goes to the client and to the report file as it is produced;
+    # the file only takes its final name once the whole report is written.
+    partial_path = filepath + '.part'
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    
+    def flush(f):
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        f.write(chunk)
+        return chunk
+    
+    chunks = iter_report_rows(db.connection, start_date, end_date, app.config['REPORT_CHUNK_SIZE'],
+                              app.config['ARCHIVE_FOLDER'])
+    try:
+        with open(partial_path, 'w', newline='', encoding='utf-8') as f:
+            # The header goes out before the query runs, keeping first byte fast
+            writer.writerow(REPORT_COLUMNS)
+            yield flush(f)
+            for rows in chunks:
+                writer.writerows(report_row_values(row) for row in rows)
+                yield flush(f)
+        os.replace(partial_path, filepath)
+    except BaseException as e:
+        # Release the unbuffered cursor before the connection is reused
+        chunks.close()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        set_report_status(db.connection, report_id, 'failed', repr(e))
+        raise
+    set_report_status(db.connection, report_id, 'done')
+    evict_report_cache(app.config['UPLOAD_FOLDER'], app.config['REPORT_CACHE_MAX_BYTES'])
+
+# Scheduled reports, run by cron off-peak, e.g.
+#   30 2 * * *  cd /srv/attendance && flask reports schedule
+# `schedule` renders the last closed day, week and month of REPORT_TYPES in
+# every REPORT_SCHEDULE_FORMATS format, in this process and one at a time,
+# then applies the retention policy. The files go into the report cache
+# under the names generate_report looks up, so the admin's download (the
+# "Previous" period or the report files page) is a cache hit. Current
+# periods are not pre-rendered: the first punch of the day invalidates them.
+def apply_retention():
+    return apply_report_retention(db.connection, app.config['UPLOAD_FOLDER'], app.config['REPORT_RETENTION_DAYS'],
+                                  app.config['REPORT_CACHE_MAX_BYTES'], app.config['REPORT_JOB_TIMEOUT'])
+
+@app.cli.group('reports', help='Scheduled reports and report file retention.')
+def report_commands():
+    pass
+
+@report_commands.command('schedule', help='Pre-render the last closed period of every report type.')
+@click.option('--date', 'day', type=click.DateTime(['%Y-%m-%d']),
+              help='Render the periods that closed before this day; defaults to today.')
+def report_schedule_command(day):
+    day = day.date() if day else date.today()
+    failed = 0
+    for report_type, title in app.config['REPORT_TYPES'].items():
+        period = previous_period(report_type, day)
+        if period is None:
+            continue
+        start_date, end_date = period
+        data_version = fetch_data_version(db.connection, start_date, end_date)
+        for format_type in app.config['REPORT_SCHEDULE_FORMATS']:
+            filepath = report_cache_path(app.config['UPLOAD_FOLDER'], report_type, format_type,
+                                         start_date, end_date, data_version)
+            label = f'{report_type} {format_type} {start_date} to {end_date}'
+            if touch_report(filepath) or live_report_job(filepath):
+                click.echo(f'{label}: up to date')
+                continue
+            cursor = db.cursor(MySQLdb.cursors.Cursor)
+            cursor.execute('''
+                INSERT INTO reports (report_type, format, start_date, end_date, status, generated_by, file_path)
+                VALUES (%s, %s, %s, %s, 'queued', NULL, %s)
+            ''', (report_type, format_type, start_date, end_date, filepath))
+            report_id = cursor.lastrowid
+            db.commit()
+            cursor.close()
+            try:
+                run_report_job(report_db_config(), report_id, title, format_type, start_date, end_date, filepath,
+                               app.config['REPORT_CHUNK_SIZE'], None, app.config['ARCHIVE_FOLDER'])
+            except Exception as e:
+                # No-op if the job already marked itself as failed
+                fail_report_job(report_db_config(), report_id, repr(e))
+                failed += 1
+                click.echo(f'{label}: failed: {e}', err=True)
+                continue
+            click.echo(f'{label}: rendered ({os.path.getsize(filepath)} bytes)')
+    files, rows = apply_retention()
+    click.echo(f'Retention: {files} file(s) and {rows} report row(s) removed')
+    if failed:
+        raise click.ClickException(f'{failed} report(s) failed')
+
+@report_commands.command('prune', help='Apply the retention policy to report files and report rows.')
+def report_prune_command():
+    files, rows = apply_retention()
+    click.echo(f'{files} file(s) and {rows} report row(s) removed')
+
 @app.route('/admin/reports/')
 def reports():
     if 'loggedin' not in session or session['role'] != 'admin':
@@ -414,160 +1468,285 @@ def generate_report():
     
     report_type = request.form['report_type']
     format_type = request.form['format']
-    start_date = request.form.get('start_date')
-    end_date = request.form.get('end_date')
+    group_by = request.form.get('group_by') if format_type == 'pdf' else None
     
-    cursor = mysql.connection.cursor(MySQLdb.cursors.DictCursor)
+    if report_type not in app.config['REPORT_TYPES'] or format_type not in REPORT_EXTENSIONS:
+        flash('Unknown report type or format!', 'danger')
+        return redirect(url_for('reports'))
     
     # Determine date range based on report type
-    if report_type == 'daily':
-        report_date = date.today()
-        start_date = report_date
-        end_date = report_date
-    elif report_type == 'weekly':
-        today = date.today()
-        start_date = today - timedelta(days=today.weekday())
-        end_date = start_date + timedelta(days=6)
-    elif report_type == 'monthly':
-        today = date.today()
-        start_date = date(today.year, today.month, 1)
-        end_date = date(today.year, today.month + 1, 1) - timedelta(days=1)
-    
-    # Get attendance data
-    cursor.execute('''
-        SELECT e.employee_id, e.full_name, e.department, 
-               a.date, a.time_in, a.time_out, a.status
-        FROM attendance a
-        JOIN employees e ON a.employee_id = e.id
-        WHERE a.date BETWEEN %s AND %s
-        ORDER BY e.full_name, a.date
-    ''', (start_date, end_date))
-    attendance_data = cursor.fetchall()
-    
-    # Get summary data
-    cursor.execute('''
-        SELECT 
-            COUNT(DISTINCT e.id) AS total_employees,
-            COUNT(DISTINCT a.employee_id) AS present_employees,
-            SUM(CASE WHEN a.status = 'late' THEN 1 ELSE 0 END) AS late_count,
-            SUM(CASE WHEN a.status = 'absent' THEN 1 ELSE 0 END) AS absent_count,
-            SUM(CASE WHEN a.status = 'half-day' THEN 1 ELSE 0 END) AS half_day_count
-        FROM employees e
-        LEFT JOIN attendance a ON e.id = a.employee_id AND a.date BETWEEN %s AND %s
-    ''', (start_date, end_date))
-    summary_data = cursor.fetchone()
-    
-    # Generate report based on format
-    if format_type == 'excel':
-        # Create DataFrame
-        df = pd.DataFrame(attendance_data)
-        
-        # Create summary DataFrame
-        summary_df = pd.DataFrame([summary_data])
-        
-        # Create Excel file in memory
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Attendance Details', index=False)
-            summary_df.to_excel(writer, sheet_name='Summary', index=False)
-        
-        output.seek(0)
-        
-        # Save report record
-        filename = f"attendance_report_{report_type}_{date.today()}.xlsx"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        with open(filepath, 'wb') as f:
-            f.write(output.getbuffer())
-        
+    start_date, end_date = report_date_range(report_type,
+                                             request.form.get('start_date'),
+                                             request.form.get('end_date'),
+                                             request.form.get('period', 'current'))
+    
+    # Unchanged data since an identical report was rendered: serve that file
+    data_version = fetch_data_version(db.connection, start_date, end_date)
+    group_by = group_by if group_by in PDF_GROUPS else None
+    filepath = report_cache_path(app.config['UPLOAD_FOLDER'], report_type, format_type,
+                                 start_date, end_date, data_version, group_by or '')
+    filename = f"attendance_report_{report_type}_{start_date}_{end_date}.{REPORT_EXTENSIONS[format_type]}"
+    if touch_report(filepath):
+        cursor = db.cursor(MySQLdb.cursors.Cursor)
         cursor.execute('''
-            INSERT INTO reports (report_type, generated_by, file_path)
-            VALUES (%s, %s, %s)
-        ''', (report_type, session['id'], filepath))
-        mysql.connection.commit()
-        
+            INSERT INTO reports (report_type, format, start_date, end_date, status, generated_by, file_path, completed_at)
+            VALUES (%s, %s, %s, %s, 'done', %s, %s, NOW())
+        ''', (report_type, format_type, start_date, end_date, session['id'], filepath))
+        db.commit()
         return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            filepath,
+            mimetype=REPORT_MIMETYPES[format_type],
             as_attachment=True,
             download_name=filename
         )
     
-    elif format_type == 'pdf':
-        # Create PDF
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        
-        # Report title
-        pdf.cell(200, 10, txt=app.config['REPORT_TYPES'][report_type], ln=1, align='C')
-        pdf.cell(200, 10, txt=f"Date Range: {start_date} to {end_date}", ln=1, align='C')
-        pdf.ln(10)
-        
-        # Summary section
-        pdf.set_font("Arial", 'B', size=12)
-        pdf.cell(200, 10, txt="Summary", ln=1)
-        pdf.set_font("Arial", size=10)
-        
-        pdf.cell(100, 10, txt=f"Total Employees: {summary_data['total_employees']}", ln=1)
-        pdf.cell(100, 10, txt=f"Present Employees: {summary_data['present_employees']}", ln=1)
-        pdf.cell(100, 10, txt=f"Late Count: {summary_data['late_count']}", ln=1)
-        pdf.cell(100, 10, txt=f"Absent Count: {summary_data['absent_count']}", ln=1)
-        pdf.cell(100, 10, txt=f"Half-Day Count: {summary_data['half_day_count']}", ln=1)
-        pdf.ln(10)
-        
-        # Details section
-        pdf.set_font("Arial", 'B', size=12)
-        pdf.cell(200, 10, txt="Attendance Details", ln=1)
-        pdf.set_font("Arial", size=10)
-        
-        # Table header
-        pdf.cell(30, 10, txt="Employee ID", border=1)
-        pdf.cell(40, 10, txt="Name", border=1)
-        pdf.cell(30, 10, txt="Date", border=1)
-        pdf.cell(30, 10, txt="Time In", border=1)
-        pdf.cell(30, 10, txt="Time Out", border=1)
-        pdf.cell(30, 10, txt="Status", border=1, ln=1)
-        
-        # Table rows
-        for row in attendance_data:
-            pdf.cell(30, 10, txt=row['employee_id'], border=1)
-            pdf.cell(40, 10, txt=row['full_name'], border=1)
-            pdf.cell(30, 10, txt=str(row['date']), border=1)
-            pdf.cell(30, 10, txt=str(row['time_in'] or ''), border=1)
-            pdf.cell(30, 10, txt=str(row['time_out'] or ''), border=1)
-            pdf.cell(30, 10, txt=row['status'], border=1, ln=1)
-        
-        # Save PDF to file
-        filename = f"attendance_report_{report_type}_{date.today()}.pdf"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        pdf.output(filepath)
-        
-        # Save report record
+    # CSV is streamed straight from the database, so it stays in the request
+    if format_type == 'csv':
+        # Record the report before streaming starts; the connection is busy
+        # with the unbuffered cursor until the last row has been sent
+        cursor = db.cursor(MySQLdb.cursors.Cursor)
         cursor.execute('''
-            INSERT INTO reports (report_type, generated_by, file_path)
-            VALUES (%s, %s, %s)
-        ''', (report_type, session['id'], filepath))
-        mysql.connection.commit()
+            INSERT INTO reports (report_type, format, start_date, end_date, status, generated_by, file_path)
+            VALUES (%s, %s, %s, %s, 'running', %s, %s)
+        ''', (report_type, format_type, start_date, end_date, session['id'], filepath))
+        report_id = cursor.lastrowid
+        db.commit()
+        cursor.close()
         
+        return Response(
+            stream_with_context(stream_csv_report(report_id, filepath, start_date, end_date)),
+            mimetype=REPORT_MIMETYPES['csv'],
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    
+    # Excel and PDF are rendered by the worker pool; the browser polls for them
+    report_id = enqueue_report(report_type, format_type, start_date, end_date, filepath, group_by)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(id=report_id, status_url=url_for('report_status', id=report_id)), 202
+    return redirect(url_for('report_status', id=report_id))
+
+# One entry per file still on disk, through its newest `reports` row
+REPORT_FILES_QUERY = '''
+    SELECT r.id, r.report_type, r.format, r.start_date, r.end_date, r.file_path, r.generated_by,
+           COALESCE(r.completed_at, r.created_at) AS completed_at, u.username
+    FROM reports r
+    JOIN (SELECT MAX(id) AS id FROM reports WHERE status = 'done' GROUP BY file_path) latest ON latest.id = r.id
+    LEFT JOIN users u ON u.id = r.generated_by
+    ORDER BY r.start_date DESC, r.end_date DESC, r.report_type, r.format
+'''
+
+@app.route('/admin/reports/files')
+def report_files():
+    if 'loggedin' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+    
+    # The download goes through report_status like any finished job
+    cursor = db.cursor()
+    cursor.execute(REPORT_FILES_QUERY)
+    files = []
+    for report in cursor.fetchall():
+        try:
+            report['size'] = os.path.getsize(report['file_path'])
+        except OSError:
+            continue
+        files.append(report)
+    return render_template('report_files.html', files=files)
+
+@app.route('/admin/reports/<int:id>')
+def report_status(id):
+    if 'loggedin' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+    
+    cursor = db.cursor()
+    cursor.execute('SELECT * FROM reports WHERE id = %s', (id,))
+    report = cursor.fetchone()
+    
+    if request.accept_mimetypes.best == 'application/json':
+        if not report:
+            return jsonify(error='Report not found'), 404
+        return jsonify(id=report['id'],
+                       status=report['status'],
+                       error=report['error'],
+                       download_url=url_for('report_status', id=report['id']) if report['status'] == 'done' else None)
+    
+    if not report:
+        flash('Report not found!', 'danger')
+        return redirect(url_for('reports'))
+    
+    if report['status'] == 'done':
+        # Evicted from the cache, or invalidated by an attendance change
+        if not touch_report(report['file_path']):
+            flash('This report has expired, please generate it again.', 'warning')
+            return redirect(url_for('reports'))
         return send_file(
-            filepath,
-            mimetype='application/pdf',
+            report['file_path'],
+            mimetype=REPORT_MIMETYPES.get(report['format'], 'application/octet-stream'),
             as_attachment=True,
-            download_name=filename
+            download_name=os.path.basename(report['file_path'])
         )
     
-    flash('Report generated successfully!', 'success')
-    return redirect(url_for('reports'))
+    if report['status'] == 'failed':
+        flash(f"Report generation failed: {report['error']}", 'danger')
+        return redirect(url_for('reports'))
+    
+    return render_template('report_status.html', report=report)
+
+# Read-only JSON API. Responses carry a strong ETag built from the data
+# version counters, checked before any data query: a client polling with
+# If-None-Match gets a bodiless 304 for one primary-key lookup. Bodies are
+# always queried, never taken from the per-process dashboard cache, which
+# may lag the shared counters and would pair a new tag with old data.
+def api_value(value):
+    if isinstance(value, timedelta):
+        return format_time(value)
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value)
+    return value
+
+def api_record(row):
+    return {key: api_value(value) for key, value in row.items()}
+
+def api_conditional(etag, build):
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # Per-user data that must be revalidated on every use; the
+    # revalidation is the cheap part
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+def api_admin_only():
+    if 'loggedin' not in session or session['role'] != 'admin':
+        return jsonify(error='Unauthorized'), 401
+    return None
+
+@app.route('/api/v1/summary/today')
+def api_summary_today():
+    denied = api_admin_only()
+    if denied:
+        return denied
+    
+    today = date.today()
+    etag = f"summary-{today}-{data_versions.fetch(db.connection, 'attendance', 'employees')}"
+    def build():
+        summary, _ = load_dashboard_summary(today)
+        return dict(api_record(summary), date=today.isoformat())
+    return api_conditional(etag, build)
+
+@app.route('/api/v1/attendance/recent')
+def api_recent_attendance():
+    denied = api_admin_only()
+    if denied:
+        return denied
+    
+    today = date.today()
+    etag = f"recent-{today}-{data_versions.fetch(db.connection, 'attendance', 'employees')}"
+    def build():
+        _, recent = load_dashboard_summary(today)
+        return {'records': [api_record(record) for record in recent]}
+    return api_conditional(etag, build)
+
+API_HISTORY_QUERY = '''
+    SELECT date, time_in, time_out, status, notes
+    FROM attendance
+    WHERE employee_id = %s
+    ORDER BY date DESC LIMIT %s
+'''
+
+API_EMPLOYEES_QUERY = '''
+    SELECT id, employee_id, full_name, department, position, hire_date
+    FROM employees ORDER BY full_name
+'''
+
+@app.route('/api/v1/employees/<int:id>/attendance')
+def api_employee_attendance(id):
+    # Admins may read anyone's history, employees only their own
+    if 'loggedin' not in session:
+        return jsonify(error='Unauthorized'), 401
+    if session['role'] != 'admin' and current_employee_pk() != id:
+        return jsonify(error='Forbidden'), 403
+    
+    limit = min(max(request.args.get('limit', 7, type=int), 1), app.config['API_HISTORY_MAX_DAYS'])
+    etag = f"history-{id}-{limit}-{data_versions.fetch(db.connection, 'attendance')}"
+    def build():
+        cursor = db.cursor()
+        cursor.execute(API_HISTORY_QUERY, (id, limit))
+        return {'employee': id, 'records': [api_record(record) for record in cursor.fetchall()]}
+    return api_conditional(etag, build)
+
+@app.route('/api/v1/employees')
+def api_employees():
+    denied = api_admin_only()
+    if denied:
+        return denied
+    
+    etag = f"employees-{data_versions.fetch(db.connection, 'employees')}"
+    def build():
+        cursor = db.cursor()
+        cursor.execute(API_EMPLOYEES_QUERY)
+        return {'employees': [api_record(employee) for employee in cursor.fetchall()]}
+    return api_conditional(etag, build)
+
+@app.route('/admin/db/stats')
+def db_stats():
+    if 'loggedin' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+    
+    return jsonify(db.pool.stats())
+
+def metrics_authorized():
+    token = app.config['METRICS_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+@app.route('/metrics')
+def metrics():
+    if not metrics_authorized() and not ('loggedin' in session and session['role'] == 'admin'):
+        return 'Unauthorized', 401
+    
+    return Response(instrumentation.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/logout/')
 def logout():
-    session.pop('loggedin', None)
-    session.pop('id', None)
-    session.pop('username', None)
-    session.pop('role', None)
-    session.pop('employee_id', None)
-    session.pop('full_name', None)
+    # Deletes the stored session and its cookie
+    session.clear()
     return redirect(url_for('login'))
 
+# The SQL of the routes above with representative parameters, for `flask db
+# explain` (see migrations.explain_queries). Built from the constants the
+# routes execute. (name, sql, params, tables allowed to be read in full)
+def attendance_page_explain(cursor_value):
+    # manage_attendance's page query for a date range, past a seek cursor
+    condition, params = attendance_seek_condition(cursor_value)
+    sql = ATTENDANCE_PAGE_QUERY.format(where=f'WHERE a.date >= %s AND a.date <= %s AND {condition}', order='DESC')
+    return 'manage_attendance/page', sql, ['2024-01-01', '2024-01-31'] + params + [51], ()
+
+ROUTE_QUERIES = [
+    ('login', USER_QUERY, ('admin',), ()),
+    ('session_profile', PROFILE_QUERY, (1,), ()),
+    ('dashboard/today', DASHBOARD_TODAY_QUERY, (1, '2024-01-01'), ()),
+    ('dashboard/history', DASHBOARD_HISTORY_QUERY, (1,), ()),
+    ('dashboard/monthly', DASHBOARD_MONTHLY_QUERY, (1, '2024-01-01'), ()),
+    ('api_time_in_out', KIOSK_EMPLOYEE_QUERY, ('EMP001',), ()),
+    ('record_punch', PUNCH_QUERY, (1, '2024-01-01', '09:00:00', 'present'), ()),
+    ('admin_dashboard/summary', SUMMARY_QUERY, ('2024-01-01',), ()),
+    ('admin_dashboard/recent', RECENT_QUERY, (), ()),
+    ('manage_employees', EMPLOYEE_LIST_QUERY, (), ('employees',)),
+    ('manage_attendance/employees', EMPLOYEE_OPTIONS_QUERY, (), ('employees',)),
+    ('manage_attendance/departments', DEPARTMENTS_QUERY, (), ()),
+    attendance_page_explain(('2024-01-15', '09:00:00', 100)),
+    ('manage_attendance/employee', ATTENDANCE_PAGE_QUERY.format(where='WHERE a.employee_id = %s', order='DESC'),
+     (1, 51), ()),
+    ('enqueue_report', LIVE_REPORT_QUERY, ('static/reports/x.pdf', 600), ()),
+    # The derived table holds one row per report file
+    ('report_files', REPORT_FILES_QUERY, (), ('<derived2>',)),
+    ('api/employee_attendance', API_HISTORY_QUERY, (1, 7), ()),
+    ('api/employees', API_EMPLOYEES_QUERY, (), ('employees',)),
+]
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,271 @@
+# Attendance archive: closed months moved out of the attendance table into
+# one Parquet file per month (ARCHIVE_FOLDER/attendance/2024-01.parquet),
+# registered in the attendance_archive table.
+#
+# `archive_month` reads the month's rows under lock, writes the file next to
+# its final name, then registers it and deletes the rows in one transaction;
+# `restore_month` does the reverse. Rows keep their ids and employee pks, so
+# a restore is exact (apart from employees deleted meanwhile) and listing
+# cursors work across both tiers. Employee code, name and department are
+# joined from employees on read, as the SQL queries do.
+#
+# Archived months are read-only: writers check `is_archived` and refuse.
+# Their rollups are left in place and are not rebuilt, so report summaries
+# keep covering them without reading any file.
+import os
+import unicodedata
+from datetime import date, timedelta
+
+import pandas as pd
+
+import rollups
+
+ARCHIVE_COLUMNS = ['id', 'employee_id', 'date', 'time_in', 'time_out', 'status', 'notes']
+
+# A NULL time in sorts lowest, as in MySQL
+NO_TIME = timedelta(seconds=-1)
+
+
+def month_path(folder, month):
+    return os.path.join(folder, 'attendance', f'{month:%Y-%m}.parquet')
+
+
+def archived_months(connection, start=None, end=None):
+    # Registered months overlapping start..end, oldest first
+    cursor = connection.cursor()
+    try:
+        if start is None:
+            cursor.execute('SELECT month FROM attendance_archive ORDER BY month')
+        else:
+            cursor.execute('SELECT month FROM attendance_archive WHERE month <= %s AND LAST_DAY(month) >= %s '
+                           'ORDER BY month', (end, start))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def is_archived(connection, day):
+    day = date.fromisoformat(str(day))
+    return bool(archived_months(connection, day, day))
+
+
+def archive_status(connection):
+    # -> rows for `flask archive list`: month, row_count, file_path, archived_at
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT month, row_count, file_path, archived_at FROM attendance_archive ORDER BY month')
+        return list(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def hot_months(connection, before):
+    # Months with rows in the attendance table that end before `before`
+    cursor = connection.cursor()
+    try:
+        cursor.execute('''
+            SELECT DISTINCT YEAR(date), MONTH(date) FROM attendance
+            WHERE date < %s ORDER BY 1, 2
+        ''', (before,))
+        return [date(year, month, 1) for year, month in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def archive_month(connection, folder, month):
+    # -> number of rows archived. The rows stay locked from the read to the
+    # delete, so a write that slips in cannot be lost.
+    month = rollups.month_start(month)
+    last = rollups.month_end(month)
+    if last >= date.today():
+        raise ValueError(f'{month:%Y-%m} is not over yet')
+    path = month_path(folder, month)
+    cursor = connection.cursor()
+    written = False
+    try:
+        cursor.execute('SELECT 1 FROM attendance_archive WHERE month = %s FOR UPDATE', (month,))
+        if cursor.fetchone():
+            raise ValueError(f'{month:%Y-%m} is already archived')
+        cursor.execute(f'''
+            SELECT {', '.join(ARCHIVE_COLUMNS)} FROM attendance
+            WHERE date BETWEEN %s AND %s
+            ORDER BY employee_id, date
+            FOR UPDATE
+        ''', (month, last))
+        frame = pd.DataFrame(list(cursor.fetchall()), columns=ARCHIVE_COLUMNS)
+        if frame.empty:
+            raise ValueError(f'{month:%Y-%m} has no attendance to archive')
+        frame['time_in'] = pd.to_timedelta(frame['time_in'])
+        frame['time_out'] = pd.to_timedelta(frame['time_out'])
+        frame['status'] = frame['status'].astype('category')
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        frame.to_parquet(path + '.part', compression='zstd', index=False)
+        os.replace(path + '.part', path)
+        written = True
+
+        cursor.execute('INSERT INTO attendance_archive (month, row_count, file_path) VALUES (%s, %s, %s)',
+                       (month, len(frame), os.path.relpath(path, folder)))
+        cursor.execute('DELETE FROM attendance WHERE date BETWEEN %s AND %s', (month, last))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        # No file may outlive a failed archive: the registry decides
+        if os.path.exists(path + '.part'):
+            os.remove(path + '.part')
+        if written:
+            os.remove(path)
+        raise
+    finally:
+        cursor.close()
+    return len(frame)
+
+
+def restore_month(connection, folder, month, chunk_size=5000):
+    # -> (rows restored, rows dropped because their employee was deleted)
+    month = rollups.month_start(month)
+    path = month_path(folder, month)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT 1 FROM attendance_archive WHERE month = %s FOR UPDATE', (month,))
+        if not cursor.fetchone():
+            raise ValueError(f'{month:%Y-%m} is not archived')
+        frame = pd.read_parquet(path)
+        cursor.execute('SELECT id FROM employees')
+        employees = {row[0] for row in cursor.fetchall()}
+        kept = frame[frame['employee_id'].isin(employees)]
+        rows = [tuple(record) for record in as_records(kept, ARCHIVE_COLUMNS)]
+        for start in range(0, len(rows), chunk_size):
+            cursor.executemany(f'''
+                INSERT INTO attendance ({', '.join(ARCHIVE_COLUMNS)})
+                VALUES ({', '.join(['%s'] * len(ARCHIVE_COLUMNS))})
+            ''', rows[start:start + chunk_size])
+        cursor.execute('DELETE FROM attendance_archive WHERE month = %s', (month,))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    os.remove(path)
+    return len(kept), len(frame) - len(kept)
+
+
+def as_records(frame, columns):
+    # Python values as MySQLdb returns them: date, timedelta or None, int
+    records = []
+    for values in frame[columns].itertuples(index=False, name=None):
+        record = []
+        for value in values:
+            if value is pd.NaT or (not isinstance(value, str) and pd.isna(value)):
+                record.append(None)
+            elif isinstance(value, pd.Timedelta):
+                record.append(value.to_pytimedelta())
+            elif hasattr(value, 'item'):
+                record.append(value.item())
+            else:
+                record.append(value)
+        records.append(record)
+    return records
+
+
+def fetch_employees(connection):
+    # id -> employee code, name and department, for joining archived rows
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT id, employee_id, full_name, COALESCE(department, '') FROM employees")
+        frame = pd.DataFrame(list(cursor.fetchall()), columns=['id', 'employee_code', 'full_name', 'department'])
+    finally:
+        cursor.close()
+    return frame.set_index('id')
+
+
+def read_months(folder, months, start=None, end=None, columns=None):
+    # Archived rows of `months` (within start..end), one frame. Only the
+    # requested columns are read from the files.
+    filters = []
+    if start is not None:
+        filters.append(('date', '>=', date.fromisoformat(str(start))))
+    if end is not None:
+        filters.append(('date', '<=', date.fromisoformat(str(end))))
+    frames = [pd.read_parquet(month_path(folder, month), columns=columns, filters=filters or None)
+              for month in months]
+    if not frames:
+        return pd.DataFrame(columns=columns or ARCHIVE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def joined(frame, employees):
+    # Inner join with employees: rows of deleted employees drop out, as
+    # they do from the SQL joins
+    frame = frame.join(employees, on='employee_id', how='inner')
+    frame['employee_pk'] = frame['employee_id']
+    frame['employee_id'] = frame['employee_code']
+    return frame
+
+
+def report_rows(connection, folder, months, start_date, end_date):
+    # Report detail rows (reporting.REPORT_COLUMNS) from the archive, in the
+    # detail query's order: name, then date
+    frame = read_months(folder, months, start_date, end_date,
+                        ['employee_id', 'date', 'time_in', 'time_out', 'status'])
+    frame = joined(frame, fetch_employees(connection))
+    frame['name_key'] = frame['full_name'].map(name_key)
+    frame = frame.sort_values(['name_key', 'date'], kind='stable')
+    columns = ['employee_id', 'full_name', 'department', 'date', 'time_in', 'time_out', 'status']
+    for values in as_records(frame, columns):
+        yield dict(zip(columns, values))
+
+
+def employee_ids(connection, folder, months, start_date, end_date):
+    # Distinct employees with archived rows in the range, deleted ones left out
+    frame = read_months(folder, months, start_date, end_date, ['employee_id'])
+    return set(frame['employee_id'].tolist()) & set(fetch_employees(connection).index.tolist())
+
+
+def listing_rows(connection, folder, months, filters, seek=None, forward=True, limit=50):
+    # Up to `limit` archived rows for the attendance listing, in its order
+    # (date, time_in, id descending when `forward`, ascending otherwise),
+    # past the `seek` cursor (date, time_in or None, id). Months are read
+    # nearest first and reading stops once `limit` rows are found.
+    employees = fetch_employees(connection)
+    if filters.get('employee'):
+        employees = employees[employees.index == filters['employee']]
+    if filters.get('department'):
+        employees = employees[employees['department'] == filters['department']]
+
+    rows = []
+    for month in sorted(months, reverse=forward):
+        frame = read_months(folder, [month], filters.get('date_from'), filters.get('date_to'))
+        frame = joined(frame, employees)
+        if filters.get('status'):
+            frame = frame[frame['status'] == filters['status']]
+        if seek is not None:
+            day, time_in, row_id = seek
+            day = date.fromisoformat(str(day))
+            time_in = NO_TIME if time_in is None else pd.Timedelta(str(time_in))
+            times = frame['time_in'].fillna(NO_TIME)
+            if forward:
+                past = (frame['date'] < day) | ((frame['date'] == day) & (
+                    (times < time_in) | ((times == time_in) & (frame['id'] < row_id))))
+            else:
+                past = (frame['date'] > day) | ((frame['date'] == day) & (
+                    (times > time_in) | ((times == time_in) & (frame['id'] > row_id))))
+            frame = frame[past]
+        columns = ['id', 'employee_pk', 'employee_id', 'full_name', 'date', 'time_in', 'time_out', 'status', 'notes']
+        rows.extend(dict(zip(columns, values), archived=True) for values in as_records(frame, columns))
+        if len(rows) >= limit:
+            break
+    rows.sort(key=listing_key, reverse=forward)
+    return rows[:limit]
+
+
+def name_key(name):
+    # Sort key for names matching the utf8mb4 collation of employees.full_name,
+    # which ignores case and accents
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def listing_key(row):
+    return row['date'], row['time_in'] if row['time_in'] is not None else NO_TIME, row['id']
@@ -0,0 +1,180 @@
+# Static asset build: `flask assets build` writes one CSS and one JS bundle
+# to static/dist, named after a digest of their content, with .gz (and .br
+# when the brotli package is installed) copies next to them and a
+# manifest.json mapping bundle names to files.
+#
+# The CSS bundle is Bootstrap cut down to the rules whose class selectors
+# can all match a class the app uses, plus style.css. "Used" is every
+# word in the templates, script.js and app.py (flash categories), with
+# Jinja- or JS-built names like `bg-{{ ... }}success` covered by joining
+# each "prefix-" word with every other word, plus the state classes that
+# Bootstrap's JavaScript adds at runtime. The JS bundle is Bootstrap's
+# bundle (it includes Popper, which dropdowns need) and script.js; jQuery
+# is not used and not shipped.
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUNDLES = {
+    'app.css': ['css/bootstrap.min.css', 'css/style.css'],
+    'app.js': ['js/bootstrap.bundle.min.js', 'js/script.js'],
+}
+PURGED = {'css/bootstrap.min.css'}
+CLASS_SOURCES = ['templates/*.html', 'static/js/script.js', 'app.py']
+
+# Added and removed by bootstrap.bundle.js, never written in a template
+RUNTIME_CLASSES = {
+    'show', 'showing', 'hiding', 'fade', 'collapse', 'collapsing', 'collapse-horizontal', 'active', 'disabled',
+    'modal-open', 'modal-backdrop', 'modal-static', 'dropdown-menu-end', 'dropup', 'dropend', 'dropstart',
+    'offcanvas-backdrop', 'tooltip', 'tooltip-inner', 'tooltip-arrow', 'popover', 'popover-arrow',
+    'popover-header', 'popover-body', 'bs-tooltip-auto', 'bs-popover-auto', 'was-validated',
+}
+
+CLASS_SELECTOR = re.compile(r'\.(-?[_a-zA-Z][_a-zA-Z0-9-]*)')
+NOT_PSEUDO = re.compile(r':not\([^()]*\)')
+COMMENT = re.compile(r'/\*.*?\*/', re.S)
+WORD = re.compile(r'[A-Za-z0-9_-]+')
+GROUPING_RULES = ('@media', '@supports', '@container', '@layer')
+
+
+def used_classes(root):
+    words = set()
+    for pattern in CLASS_SOURCES:
+        for path in glob.glob(os.path.join(root, pattern)):
+            with open(path, encoding='utf-8') as f:
+                words.update(WORD.findall(f.read()))
+    prefixes = [word for word in words if word.endswith('-')]
+    combined = {prefix + word for prefix in prefixes for word in words}
+    return words | combined | RUNTIME_CLASSES
+
+
+def split_blocks(css):
+    # -> [(prelude, body or None)] for the top level of `css`; strings and
+    # comments are skipped while matching braces
+    blocks = []
+    start = i = 0
+    depth = 0
+    prelude = None
+    while i < len(css):
+        char = css[i]
+        if char in '"\'':
+            i = css.index(char, i + 1) + 1
+            continue
+        if css.startswith('/*', i):
+            i = css.index('*/', i + 2) + 2
+            continue
+        if char == '{':
+            if depth == 0:
+                prelude = css[start:i]
+                start = i + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude.strip(), css[start:i]))
+                start = i + 1
+        elif char == ';' and depth == 0:
+            blocks.append((css[start:i].strip(), None))
+            start = i + 1
+        i += 1
+    return blocks
+
+
+def split_selectors(prelude):
+    selectors, depth, start = [], 0, 0
+    for i, char in enumerate(prelude):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            selectors.append(prelude[start:i])
+            start = i + 1
+    selectors.append(prelude[start:])
+    return [selector.strip() for selector in selectors]
+
+
+def purge_css(css, classes):
+    output = []
+    for prelude, body in split_blocks(css):
+        # Licence comments (/*! ... */) are kept, other comments dropped
+        output.extend(comment for comment in COMMENT.findall(prelude) if comment.startswith('/*!'))
+        prelude = COMMENT.sub('', prelude).strip()
+        if body is None:
+            output.append(prelude + ';')
+        elif prelude.startswith(GROUPING_RULES):
+            inner = purge_css(body, classes)
+            if inner:
+                output.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@'):
+            output.append(f'{prelude}{{{body}}}')
+        else:
+            kept = [selector for selector in split_selectors(prelude)
+                    if set(CLASS_SELECTOR.findall(NOT_PSEUDO.sub('', selector))) <= classes]
+            if kept:
+                output.append(f"{','.join(kept)}{{{body}}}")
+    return ''.join(output)
+
+
+def build(root, output='static/dist', log=print):
+    # root: the app directory; returns the manifest
+    static = os.path.join(root, 'static')
+    dist = os.path.join(root, output)
+    os.makedirs(dist, exist_ok=True)
+    classes = used_classes(root)
+
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(static, source), encoding='utf-8') as f:
+                text = f.read()
+            # Source maps are not shipped, so drop their references
+            text = re.sub(r'/[/*]# sourceMappingURL=\S+?(?: \*/)?\s*$', '', text)
+            original = len(text)
+            if source in PURGED:
+                text = purge_css(text, classes)
+            log(f'  {source}: {original} -> {len(text)} bytes')
+            parts.append(text)
+        content = '\n'.join(parts).encode('utf-8')
+        stem, extension = os.path.splitext(name)
+        filename = f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+        path = os.path.join(dist, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        # mtime=0 keeps the compressed files byte-identical across builds
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=9, mtime=0))
+        sizes = f'{len(content)} bytes, gzip {os.path.getsize(path + ".gz")}'
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(content, quality=11))
+            sizes += f', brotli {os.path.getsize(path + ".br")}'
+        log(f'{name} -> {filename} ({sizes})')
+        manifest[name] = filename
+
+    # Remove bundles from earlier builds
+    current = set(manifest.values())
+    for entry in os.scandir(dist):
+        base = re.sub(r'\.(gz|br)$', '', entry.name)
+        if entry.name != 'manifest.json' and base not in current:
+            os.remove(entry.path)
+    with open(os.path.join(dist, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(root, output='static/dist'):
+    try:
+        with open(os.path.join(root, output, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
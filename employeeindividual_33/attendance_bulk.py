@@ -0,0 +1,159 @@
+# Bulk attendance changes from the admin listing: delete selected rows, set
+# the status of selected rows, and correct one department's day (after a
+# badge-reader outage, say).
+#
+# Each operation is one transaction: the target rows are locked and copied
+# into attendance_audit_rows, changed by a single set-based statement, and
+# their after-images are written back to the same audit rows. A correction
+# that gives a time in also creates rows for the department's employees
+# who have none that day; without one it only changes existing rows. The
+# audit rows double as the response, so the page can patch its table in
+# place.
+import json
+
+import MySQLdb.cursors
+
+import rollups
+from rules import update_statuses
+
+ROW_SOURCE = 'attendance a JOIN employees e ON a.employee_id = e.id'
+
+AUDIT_BEFORE_QUERY = f'''
+    INSERT INTO attendance_audit_rows
+        (batch_id, attendance_id, employee_id, date, old_time_in, old_time_out, old_status, old_notes)
+    SELECT %s, a.id, a.employee_id, a.date, a.time_in, a.time_out, a.status, a.notes
+    FROM {ROW_SOURCE}
+    WHERE {{where}}
+'''
+
+AUDIT_AFTER_QUERY = '''
+    UPDATE attendance_audit_rows r
+    JOIN attendance a ON a.id = r.attendance_id
+    SET r.new_time_in = a.time_in, r.new_time_out = a.time_out,
+        r.new_status = a.status, r.new_notes = a.notes
+    WHERE r.batch_id = %s
+'''
+
+AUDIT_CREATED_QUERY = f'''
+    INSERT INTO attendance_audit_rows
+        (batch_id, attendance_id, employee_id, date, created,
+         new_time_in, new_time_out, new_status, new_notes)
+    SELECT %s, a.id, a.employee_id, a.date, TRUE, a.time_in, a.time_out, a.status, a.notes
+    FROM {ROW_SOURCE}
+    WHERE {{where}} AND NOT EXISTS (
+        SELECT 1 FROM attendance_audit_rows r WHERE r.batch_id = %s AND r.attendance_id = a.id)
+'''
+
+# Rows the statement left as they were are audited but not returned
+AUDIT_CHANGED_QUERY = '''
+    SELECT attendance_id, date, created, new_time_in, new_time_out, new_status, new_notes
+    FROM attendance_audit_rows
+    WHERE batch_id = %s AND NOT (
+        old_time_in <=> new_time_in AND old_time_out <=> new_time_out
+        AND old_status <=> new_status AND old_notes <=> new_notes)
+    ORDER BY attendance_id
+'''
+
+DEPARTMENT_DAY = "a.date = %s AND COALESCE(e.department, '') = %s"
+
+# Blank correction fields (None) leave the stored value alone
+CORRECT_UPSERT_QUERY = '''
+    INSERT INTO attendance (employee_id, date, time_in, time_out, status, notes)
+    SELECT e.id, %s, %s, %s, %s, %s
+    FROM employees e
+    WHERE COALESCE(e.department, '') = %s AND (e.hire_date IS NULL OR e.hire_date <= %s)
+    ON DUPLICATE KEY UPDATE
+        time_in = COALESCE(VALUES(time_in), time_in),
+        time_out = COALESCE(VALUES(time_out), time_out),
+        status = COALESCE(%s, status),
+        notes = COALESCE(VALUES(notes), notes)
+'''
+
+CORRECT_UPDATE_QUERY = f'''
+    UPDATE {ROW_SOURCE}
+    SET a.time_out = COALESCE(%s, a.time_out),
+        a.status = COALESCE(%s, a.status),
+        a.notes = COALESCE(%s, a.notes)
+    WHERE {DEPARTMENT_DAY}
+'''
+
+
+def id_list(ids):
+    # -> (placeholders, params) for an IN list
+    ids = sorted({int(value) for value in ids})
+    return ', '.join(['%s'] * len(ids)), ids
+
+
+def run_batch(connection, action, detail, user_id, where, params, statement, statement_params, rules,
+              restatus=False):
+    # `where` selects the target rows of ROW_SOURCE before and after the
+    # change. Returns the batch result; does the commit.
+    cursor = connection.cursor(MySQLdb.cursors.Cursor)
+    try:
+        old_rows = rollups.fetch_rows(connection, where, params, lock=True)
+        cursor.execute('INSERT INTO attendance_audit (action, detail, performed_by) VALUES (%s, %s, %s)',
+                       (action, json.dumps(detail, default=str), user_id))
+        batch_id = cursor.lastrowid
+        cursor.execute(AUDIT_BEFORE_QUERY.format(where=where), [batch_id] + list(params))
+
+        cursor.execute(statement, statement_params)
+
+        new_rows = rollups.fetch_rows(connection, where, params)
+        if restatus:
+            update_statuses(connection, new_rows, rules)
+        cursor.execute(AUDIT_AFTER_QUERY, (batch_id,))
+        cursor.execute(AUDIT_CREATED_QUERY.format(where=where), [batch_id] + list(params) + [batch_id])
+        cursor.execute('''
+            UPDATE attendance_audit SET row_count = (
+                SELECT COUNT(*) FROM attendance_audit_rows WHERE batch_id = %s)
+            WHERE id = %s
+        ''', (batch_id, batch_id))
+        rollups.apply_changes(connection, old_rows, new_rows, rules)
+
+        cursor.execute(AUDIT_CHANGED_QUERY, (batch_id,))
+        rows = [{'id': attendance_id, 'date': day, 'created': bool(created), 'deleted': status is None,
+                 'time_in': time_in, 'time_out': time_out, 'status': status, 'notes': notes}
+                for attendance_id, day, created, time_in, time_out, status, notes in cursor.fetchall()]
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return {
+        'batch': batch_id,
+        'action': action,
+        'affected': len(rows),
+        'dates': sorted({row['date'] for row in old_rows} | {row['date'] for row in new_rows}),
+        'rows': rows,
+    }
+
+
+def delete_rows(connection, ids, user_id, rules):
+    placeholders, ids = id_list(ids)
+    return run_batch(connection, 'delete', {'ids': ids}, user_id, f'a.id IN ({placeholders})', ids,
+                     f'DELETE FROM attendance WHERE id IN ({placeholders})', ids, rules)
+
+
+def set_status(connection, ids, status, user_id, rules):
+    placeholders, ids = id_list(ids)
+    return run_batch(connection, 'status', {'ids': ids, 'status': status}, user_id,
+                     f'a.id IN ({placeholders})', ids,
+                     f'UPDATE attendance SET status = %s WHERE id IN ({placeholders}) AND status <> %s',
+                     [status] + ids + [status], rules)
+
+
+def correct_department(connection, department, day, user_id, rules, time_in=None, time_out=None, status=None,
+                       notes=None):
+    # Without a status, statuses of the day's rows follow the rules again
+    detail = {'department': department, 'date': day, 'time_in': time_in, 'time_out': time_out,
+              'status': status, 'notes': notes}
+    params = [day, department]
+    if time_in is not None:
+        statement = CORRECT_UPSERT_QUERY
+        statement_params = [day, time_in, time_out, status or 'present', notes, department, day, status]
+    else:
+        statement = CORRECT_UPDATE_QUERY
+        statement_params = [time_out, status, notes, day, department]
+    return run_batch(connection, 'correct', detail, user_id, DEPARTMENT_DAY, params,
+                     statement, statement_params, rules, restatus=status is None)
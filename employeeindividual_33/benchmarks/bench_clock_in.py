@@ -0,0 +1,59 @@
+# Concurrent load test for the kiosk clock-in endpoint.
+#
+# Needs a running app with KIOSK_TOKEN set and employees whose codes match
+# --code-format. Each employee punches twice (time in, then time out).
+#
+#   python benchmarks/bench_clock_in.py --url http://127.0.0.1:5000 \
+#       --token secret --employees 500 --concurrency 50
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def punch(url, token, code):
+    body = json.dumps({'employee_id': code}).encode('utf-8')
+    request = urllib.request.Request(url + '/api/time_in_out', data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'X-Kiosk-Token': token,
+    })
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return time.perf_counter() - started, status
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--token', required=True)
+    parser.add_argument('--employees', type=int, default=500)
+    parser.add_argument('--code-format', default='EMP{:05d}')
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    codes = [args.code_format.format(i) for i in range(args.employees)]
+    for phase in ('time in', 'time out'):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda code: punch(args.url, args.token, code), codes))
+        elapsed = time.perf_counter() - started
+        latencies = [latency for latency, _ in results]
+        errors = sum(1 for _, status in results if status not in (200, 409))
+        print(f'{phase:<9} {len(results) / elapsed:8.1f} req/s   '
+              f'p50 {percentile(latencies, 0.50) * 1000:7.1f} ms   '
+              f'p99 {percentile(latencies, 0.99) * 1000:7.1f} ms   '
+              f'errors {errors}')
@@ -0,0 +1,81 @@
+# Password verification throughput of the credential service, i.e. the CPU
+# ceiling on logins.
+#
+# For each --workers value, --concurrency threads each verify passwords
+# through a CredentialService for --seconds; the report gives logins per
+# second in total and per worker process (one core each), latency
+# percentiles and how many attempts were shed with CredentialsBusy. No
+# database is needed: this measures hashing alone.
+#
+#   python benchmarks/bench_login.py --workers 1 2 4 --method scrypt
+import argparse
+import os
+import sys
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+import harness
+
+sys.path.insert(0, harness.APP_DIR)
+from credentials import CredentialService, CredentialsBusy
+
+
+def run(workers, method, concurrency, seconds, max_pending, password_hash):
+    service = CredentialService(method=method, workers=workers, max_pending=max_pending, timeout=60)
+    # Start the pool (and warm every worker) before timing
+    for _ in range(workers):
+        service.verify(password_hash, harness.PASSWORD)
+
+    latencies = []
+    busy = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                matches, _ = service.verify(password_hash, harness.PASSWORD)
+                assert matches
+            except CredentialsBusy:
+                with lock:
+                    busy[0] += 1
+                time.sleep(0.001)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    service.shutdown()
+    return len(latencies) / elapsed, latencies, busy[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument('--method', default='scrypt', help='werkzeug method string, e.g. pbkdf2:sha256:600000')
+    parser.add_argument('--concurrency', type=int, default=16, help='Simultaneous login attempts.')
+    parser.add_argument('--max-pending', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    password_hash = generate_password_hash(harness.PASSWORD, args.method)
+    print(f'method {password_hash.split("$", 1)[0]}, {os.cpu_count()} CPUs, concurrency {args.concurrency}')
+    for workers in sorted(set(args.workers)):
+        rate, latencies, busy = run(workers, args.method, args.concurrency, args.seconds,
+                                    args.max_pending, password_hash)
+        if not latencies:
+            print(f'{workers:>2} workers  no login finished within {args.seconds}s')
+            continue
+        print(f'{workers:>2} workers  {rate:8.1f} logins/s  {rate / workers:7.1f} per core   '
+              f'p50 {harness.percentile(latencies, 0.50) * 1000:7.1f} ms   '
+              f'p99 {harness.percentile(latencies, 0.99) * 1000:7.1f} ms   '
+              f'busy {busy}')
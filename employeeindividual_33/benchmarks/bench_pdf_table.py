@@ -0,0 +1,91 @@
+# Rows/sec of the batched PDF table writer against the old per-cell loop.
+#
+#   python benchmarks/bench_pdf_table.py --rows 20000
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from fpdf import FPDF
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pdf_table import PdfTableWriter  # noqa: E402
+from reporting import PDF_COLUMNS, PDF_GROUPS  # noqa: E402
+
+
+def make_rows(count, employees=300):
+    departments = ['Finance', 'HR', 'IT', 'Operations', 'Sales']
+    statuses = ['present', 'present', 'present', 'late', 'absent', 'half-day']
+    start = date(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        employee = i % employees
+        rows.append([
+            f'EMP{employee:05d}',
+            f'Employee Number {employee} ' + 'x' * (employee % 25),
+            departments[employee % len(departments)],
+            str(start + timedelta(days=i // employees)),
+            '09:%02d:00' % random.randrange(60),
+            '17:%02d:00' % random.randrange(60),
+            random.choice(statuses),
+        ])
+    return rows
+
+
+def per_cell(rows):
+    # The loop generate_report used before the batched writer
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=10)
+    for row in rows:
+        pdf.cell(30, 10, txt=row[0], border=1)
+        pdf.cell(40, 10, txt=row[1], border=1)
+        pdf.cell(30, 10, txt=row[3], border=1)
+        pdf.cell(30, 10, txt=row[4] or '', border=1)
+        pdf.cell(30, 10, txt=row[5] or '', border=1)
+        pdf.cell(30, 10, txt=row[6], border=1, ln=1)
+    return pdf
+
+
+def batched(rows, group_by=None):
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=10)
+    group_column, group_label = PDF_GROUPS.get(group_by, (None, None))
+    PdfTableWriter(pdf, PDF_COLUMNS).write(rows, group_by=group_column, group_label=group_label,
+                                           count_column='status' if group_column else None)
+    return pdf
+
+
+def measure(name, render, rows, repeat, output):
+    best_table = best_total = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        pdf = render(rows)
+        table = time.perf_counter() - started
+        if output:
+            pdf.output(os.devnull)
+        total = time.perf_counter() - started
+        best_table = table if best_table is None else min(best_table, table)
+        best_total = total if best_total is None else min(best_total, total)
+    line = f'{name:<22} table {len(rows) / best_table:>10,.0f} rows/s'
+    if output:
+        line += f'   with output {len(rows) / best_total:>10,.0f} rows/s'
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', action='store_true', help='include pdf.output() in the timing')
+    args = parser.parse_args()
+
+    random.seed(0)
+    rows = make_rows(args.rows)
+    measure('per-cell loop', per_cell, rows, args.repeat, args.output)
+    measure('batched', batched, rows, args.repeat, args.output)
+    measure('batched by employee', lambda r: batched(r, 'employee'), rows, args.repeat, args.output)
+    measure('batched by department', lambda r: batched(r, 'department'), rows, args.repeat, args.output)
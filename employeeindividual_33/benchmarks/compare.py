@@ -0,0 +1,89 @@
+# Compares two load.py result files route by route.
+#
+# A route regresses when its p95 latency or peak memory grows, or its
+# throughput drops, by more than --threshold. Routes with fewer than
+# --min-requests samples are shown but never flagged: their percentiles are
+# too noisy. Exits with status 1 on any regression, for use in CI.
+#
+#   python benchmarks/compare.py before.json after.json --threshold 0.15
+import argparse
+import json
+import sys
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def format_change(value):
+    return '' if value is None else f'{value:+.0%}'
+
+
+def compare(base, head, threshold, min_requests):
+    rows = []
+    regressions = []
+    for route in sorted(set(base['routes']) | set(head['routes'])):
+        old = base['routes'].get(route)
+        new = head['routes'].get(route)
+        if old is None or new is None:
+            rows.append((route, 'only in ' + ('head' if old is None else 'base'), '', '', '', ''))
+            continue
+        p50 = change(old['p50_ms'], new['p50_ms'])
+        p95 = change(old['p95_ms'], new['p95_ms'])
+        p99 = change(old['p99_ms'], new['p99_ms'])
+        throughput = change(old['throughput_rps'], new['throughput_rps'])
+        memory = change(old['peak_memory_kib'], new['peak_memory_kib'])
+
+        flags = []
+        if min(old['requests'], new['requests']) >= min_requests:
+            if p95 is not None and p95 > threshold:
+                flags.append('p95')
+            if throughput is not None and throughput < -threshold:
+                flags.append('throughput')
+        if memory is not None and memory > threshold:
+            flags.append('memory')
+        if new['errors'] > old['errors']:
+            flags.append('errors')
+        if flags:
+            regressions.append((route, flags))
+        notes = []
+        if throughput is not None:
+            notes.append(f'rps {format_change(throughput)}')
+        if memory is not None:
+            notes.append(f'mem {format_change(memory)}')
+        if flags:
+            notes.append('REGRESSED: ' + ', '.join(flags))
+        rows.append((route, f"{old['p95_ms']:.1f} -> {new['p95_ms']:.1f} ms",
+                     format_change(p50), format_change(p95), format_change(p99), ' '.join(notes)))
+    return rows, regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative change that counts (0.2 = 20%%).')
+    parser.add_argument('--min-requests', type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.head, encoding='utf-8') as f:
+        head = json.load(f)
+
+    print(f"base {base['meta']['revision']} ({base['meta']['started_at']}), "
+          f"head {head['meta']['revision']} ({head['meta']['started_at']})")
+    settings = [{key: value for key, value in run['meta']['args'].items() if key != 'output'}
+                for run in (base, head)]
+    if settings[0] != settings[1] or base['meta']['dataset'] != head['meta']['dataset']:
+        print('warning: runs used different arguments or datasets', file=sys.stderr)
+
+    rows, regressions = compare(base, head, args.threshold, args.min_requests)
+    print(f"{'route':<34} {'p95':<22} {'p50':>6} {'p95':>6} {'p99':>6}  notes")
+    for route, p95_values, p50, p95, p99, notes in rows:
+        print(f'{route:<34} {p95_values:<22} {p50:>6} {p95:>6} {p99:>6}  {notes}')
+    if regressions:
+        print(f'{len(regressions)} route(s) regressed beyond {args.threshold:.0%}', file=sys.stderr)
+        sys.exit(1)
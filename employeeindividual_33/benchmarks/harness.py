@@ -0,0 +1,59 @@
+# Shared set-up for the benchmark scripts: import the app against a
+# dedicated benchmark database and a few result helpers.
+import os
+import subprocess
+import sys
+import time
+
+import MySQLdb
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATABASE = 'kate33_bench'
+PASSWORD = 'bench'  # every seeded account's password
+ADMIN_USERNAME = 'bench_admin'
+EMPLOYEE_USERNAME = 'bench_emp{:05d}'
+EMPLOYEE_CODE = 'EMP{:05d}'
+DEPARTMENTS = ['Engineering', 'Sales', 'Support', 'Finance', 'Operations', 'HR', 'Marketing', 'Legal']
+
+
+def load_app(database=DEFAULT_DATABASE, create=False):
+    # The app resolves UPLOAD_FOLDER and its templates relative to its own
+    # directory. Its pool connects lazily, so repointing connect_args here
+    # moves the app (and the report workers) to the benchmark database.
+    os.chdir(APP_DIR)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    import app as app_module
+
+    app_module.app.config['MYSQL_DB'] = database
+    app_module.db.pool.connect_args['db'] = database
+    if create:
+        server_args = {key: value for key, value in app_module.db.pool.connect_args.items() if key != 'db'}
+        connection = MySQLdb.connect(**server_args)
+        try:
+            connection.cursor().execute(
+                f'CREATE DATABASE IF NOT EXISTS `{database}` CHARACTER SET utf8mb4')
+        finally:
+            connection.close()
+    return app_module
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def default_output(revision):
+    folder = os.path.join(APP_DIR, 'benchmarks', 'results')
+    os.makedirs(folder, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(folder, f"{revision or 'unknown'}-{stamp}.json")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,388 @@
+# Concurrent load driver for every route in app.py, run in-process through
+# Flask's test client against the database filled by seed.py.
+#
+# Scenarios run one after another; within a scenario --concurrency threads
+# each drive their own client (and session). Per route it reports
+# throughput, p50/p95/p99 latency and the peak Python memory one request
+# allocates, and writes everything to a JSON file for compare.py.
+#
+# Memory is measured in a separate, sequential warm-up pass under
+# tracemalloc, so the tracing overhead stays out of the latencies. Excel and
+# PDF reports render in worker processes: their latency is end to end
+# (queue, render, download) and their memory shows up only in
+# report_worker_max_rss_kib. Latencies include the GIL contention of running
+# the server and the clients in one process, so compare runs made on the
+# same machine with the same arguments.
+#
+#   python benchmarks/seed.py --employees 2000 --days 120 --reset
+#   python benchmarks/load.py --concurrency 16 --output before.json
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import harness
+
+KIOSK_TOKEN = 'bench-kiosk-token'
+JSON = {'Accept': 'application/json'}
+AFTER_CURSOR = re.compile(r'[?&;]after=([^"&#]+)')
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.seconds = defaultdict(float)  # wall time of the scenarios a route ran in
+        self.peaks = {}
+        self.measure_memory = False
+        self.active = set()
+
+    def record(self, route, elapsed, ok):
+        with self.lock:
+            if self.measure_memory:
+                return
+            self.latencies[route].append(elapsed)
+            if not ok:
+                self.errors[route] += 1
+            self.active.add(route)
+
+    def call(self, route, client, method, url, expect=(200, 302), **kwargs):
+        if self.measure_memory:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        body = response.get_data()  # drains streamed responses too
+        elapsed = time.perf_counter() - started
+        response.close()
+        if self.measure_memory:
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            with self.lock:
+                self.peaks[route] = max(self.peaks.get(route, 0), peak)
+        self.record(route, elapsed, response.status_code in expect)
+        return response, body
+
+
+class Context:
+    def __init__(self, app_module, recorder, args):
+        self.app_module = app_module
+        self.app = app_module.app
+        self.recorder = recorder
+        self.args = args
+        self.workers = args.concurrency
+        self.rounds = args.rounds
+        self.punches = args.punches
+        self.bulk_size = args.bulk_size
+        self.run = 'load'
+        with self.app.app_context():
+            cursor = app_module.db.cursor()
+            cursor.execute('SELECT id, employee_id FROM employees WHERE employee_id LIKE %s ORDER BY id',
+                           ('EMP%',))
+            employees = cursor.fetchall()
+            cursor.execute("SELECT username FROM users WHERE role = 'employee' AND username LIKE %s",
+                           ('bench_emp%',))
+            self.accounts = [row['username'] for row in cursor.fetchall()]
+            cursor.execute('SELECT DISTINCT department FROM employees WHERE department IS NOT NULL')
+            self.departments = [row['department'] for row in cursor.fetchall()]
+            # Before the run adds today's punches
+            cursor.execute('''
+                SELECT (SELECT COUNT(*) FROM employees) AS employees,
+                       (SELECT COUNT(*) FROM attendance) AS attendance
+            ''')
+            self.dataset = {key: int(value) for key, value in cursor.fetchone().items()}
+        if not employees or not self.accounts:
+            sys.exit('No benchmark data; run benchmarks/seed.py first')
+        self.employee_pks = [row['id'] for row in employees]
+        self.codes = [row['employee_id'] for row in employees]
+
+    def query(self, sql, params=()):
+        with self.app.app_context():
+            cursor = self.app_module.db.cursor()
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def login(self, client, username):
+        self.recorder.call('login', client, 'POST', '/login/',
+                           data={'username': username, 'password': harness.PASSWORD})
+
+
+def run_scenario(ctx, results, name, work):
+    # work(ctx, worker) in ctx.workers threads at once
+    recorder = ctx.recorder
+    recorder.active = set()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=ctx.workers) as pool:
+        list(pool.map(lambda worker: work(ctx, worker), range(ctx.workers)))
+    elapsed = time.perf_counter() - started
+    if not recorder.measure_memory:
+        for route in recorder.active:
+            recorder.seconds[route] += elapsed
+        results[name] = {'seconds': round(elapsed, 3),
+                         'requests': sum(len(recorder.latencies[route]) for route in recorder.active)}
+    print(f'  {name:<16} {elapsed:7.2f}s', file=sys.stderr)
+
+
+# Scenarios
+
+def sessions(ctx, worker):
+    # Anonymous pages, then an employee logs in, looks and leaves
+    call = ctx.recorder.call
+    client = ctx.app.test_client()
+    for _ in range(ctx.rounds):
+        call('home', client, 'GET', '/')
+        call('login:form', client, 'GET', '/login/')
+        call('register:form', client, 'GET', '/register/')
+        ctx.login(client, ctx.accounts[worker % len(ctx.accounts)])
+        call('dashboard', client, 'GET', '/dashboard/')
+        call('logout', client, 'GET', '/logout/')
+
+
+def clock_in_burst(ctx, worker):
+    # Kiosk punches for the last --punches employees (time in, then time
+    # out) while employees with accounts punch through the web UI
+    call = ctx.recorder.call
+    client = ctx.app.test_client()
+    codes = ctx.codes[-ctx.punches:][worker::ctx.workers]
+    headers = {'X-Kiosk-Token': KIOSK_TOKEN}
+    for _ in range(2):
+        for code in codes:
+            call('api_time_in_out', client, 'POST', '/api/time_in_out', expect=(200, 409),
+                 json={'employee_id': code}, headers=headers)
+
+    client = ctx.app.test_client()
+    ctx.login(client, ctx.accounts[worker % len(ctx.accounts)])
+    call('time_in_out', client, 'POST', '/time_in_out/')
+    call('api_time_in_out:session', client, 'POST', '/api/time_in_out', expect=(200, 409))
+    call('dashboard', client, 'GET', '/dashboard/')
+
+
+def bulk_ingest(ctx, worker):
+    # Badge readers upload buffered NDJSON events for today
+    client = ctx.app.test_client()
+    codes = ctx.codes[worker::ctx.workers]
+    today = date.today().isoformat()
+    lines = []
+    for i in range(ctx.bulk_size):
+        code = codes[i % len(codes)]
+        kind = 'in' if i < len(codes) else 'out'
+        lines.append(json.dumps({'employee_id': code, 'type': kind,
+                                 'timestamp': f'{today}T{8 + i % 10:02d}:{i % 60:02d}:00'}))
+    ctx.recorder.call('api_attendance_bulk', client, 'POST', '/api/attendance/bulk', expect=(200, 207),
+                      data='\n'.join(lines), content_type='application/x-ndjson',
+                      headers={'X-Kiosk-Token': KIOSK_TOKEN})
+
+
+def admin_polling(ctx, worker):
+    # Admins keep the dashboard open and page through attendance
+    call = ctx.recorder.call
+    client = ctx.app.test_client()
+    ctx.login(client, harness.ADMIN_USERNAME)
+    today = date.today()
+    for i in range(ctx.rounds):
+        call('admin_dashboard', client, 'GET', '/admin/dashboard/')
+        _, body = call('manage_attendance', client, 'GET', '/admin/attendance')
+        for _ in range(3):
+            cursor = AFTER_CURSOR.search(body.decode('utf-8'))
+            if not cursor:
+                break
+            _, body = call('manage_attendance:after', client, 'GET', '/admin/attendance?after=' + cursor.group(1))
+        department = ctx.departments[(worker + i) % len(ctx.departments)]
+        call('manage_attendance:filter', client, 'GET', '/admin/attendance', query_string={
+            'department': department, 'status': 'late',
+            'date_from': today.replace(day=1).isoformat(), 'date_to': today.isoformat()})
+        call('manage_attendance:employee', client, 'GET', '/admin/attendance',
+             query_string={'employee': ctx.employee_pks[(worker * 7 + i) % len(ctx.employee_pks)]})
+        call('manage_employees', client, 'GET', '/admin/employees')
+        call('reports', client, 'GET', '/admin/reports/')
+        call('db_stats', client, 'GET', '/admin/db/stats')
+        # What the dashboard's script polls: a full fetch, then revalidation
+        for route, url in (('api_summary_today', '/api/v1/summary/today'),
+                           ('api_recent_attendance', '/api/v1/attendance/recent')):
+            response, _ = call(route, client, 'GET', url, expect=(200,))
+            call(route + ':304', client, 'GET', url, expect=(200, 304),
+                 headers={'If-None-Match': response.headers.get('ETag', '')})
+
+
+def admin_crud(ctx, worker):
+    # Create, edit and delete employees and attendance by hand
+    call = ctx.recorder.call
+    client = ctx.app.test_client()
+    ctx.login(client, harness.ADMIN_USERNAME)
+    for i in range(ctx.rounds):
+        code = f'B{ctx.run[0]}{worker:03d}{i:05d}{int(time.time()) % 100000:05d}'
+        form = {'employee_id': code, 'full_name': f'Bench Temp {code}', 'department': 'Benchmark',
+                'position': 'Temp', 'hire_date': '2024-01-01', 'contact_number': '0',
+                'email': f'{code}@example.com', 'address': 'Nowhere'}
+        call('add_employee:form', client, 'GET', '/admin/employees/add')
+        call('add_employee', client, 'POST', '/admin/employees/add', data=form)
+        employee_pk = ctx.query('SELECT id FROM employees WHERE employee_id = %s', (code,))[0]['id']
+        call('edit_employee:form', client, 'GET', f'/admin/employees/edit/{employee_pk}')
+        call('edit_employee', client, 'POST', f'/admin/employees/edit/{employee_pk}',
+             data=dict(form, position='Temp II'))
+
+        day = f'2020-01-{1 + i % 28:02d}'
+        call('add_attendance', client, 'POST', '/admin/attendance/add', data={
+            'employee_id': employee_pk, 'date': day, 'time_in': '08:55', 'time_out': '18:00',
+            'status': 'present', 'notes': ''})
+        attendance_id = ctx.query('SELECT id FROM attendance WHERE employee_id = %s AND date = %s',
+                                  (employee_pk, day))[0]['id']
+        call('edit_attendance', client, 'POST', f'/admin/attendance/edit/{attendance_id}', data={
+            'date': day, 'time_in': '09:10', 'time_out': '18:00', 'status': 'late', 'notes': 'bench'})
+        call('delete_attendance', client, 'POST', f'/admin/attendance/delete/{attendance_id}')
+        call('delete_employee', client, 'POST', f'/admin/employees/delete/{employee_pk}')
+
+
+def wait_for_report(ctx, client, status_url):
+    while True:
+        _, body = ctx.recorder.call('report_status', client, 'GET', status_url, headers=JSON)
+        status = json.loads(body)['status']
+        if status in ('done', 'failed'):
+            return status
+        time.sleep(0.1)
+
+
+def generate(ctx, client, route, form):
+    # One report, end to end: request, wait for the worker, download
+    recorder = ctx.recorder
+    started = time.perf_counter()
+    response, body = recorder.call(route + ':request', client, 'POST', '/admin/generate_report/',
+                                   expect=(200, 202), data=form, headers=JSON)
+    ok = response.status_code in (200, 202)
+    if response.status_code == 202:
+        status_url = json.loads(body)['status_url']
+        ok = wait_for_report(ctx, client, status_url) == 'done'
+        if ok:
+            response, _ = recorder.call('report_status:download', client, 'GET', status_url, expect=(200,))
+            ok = response.status_code == 200
+    recorder.record(route, time.perf_counter() - started, ok)
+
+
+def report_generation(ctx, worker):
+    # Every type and format, rendered cold and then served from the cache
+    client = ctx.app.test_client()
+    ctx.login(client, harness.ADMIN_USERNAME)
+    jobs = [(format_type, report_type)
+            for format_type in ('csv', 'excel', 'pdf')
+            for report_type in ('daily', 'weekly', 'monthly')]
+    for format_type, report_type in jobs[worker::ctx.workers]:
+        form = {'report_type': report_type, 'format': format_type}
+        generate(ctx, client, f'generate_report:{format_type}', form)
+        generate(ctx, client, f'generate_report:{format_type}:cached', form)
+
+
+SCENARIOS = [
+    ('sessions', sessions),
+    ('clock_in_burst', clock_in_burst),
+    ('bulk_ingest', bulk_ingest),
+    ('admin_polling', admin_polling),
+    ('admin_crud', admin_crud),
+    ('reports', report_generation),
+]
+
+
+def clear_report_cache(ctx):
+    ctx.app_module.evict_report_cache(ctx.app.config['UPLOAD_FOLDER'], 0)
+
+
+def summarize(recorder, scenarios, ctx):
+    routes = {}
+    for route in sorted(recorder.latencies):
+        latencies = recorder.latencies[route]
+        seconds = recorder.seconds[route]
+        routes[route] = {
+            'requests': len(latencies),
+            'errors': recorder.errors[route],
+            'throughput_rps': round(len(latencies) / seconds, 2) if seconds else None,
+            'p50_ms': round(harness.percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(harness.percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(harness.percentile(latencies, 0.99) * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2),
+            'peak_memory_kib': round(recorder.peaks[route] / 1024, 1) if route in recorder.peaks else None,
+        }
+    return {
+        'meta': {
+            'revision': harness.git_revision(),
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'database': ctx.app.config['MYSQL_DB'],
+            'dataset': ctx.dataset,
+            'args': vars(ctx.args),
+            'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'report_worker_max_rss_kib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        },
+        'scenarios': scenarios,
+        'routes': routes,
+    }
+
+
+def print_table(results):
+    print(f"{'route':<34} {'reqs':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'peak KiB':>9}")
+    for route, stats in results['routes'].items():
+        peak = stats['peak_memory_kib']
+        print(f"{route:<34} {stats['requests']:>6} {stats['errors']:>4} "
+              f"{stats['throughput_rps'] or 0:>8.1f} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+              f"{stats['p99_ms']:>8.1f} {'-' if peak is None else f'{peak:.0f}':>9}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=harness.DEFAULT_DATABASE)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=5, help='Loop count per thread for polling and CRUD.')
+    parser.add_argument('--punches', type=int, default=500, help='Employees punching at the kiosks.')
+    parser.add_argument('--bulk-size', type=int, default=2000, help='Events per bulk upload.')
+    parser.add_argument('--only', action='append', choices=[name for name, _ in SCENARIOS],
+                        help='Run just these scenarios (repeatable).')
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/<rev>-<time>.json).')
+    args = parser.parse_args()
+    # load_app changes into the app directory
+    output = os.path.abspath(args.output) if args.output else None
+
+    app_module = harness.load_app(args.database)
+    app_module.app.config['KIOSK_TOKEN'] = KIOSK_TOKEN
+    recorder = Recorder()
+    ctx = Context(app_module, recorder, args)
+    selected = [(name, work) for name, work in SCENARIOS if not args.only or name in args.only]
+
+    # Sequential pass: warms up templates, pools and caches, and measures
+    # what one request of each route allocates
+    print('memory pass', file=sys.stderr)
+    ctx.workers, ctx.rounds, ctx.punches, ctx.bulk_size, ctx.run = 1, 1, 1, 50, 'memory'
+    recorder.measure_memory = True
+    tracemalloc.start()
+    for name, work in selected:
+        if name == 'reports':
+            clear_report_cache(ctx)
+        run_scenario(ctx, {}, name, work)
+    tracemalloc.stop()
+    recorder.measure_memory = False
+
+    print('load pass', file=sys.stderr)
+    ctx.workers, ctx.rounds, ctx.punches, ctx.bulk_size, ctx.run = (
+        args.concurrency, args.rounds, args.punches, args.bulk_size, 'load')
+    scenarios = {}
+    for name, work in selected:
+        if name == 'reports':
+            clear_report_cache(ctx)
+        run_scenario(ctx, scenarios, name, work)
+
+    results = summarize(recorder, scenarios, ctx)
+    print_table(results)
+    output = output or harness.default_output(results['meta']['revision'])
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f'results written to {output}', file=sys.stderr)
+    if app_module.report_executor is not None:
+        app_module.report_executor.shutdown()
@@ -0,0 +1,151 @@
+# Seeds the benchmark database with N employees x M days of attendance.
+#
+# The data is deterministic for a given --seed, so runs on different commits
+# measure the same workload. Days end yesterday: today is left empty for the
+# clock-in burst in load.py. All accounts use harness.PASSWORD.
+#
+#   python benchmarks/seed.py --employees 2000 --days 120 --reset
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+import harness
+
+
+def employee_rows(count, rng):
+    first = ['Ana', 'Ben', 'Carla', 'Dino', 'Ella', 'Felix', 'Gina', 'Hugo', 'Ivy', 'Jose', 'Kate', 'Leo']
+    last = ['Santos', 'Reyes', 'Cruz', 'Bautista', 'Garcia', 'Mendoza', 'Torres', 'Flores', 'Ramos']
+    rows = []
+    for i in range(count):
+        rows.append((
+            harness.EMPLOYEE_CODE.format(i),
+            f'{rng.choice(first)} {rng.choice(last)} {i}',
+            harness.DEPARTMENTS[i % len(harness.DEPARTMENTS)],
+            'Staff',
+            date(2015, 1, 1) + timedelta(days=rng.randrange(3000)),
+            f'0917{i:07d}',
+            f'employee{i}@example.com',
+            f'{i} Benchmark Street',
+        ))
+    return rows
+
+
+def attendance_rows(employee_pks, days, late_after, rng):
+    # ~90% on time or late, ~5% absent, ~3% half day, rest no record at all;
+    # weekends are skipped
+    today = date.today()
+    for offset in range(days, 0, -1):
+        day = today - timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        for employee_pk in employee_pks:
+            roll = rng.random()
+            if roll < 0.02:
+                continue
+            if roll < 0.07:
+                yield (employee_pk, day, None, None, 'absent')
+                continue
+            time_in = datetime.combine(day, late_after) + timedelta(minutes=rng.gauss(-15, 12))
+            if roll < 0.10:
+                time_out = time_in + timedelta(hours=4)
+                status = 'half-day'
+            else:
+                time_out = time_in + timedelta(hours=9, minutes=rng.randrange(0, 90))
+                status = 'late' if time_in.time() > late_after else 'present'
+            yield (employee_pk, day, time_in.time().replace(microsecond=0),
+                   time_out.time().replace(microsecond=0), status)
+
+
+def insert_chunks(connection, query, rows, chunk_size):
+    cursor = connection.cursor()
+    written = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            cursor.executemany(query, chunk)
+            connection.commit()
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        cursor.executemany(query, chunk)
+        connection.commit()
+        written += len(chunk)
+    cursor.close()
+    return written
+
+
+def seed(connection, employees, days, accounts, late_after, rng, chunk_size=5000):
+    cursor = connection.cursor()
+    # One hash for every account: hashing thousands of passwords would take
+    # longer than seeding the attendance
+    password = generate_password_hash(harness.PASSWORD)
+    cursor.execute('INSERT INTO users (username, email, password, role) VALUES (%s, %s, %s, %s)',
+                   (harness.ADMIN_USERNAME, 'admin@example.com', password, 'admin'))
+    connection.commit()
+
+    insert_chunks(connection, '''
+        INSERT INTO employees
+        (employee_id, full_name, department, position, hire_date, contact_number, email, address)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ''', employee_rows(employees, rng), chunk_size)
+    cursor.execute('SELECT id, employee_id FROM employees ORDER BY id')
+    employee_pks = [row[0] for row in cursor.fetchall()]
+
+    # Login accounts for the first `accounts` employees
+    users = [(harness.EMPLOYEE_USERNAME.format(i), f'employee{i}@example.com', password, 'employee')
+             for i in range(min(accounts, employees))]
+    insert_chunks(connection, 'INSERT INTO users (username, email, password, role) VALUES (%s, %s, %s, %s)',
+                  users, chunk_size)
+    cursor.execute('''
+        UPDATE employees e
+        JOIN users u ON u.username = CONCAT('bench_emp', SUBSTRING(e.employee_id, 4))
+        SET e.user_id = u.id
+    ''')
+    connection.commit()
+
+    written = insert_chunks(connection, '''
+        INSERT INTO attendance (employee_id, date, time_in, time_out, status)
+        VALUES (%s, %s, %s, %s, %s)
+    ''', attendance_rows(employee_pks, days, late_after, rng), chunk_size)
+    cursor.close()
+    return written
+
+
+def reset(connection):
+    cursor = connection.cursor()
+    cursor.execute('SET FOREIGN_KEY_CHECKS = 0')
+    for table in ('attendance', 'reports', 'employees', 'users'):
+        cursor.execute(f'TRUNCATE TABLE {table}')
+    cursor.execute('SET FOREIGN_KEY_CHECKS = 1')
+    connection.commit()
+    cursor.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=harness.DEFAULT_DATABASE,
+                        help='Created if missing; never point this at real data with --reset.')
+    parser.add_argument('--employees', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--accounts', type=int, default=200, help='Employees that get a login.')
+    parser.add_argument('--seed', type=int, default=33)
+    parser.add_argument('--reset', action='store_true', help='Empty the tables first.')
+    args = parser.parse_args()
+
+    app_module = harness.load_app(args.database, create=True)
+    import migrations
+
+    with app_module.app.app_context():
+        connection = app_module.db.connection
+        migrations.upgrade(connection)
+        if args.reset:
+            reset(connection)
+        started = time.perf_counter()
+        written = seed(connection, args.employees, args.days, args.accounts,
+                       app_module.app.config['ATTENDANCE_RULES']['default']['shift_start'], random.Random(args.seed))
+        print(f'{args.employees} employees, {written} attendance rows in '
+              f'{time.perf_counter() - started:.1f}s ({args.database})')
@@ -0,0 +1,143 @@
+# Password hashing and verification off the request threads, plus login
+# rate limiting.
+#
+# Hashes are computed in a small spawn process pool so a wave of logins
+# keeps request threads free for other routes. At most `max_pending` jobs
+# may be queued or running; past that `CredentialsBusy` is raised at once
+# (the app turns it into a 503) instead of letting requests pile up behind
+# the pool. Hashes made with another method or cost than the configured
+# one are replaced on the next successful login.
+#
+# Rate limits are per process, like the dashboard cache: with several
+# workers an attacker gets each limit once per worker.
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class CredentialsBusy(Exception):
+    pass
+
+
+def hash_method(password_hash):
+    # 'scrypt:32768:8:1$salt$hash' -> 'scrypt:32768:8:1'
+    return password_hash.split('$', 1)[0]
+
+
+def verify_and_rehash(password_hash, password, method):
+    # Runs in a worker, for hashes whose method or cost is outdated
+    if not check_password_hash(password_hash, password):
+        return False, None
+    return True, generate_password_hash(password, method)
+
+
+class CredentialService:
+    def __init__(self, method='scrypt', workers=2, max_pending=32, timeout=10.0):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._method_prefix = None
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise CredentialsBusy()
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                executor = self._executor
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise CredentialsBusy()
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool on the next call
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise CredentialsBusy()
+
+    def needs_rehash(self, password_hash):
+        if self._method_prefix is None:
+            self._method_prefix = hash_method(self._submit(generate_password_hash, '', self.method))
+        return hash_method(password_hash) != self._method_prefix
+
+    def hash_password(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        # -> (matches, replacement hash or None)
+        if not self.needs_rehash(password_hash):
+            return self._submit(check_password_hash, password_hash, password), None
+        return self._submit(verify_and_rehash, password_hash, password, self.method)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RateLimiter:
+    # Sliding window: at most `limit` hits per key in any `window` seconds
+    def __init__(self, limit, window, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._hits = {}  # key -> deque of monotonic timestamps
+
+    def _prune(self, hits, now):
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+
+    def retry_after(self, key):
+        # Seconds until `key` may try again, 0 when it is not limited
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                return 0
+            self._prune(hits, now)
+            if len(hits) < self.limit:
+                return 0
+            return max(1, int(hits[0] + self.window - now) + 1)
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                if len(self._hits) >= self.max_keys:
+                    self._evict(now)
+                hits = self._hits[key] = deque()
+            self._prune(hits, now)
+            hits.append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+    def _evict(self, now):
+        # Drop keys whose hits have all expired; if that is not enough, the
+        # oldest half (dicts keep insertion order)
+        for key in [key for key, hits in self._hits.items() if not hits or hits[-1] <= now - self.window]:
+            del self._hits[key]
+        if len(self._hits) >= self.max_keys:
+            for key in list(self._hits)[:len(self._hits) // 2]:
+                del self._hits[key]
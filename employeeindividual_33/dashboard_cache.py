@@ -0,0 +1,56 @@
+# In-process cache for the admin dashboard: today's counters plus a small
+# ring buffer of recent punches. It is rebuilt from the database at most
+# once per TTL; in between, clock-ins handled by this process update it in
+# place (write-through) and other attendance writes invalidate it. With
+# several workers, each one's view lags the others' clock-ins by at most
+# the TTL.
+import threading
+import time
+from collections import deque
+
+
+class DailySummaryCache:
+    def __init__(self, ttl=30.0, recent_size=10):
+        self.ttl = ttl
+        self.recent_size = recent_size
+        self._lock = threading.Lock()
+        self._day = None
+        self._summary = None
+        self._recent = deque(maxlen=recent_size)
+        self._expires = 0.0
+
+    def get(self, day, loader):
+        # loader(day) -> (summary dict, list of recent records, newest first)
+        with self._lock:
+            if self._day == day and time.monotonic() < self._expires:
+                return dict(self._summary), list(self._recent)
+        summary, recent = loader(day)
+        with self._lock:
+            self._day = day
+            self._summary = dict(summary)
+            self._recent = deque(recent, maxlen=self.recent_size)
+            self._expires = time.monotonic() + self.ttl
+        return dict(summary), list(recent)
+
+    def record_time_in(self, day, record):
+        # record: employee_id, full_name, date, time_in, time_out, status
+        with self._lock:
+            if self._day != day or self._summary is None:
+                return
+            self._summary['present_count'] = (self._summary['present_count'] or 0) + 1
+            self._summary['absent_count'] = max((self._summary['absent_count'] or 0) - 1, 0)
+            if record['status'] == 'late':
+                self._summary['late_count'] = (self._summary['late_count'] or 0) + 1
+            self._recent.appendleft(record)
+
+    def record_time_out(self, day, employee_id, time_out):
+        with self._lock:
+            if self._day != day:
+                return
+            for record in self._recent:
+                if record['employee_id'] == employee_id and record['date'] == day:
+                    record['time_out'] = time_out
+
+    def invalidate(self):
+        with self._lock:
+            self._expires = 0.0
@@ -0,0 +1,38 @@
+# Change counters for the JSON API's ETags: one row per dataset in the
+# data_versions table, bumped after every committed write to it. Reading
+# them is a primary-key lookup, so a client whose ETag is current gets its
+# 304 without any query against attendance or employees.
+#
+# The bump usually runs after the writer's commit, in its own short
+# statement, so long writes never hold the counter row for a whole
+# transaction. A client that reads in the gap between the two sees new data
+# under the old tag and simply refetches once the counter moves. Punches
+# are a single statement, so they bump as the last statement of their own
+# transaction instead (commit=False) and pay for one commit, not two.
+DATASETS = ('attendance', 'employees')
+
+# {placeholders}: one %s per dataset name
+FETCH_QUERY = 'SELECT name, version FROM data_versions WHERE name IN ({placeholders}) ORDER BY name'
+
+
+def bump(connection, *names, commit=True):
+    cursor = connection.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(names))
+        cursor.execute(f'UPDATE data_versions SET version = version + 1 WHERE name IN ({placeholders})',
+                       sorted(names))
+        if commit:
+            connection.commit()
+    finally:
+        cursor.close()
+
+
+def fetch(connection, *names):
+    # -> 'attendance.41:employees.7' for the requested datasets
+    cursor = connection.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(names))
+        cursor.execute(FETCH_QUERY.format(placeholders=placeholders), names)
+        return ':'.join(f'{name}.{version}' for name, version in cursor.fetchall())
+    finally:
+        cursor.close()
@@ -0,0 +1,214 @@
+# Data-access layer: a bounded MySQL connection pool plus the Flask glue
+# that hands each request one pooled connection and closes its cursors.
+import threading
+import time
+
+import MySQLdb
+import MySQLdb.cursors
+from flask import g
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, maxsize=10, timeout=5.0, ping_after=30.0, recycle=3600.0, **connect_args):
+        # maxsize: connections open at most; timeout: seconds to wait for one;
+        # ping_after: idle seconds after which a connection is checked before
+        # reuse; recycle: age in seconds after which it is replaced
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.recycle = recycle
+        self.connect_args = connect_args
+        self.factory = MySQLdb.connect  # called with connect_args to open a connection
+        self._idle = []  # (connection, created_at, released_at), most recent last
+        self._created = {}  # id(connection) -> created_at, for connections in use
+        self._size = 0
+        self._condition = threading.Condition()
+        self._metrics = {
+            'acquired': 0,
+            'created': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'waiting': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    def _connect(self):
+        connection = self.factory(**self.connect_args)
+        with self._condition:
+            self._metrics['created'] += 1
+        return connection
+
+    def _healthy(self, connection, created_at, released_at):
+        now = time.monotonic()
+        if now - created_at > self.recycle:
+            return False
+        if now - released_at > self.ping_after:
+            try:
+                connection.ping()
+            except MySQLdb.Error:
+                return False
+        return True
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except MySQLdb.Error:
+            pass
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._condition:
+            self._metrics['waiting'] += 1
+            try:
+                while not self._idle and self._size >= self.maxsize:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                    self._condition.wait(remaining)
+                if self._idle:
+                    connection, created_at, released_at = self._idle.pop()
+                else:
+                    # Reserve the slot now, connect outside the lock
+                    connection, created_at, released_at = None, None, None
+                    self._size += 1
+            finally:
+                self._metrics['waiting'] -= 1
+            waited = time.monotonic() - started
+            self._metrics['acquired'] += 1
+            self._metrics['wait_seconds_total'] += waited
+            self._metrics['wait_seconds_max'] = max(self._metrics['wait_seconds_max'], waited)
+
+        try:
+            if connection is not None and not self._healthy(connection, created_at, released_at):
+                self._close(connection)
+                with self._condition:
+                    self._metrics['discarded'] += 1
+                connection = None
+            if connection is None:
+                connection = self._connect()
+                created_at = time.monotonic()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._created[id(connection)] = created_at
+        return connection
+
+    def release(self, connection, discard=False):
+        # End whatever transaction the request left open so the next user
+        # does not inherit its locks or its REPEATABLE READ snapshot
+        if not discard:
+            try:
+                connection.rollback()
+            except MySQLdb.Error:
+                discard = True
+        with self._condition:
+            created_at = self._created.pop(id(connection), time.monotonic())
+            if discard:
+                self._size -= 1
+                self._metrics['discarded'] += 1
+            else:
+                self._idle.append((connection, created_at, time.monotonic()))
+            self._condition.notify()
+        if discard:
+            self._close(connection)
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self._metrics)
+            stats['size'] = self._size
+            stats['max_size'] = self.maxsize
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+        return stats
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for connection, _, _ in idle:
+            self._close(connection)
+
+
+class Database:
+    # Drop-in for flask_mysqldb's MySQL: `db.connection` is the request's
+    # pooled connection and every cursor handed out is closed at teardown.
+    def __init__(self, app=None):
+        self.pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MYSQL_HOST', 'localhost')
+        app.config.setdefault('MYSQL_USER', None)
+        app.config.setdefault('MYSQL_PASSWORD', None)
+        app.config.setdefault('MYSQL_DB', None)
+        app.config.setdefault('MYSQL_PORT', 3306)
+        app.config.setdefault('MYSQL_CHARSET', 'utf8mb4')
+        app.config.setdefault('DB_POOL_SIZE', 10)
+        app.config.setdefault('DB_POOL_TIMEOUT', 5.0)
+        app.config.setdefault('DB_POOL_PING_AFTER', 30.0)
+        app.config.setdefault('DB_POOL_RECYCLE', 3600.0)
+
+        connect_args = {
+            'host': app.config['MYSQL_HOST'],
+            'port': app.config['MYSQL_PORT'],
+            'charset': app.config['MYSQL_CHARSET'],
+        }
+        if app.config['MYSQL_USER'] is not None:
+            connect_args['user'] = app.config['MYSQL_USER']
+        if app.config['MYSQL_PASSWORD'] is not None:
+            connect_args['passwd'] = app.config['MYSQL_PASSWORD']
+        if app.config['MYSQL_DB'] is not None:
+            connect_args['db'] = app.config['MYSQL_DB']
+
+        self.pool = ConnectionPool(maxsize=app.config['DB_POOL_SIZE'],
+                                   timeout=app.config['DB_POOL_TIMEOUT'],
+                                   ping_after=app.config['DB_POOL_PING_AFTER'],
+                                   recycle=app.config['DB_POOL_RECYCLE'],
+                                   **connect_args)
+        app.teardown_appcontext(self.teardown)
+
+    @property
+    def connection(self):
+        if '_db_connection' not in g:
+            g._db_connection = self.pool.acquire()
+            g._db_cursors = []
+        return g._db_connection
+
+    def cursor(self, cursorclass=MySQLdb.cursors.DictCursor):
+        # Usable as `with db.cursor() as cursor:` or plainly; either way the
+        # cursor is closed before the connection goes back to the pool
+        cursor = self.connection.cursor(cursorclass)
+        g._db_cursors.append(cursor)
+        return cursor
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def teardown(self, exception):
+        connection = g.pop('_db_connection', None)
+        if connection is None:
+            return
+        discard = False
+        for cursor in g.pop('_db_cursors', []):
+            try:
+                cursor.close()
+            except MySQLdb.Error:
+                # An unbuffered cursor that could not be drained leaves the
+                # connection in an unknown state
+                discard = True
+        self.pool.release(connection, discard=discard)
@@ -0,0 +1,311 @@
+# Bulk employee import and export (CSV or XLSX).
+#
+# An import file has one employee per row with the EXPORT_COLUMNS headers;
+# only employee_id and full_name are required, and columns the file leaves
+# out keep their stored values. Rows are validated as one DataFrame,
+# compared with the existing employees in a single query and written with
+# chunked multi-row upserts in one transaction. A row with a
+# username and password also gets a login if its employee has none yet;
+# those passwords are hashed in a process pool. Exports use the same
+# columns, so an export can be edited and imported again.
+import csv
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from io import BytesIO, StringIO
+
+import MySQLdb.cursors
+import pandas as pd
+import xlsxwriter
+from werkzeug.security import generate_password_hash
+
+import rollups
+
+EMPLOYEE_COLUMNS = ['employee_id', 'full_name', 'department', 'position', 'hire_date',
+                    'contact_number', 'email', 'address']
+ACCOUNT_COLUMNS = ['username', 'password']
+EXPORT_COLUMNS = EMPLOYEE_COLUMNS + ['username']
+REQUIRED_COLUMNS = ['employee_id', 'full_name']
+
+# Column limits of the employees table (see migrations.create_tables)
+MAX_LENGTHS = {
+    'employee_id': 20,
+    'full_name': 100,
+    'department': 50,
+    'position': 50,
+    'contact_number': 20,
+    'email': 100,
+    'username': 50,
+}
+
+# Same rules as the registration form
+EMAIL_PATTERN = r'[^@]+@[^@]+\.[^@]+'
+USERNAME_PATTERN = r'[A-Za-z0-9]+'
+
+# {updates}: one `column = VALUES(column),` per column present in the file
+UPSERT_QUERY = '''
+    INSERT INTO employees
+    (employee_id, full_name, department, position, hire_date, contact_number, email, address, user_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        {updates}
+        user_id = COALESCE(user_id, VALUES(user_id))
+'''
+
+EXPORT_QUERY = '''
+    SELECT e.employee_id, e.full_name, e.department, e.position, e.hire_date,
+           e.contact_number, e.email, e.address, u.username
+    FROM employees e
+    LEFT JOIN users u ON u.id = e.user_id
+    ORDER BY e.employee_id
+'''
+
+
+def read_file(data, format_type):
+    # -> (DataFrame of strings with normalized headers, '' for blanks, the
+    # EMPLOYEE_COLUMNS the file has). Absent columns are filled with ''.
+    if format_type == 'excel':
+        try:
+            frame = pd.read_excel(BytesIO(data), dtype=str)
+        except ImportError:
+            raise ValueError('Reading XLSX files needs the openpyxl package')
+        except (zipfile.BadZipFile, KeyError) as e:
+            # Not an XLSX file, or a damaged one
+            raise ValueError('Not a readable XLSX file') from e
+    else:
+        frame = pd.read_csv(StringIO(data.decode('utf-8-sig')), dtype=str, keep_default_na=False,
+                            quoting=csv.QUOTE_MINIMAL)
+    frame.columns = [str(column).strip().lower().replace(' ', '_') for column in frame.columns]
+    missing = [column for column in REQUIRED_COLUMNS if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    present = [column for column in EMPLOYEE_COLUMNS if column in frame.columns]
+    for column in EMPLOYEE_COLUMNS + ACCOUNT_COLUMNS:
+        if column not in frame.columns:
+            frame[column] = ''
+    frame = frame[EMPLOYEE_COLUMNS + ACCOUNT_COLUMNS].fillna('').astype(str)
+    frame = frame.apply(lambda column: column.str.strip())
+    frame.insert(0, 'line', frame.index + 2)  # header is line 1
+    return frame, present
+
+
+def validate(frame, today=None):
+    # Vectorized checks; returns (valid rows, rejects). Later checks win,
+    # so each rejected line reports its most basic problem.
+    today = today or date.today()
+    frame = frame.copy()
+    hire_dates = pd.to_datetime(frame['hire_date'], errors='coerce', format='mixed')
+
+    reasons = pd.Series('', index=frame.index)
+    for column, limit in MAX_LENGTHS.items():
+        reasons = reasons.mask(frame[column].str.len() > limit, f'{column} is longer than {limit} characters')
+    has_username = frame['username'] != ''
+    reasons = reasons.mask(has_username & (frame['password'] == ''), 'password is required with a username')
+    reasons = reasons.mask(has_username & ~frame['username'].str.fullmatch(USERNAME_PATTERN),
+                           'username must contain only letters and numbers')
+    reasons = reasons.mask(has_username & frame['username'].duplicated(keep=False),
+                           'username appears more than once in the file')
+    reasons = reasons.mask((frame['email'] != '') & ~frame['email'].str.fullmatch(EMAIL_PATTERN),
+                           'invalid email address')
+    reasons = reasons.mask(hire_dates > pd.Timestamp(today), 'hire_date is in the future')
+    reasons = reasons.mask((frame['hire_date'] != '') & hire_dates.isna(), 'invalid hire_date')
+    reasons = reasons.mask(frame['employee_id'].duplicated(keep=False),
+                           'employee_id appears more than once in the file')
+    reasons = reasons.mask(frame['full_name'] == '', 'missing full_name')
+    reasons = reasons.mask(frame['employee_id'] == '', 'missing employee_id')
+
+    frame['hire_date'] = [value.date() if pd.notna(value) else None for value in hire_dates]
+    bad = reasons != ''
+    rejects = [{'line': int(line), 'reason': reason} for line, reason in zip(frame.loc[bad, 'line'], reasons[bad])]
+    return frame[~bad], rejects
+
+
+def hash_passwords(passwords, workers=None, method='scrypt'):
+    # Hashing is deliberately slow; spread it over processes for big files
+    if workers == 0 or len(passwords) < 8:
+        return [generate_password_hash(password, method) for password in passwords]
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        return list(pool.map(generate_password_hash, passwords, [method] * len(passwords),
+                             chunksize=max(1, len(passwords) // (4 * workers))))
+
+
+def as_text(series):
+    # Comparable text for a column of strings, dates and NULLs
+    return series.map(lambda value: '' if value is None or value is pd.NaT or value != value else str(value))
+
+
+def fetch_existing(connection, codes):
+    # The whole diff base in one query
+    columns = ['id', 'employee_id', 'full_name', 'department', 'position', 'hire_date',
+               'contact_number', 'email', 'address', 'user_id']
+    if not codes:
+        return pd.DataFrame(columns=columns)
+    cursor = connection.cursor(MySQLdb.cursors.Cursor)
+    try:
+        placeholders = ', '.join(['%s'] * len(codes))
+        cursor.execute(f"SELECT {', '.join(columns)} FROM employees WHERE employee_id IN ({placeholders})", codes)
+        return pd.DataFrame(list(cursor.fetchall()), columns=columns)
+    finally:
+        cursor.close()
+
+
+def taken_usernames(connection, usernames):
+    # -> {username: users.id} for the names that already exist
+    if not usernames:
+        return {}
+    cursor = connection.cursor(MySQLdb.cursors.Cursor)
+    try:
+        placeholders = ', '.join(['%s'] * len(usernames))
+        cursor.execute(f'SELECT username, id FROM users WHERE username IN ({placeholders})', usernames)
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def diff(connection, frame, columns=EMPLOYEE_COLUMNS):
+    # -> frame with `action` (insert / update / unchanged), `employee_pk`,
+    # `current_department`, `create_account`, plus rejects for taken
+    # usernames. Only `columns` (those in the file) are compared.
+    existing = fetch_existing(connection, frame['employee_id'].tolist())
+    merged = frame.merge(existing, on='employee_id', how='left', suffixes=('', '_current'), indicator=True)
+    merged.index = frame.index
+    new = merged['_merge'] == 'left_only'
+    changed = pd.Series(False, index=merged.index)
+    for column in columns[1:]:
+        changed |= as_text(merged[column]) != as_text(merged[column + '_current'])
+
+    create_account = (merged['username'] != '') & merged['user_id'].isna()
+    taken = taken_usernames(connection, merged.loc[create_account, 'username'].tolist())
+    clash = create_account & merged['username'].isin(list(taken))
+    rejects = [{'line': int(line), 'reason': 'username is already taken'} for line in merged.loc[clash, 'line']]
+    merged = merged[~clash]
+    create_account = create_account[~clash]
+    new, changed = new[~clash], changed[~clash]
+
+    merged['action'] = 'unchanged'
+    merged.loc[changed | create_account, 'action'] = 'update'
+    merged.loc[new, 'action'] = 'insert'
+    merged['create_account'] = create_account
+    merged['employee_pk'] = merged['id']
+    merged['current_department'] = merged['department_current']
+    return merged, rejects
+
+
+def import_employees(connection, data, format_type, rules, chunk_size=1000, hash_workers=None,
+                     hash_method='scrypt', dry_run=False):
+    frame, columns = read_file(data, format_type)
+    received = len(frame)
+    frame, rejects = validate(frame)
+    frame, taken = diff(connection, frame, columns)
+    rejects += taken
+
+    writes = frame[frame['action'] != 'unchanged']
+    accounts = writes[writes['create_account']]
+    result = {
+        'received': received,
+        'inserted': int((writes['action'] == 'insert').sum()),
+        'updated': int((writes['action'] == 'update').sum()),
+        'unchanged': int((frame['action'] == 'unchanged').sum()),
+        'accounts_created': len(accounts),
+        'rejected': sorted(rejects, key=lambda reject: reject['line']),
+        'dry_run': dry_run,
+    }
+    if dry_run or writes.empty:
+        return result
+
+    def nullable(value):
+        return None if value == '' else value
+
+    cursor = connection.cursor(MySQLdb.cursors.Cursor)
+    try:
+        user_ids = {}
+        if len(accounts):
+            hashes = hash_passwords(accounts['password'].tolist(), hash_workers, hash_method)
+            users = [(username, email, password_hash, 'employee')
+                     for username, email, password_hash in zip(accounts['username'], accounts['email'], hashes)]
+            for start in range(0, len(users), chunk_size):
+                cursor.executemany('INSERT INTO users (username, email, password, role) VALUES (%s, %s, %s, %s)',
+                                   users[start:start + chunk_size])
+            user_ids = taken_usernames(connection, accounts['username'].tolist())
+
+        # Employees changing department take their attendance days with them
+        moved_ids = []
+        if 'department' in columns:
+            moved = writes[(writes['action'] == 'update')
+                           & (as_text(writes['department']) != as_text(writes['current_department']))]
+            moved_ids = [int(value) for value in moved['employee_pk']]
+        old_rows = []
+        if moved_ids:
+            placeholders = ', '.join(['%s'] * len(moved_ids))
+            old_rows = rollups.fetch_rows(connection, f'a.employee_id IN ({placeholders})', moved_ids, lock=True)
+
+        rows = [
+            (row.employee_id, row.full_name, nullable(row.department), nullable(row.position), row.hire_date,
+             nullable(row.contact_number), nullable(row.email), nullable(row.address),
+             user_ids.get(row.username) if row.create_account else None)
+            for row in writes.itertuples(index=False)
+        ]
+        # Absent columns are NULL for new employees and left alone for others
+        upsert = UPSERT_QUERY.format(updates=''.join(f'{column} = VALUES({column}), ' for column in columns[1:]))
+        for start in range(0, len(rows), chunk_size):
+            cursor.executemany(upsert, rows[start:start + chunk_size])
+
+        if moved_ids:
+            new_rows = rollups.fetch_rows(connection, f'a.employee_id IN ({placeholders})', moved_ids)
+            rollups.apply_changes(connection, old_rows, new_rows, rules)
+        connection.commit()
+    except MySQLdb.IntegrityError as e:
+        # A username registered between the diff and the insert
+        connection.rollback()
+        raise ValueError(f'The data changed during the import, nothing was written; try again ({e.args[-1]})') from e
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return result
+
+
+def iter_export_rows(connection, chunk_size=1000):
+    # Unbuffered, so a large roster is never held in memory at once
+    cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+    try:
+        cursor.execute(EXPORT_QUERY)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def iter_export_csv(connection, chunk_size=1000):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for rows in iter_export_rows(connection, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(['' if value is None else value for value in row] for row in rows)
+        yield buffer.getvalue()
+
+
+def write_export_excel(connection, output, chunk_size=1000):
+    # output: path or binary file object
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'})
+    try:
+        worksheet = workbook.add_worksheet('Employees')
+        worksheet.write_row(0, 0, EXPORT_COLUMNS, workbook.add_format({'bold': True}))
+        row_number = 1
+        for rows in iter_export_rows(connection, chunk_size):
+            for row in rows:
+                worksheet.write_row(row_number, 0, row)
+                row_number += 1
+    finally:
+        workbook.close()
@@ -0,0 +1,224 @@
+# Bulk ingestion of badge-reader / kiosk punch events.
+#
+# Events arrive as NDJSON ({"employee_id": ..., "timestamp": ..., "type": "in"|"out"})
+# or CSV with the same columns; "type" is optional. They are validated as one
+# DataFrame, employee codes are resolved in a single lookup, punches are
+# folded into one (employee, date) row each and upserted with executemany.
+# Timestamps with an offset are moved to the local time of the employee's
+# department; naive ones are taken as already local. That is decided per
+# row, so one batch may mix both. Statuses follow the
+# attendance rules (rules.py) and are re-evaluated once a day's time out
+# is known.
+import csv
+import json
+from io import StringIO
+
+import pandas as pd
+
+import rollups
+from archive import archived_months
+from rules import update_statuses
+
+EVENT_COLUMNS = ['employee_id', 'timestamp', 'type']
+PUNCH_TYPES = {'', 'in', 'out'}
+
+# A UTC offset after the time of day: Z, UTC, +08, +08:00 or -0500
+OFFSET_PATTERN = r'(?i)\d:\d{2}(?::\d{2}(?:\.\d+)?)?\s*(?:Z|UTC|[+-]\d{2}(?::?\d{2})?)$'
+
+# Earliest time in and latest time out win, whichever batch they came in.
+# Assignments run left to right, so status is decided against the old time_in.
+UPSERT_QUERY = '''
+    INSERT INTO attendance (employee_id, date, time_in, time_out, status)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        status = IF(VALUES(time_in) IS NOT NULL AND (time_in IS NULL OR VALUES(time_in) < time_in),
+                    VALUES(status), status),
+        time_in = IF(time_in IS NULL, VALUES(time_in), LEAST(time_in, COALESCE(VALUES(time_in), time_in))),
+        time_out = IF(time_out IS NULL, VALUES(time_out), GREATEST(time_out, COALESCE(VALUES(time_out), time_out)))
+'''
+
+
+def read_ndjson(text):
+    records = []
+    rejects = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            rejects.append({'line': number, 'reason': 'invalid JSON'})
+            continue
+        if not isinstance(event, dict):
+            rejects.append({'line': number, 'reason': 'expected a JSON object'})
+            continue
+        records.append([number] + [event.get(column) for column in EVENT_COLUMNS])
+    frame = pd.DataFrame(records, columns=['line'] + EVENT_COLUMNS)
+    return frame, rejects
+
+
+def read_csv(text):
+    frame = pd.read_csv(StringIO(text), dtype=str, keep_default_na=False, quoting=csv.QUOTE_MINIMAL)
+    for column in EVENT_COLUMNS:
+        if column not in frame.columns:
+            frame[column] = ''
+    frame['line'] = frame.index + 2  # header is line 1
+    return frame[['line'] + EVENT_COLUMNS], []
+
+
+def validate(frame):
+    # Vectorized checks; returns (valid rows, rejects)
+    frame = frame.copy()
+    frame['employee_id'] = frame['employee_id'].fillna('').astype(str).str.strip()
+    frame['type'] = frame['type'].fillna('').astype(str).str.strip().str.lower()
+    # Decided per row: a batch may mix offsets (across a DST change) and
+    # naive local times. Offset rows become naive UTC, naive rows stay as
+    # they are.
+    raw = frame['timestamp'].fillna('').astype(str).str.strip()
+    frame['zoned'] = raw.str.contains(OFFSET_PATTERN)
+    zoned = pd.to_datetime(raw.where(frame['zoned']), errors='coerce', utc=True).dt.tz_convert(None)
+    naive = pd.to_datetime(raw.where(~frame['zoned']), errors='coerce')
+    frame['timestamp'] = zoned.where(frame['zoned'], naive)
+
+    reasons = pd.Series('', index=frame.index)
+    reasons = reasons.mask(~frame['type'].isin(PUNCH_TYPES), 'type must be "in" or "out"')
+    reasons = reasons.mask(frame['timestamp'].isna(), 'invalid or missing timestamp')
+    reasons = reasons.mask(frame['employee_id'] == '', 'missing employee_id')
+
+    bad = reasons != ''
+    rejects = [{'line': int(line), 'reason': reason}
+               for line, reason in zip(frame.loc[bad, 'line'], reasons[bad])]
+    return frame[~bad], rejects
+
+
+def resolve_employees(connection, frame, chunk_size=1000):
+    # Employee codes -> internal ids and departments, one query per chunk
+    # of distinct codes
+    codes = frame['employee_id'].unique().tolist()
+    mapping = {}
+    departments = {}
+    cursor = connection.cursor()
+    try:
+        for start in range(0, len(codes), chunk_size):
+            chunk = codes[start:start + chunk_size]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'''
+                SELECT employee_id, id, COALESCE(department, '') FROM employees
+                WHERE employee_id IN ({placeholders})
+            ''', chunk)
+            for code, employee_pk, department in cursor.fetchall():
+                mapping[code] = employee_pk
+                departments[code] = department
+    finally:
+        cursor.close()
+
+    frame = frame.copy()
+    frame['employee_pk'] = frame['employee_id'].map(mapping)
+    frame['department'] = frame['employee_id'].map(departments)
+    unknown = frame['employee_pk'].isna()
+    rejects = [{'line': int(line), 'reason': 'unknown employee_id'} for line in frame.loc[unknown, 'line']]
+    return frame[~unknown], rejects
+
+
+def reject_archived(connection, frame):
+    # Archived months are read-only (see archive.py)
+    if frame.empty:
+        return frame, []
+    months = archived_months(connection, frame['timestamp'].min().date(), frame['timestamp'].max().date())
+    if not months:
+        return frame, []
+    archived = frame['timestamp'].dt.to_period('M').dt.start_time.dt.date.isin(months)
+    rejects = [{'line': int(line), 'reason': 'month is archived'} for line in frame.loc[archived, 'line']]
+    return frame[~archived], rejects
+
+
+def fold_punches(frame, rules):
+    # One row per (employee, date): typed punches go to their own column; an
+    # untyped punch counts as a time in if it is the day's first and as a
+    # time out if it is the last of several
+    frame = frame.copy()
+    frame['employee_pk'] = frame['employee_pk'].astype(int)
+    frame['day'] = frame['timestamp'].dt.normalize()
+    keys = ['employee_pk', 'day']
+
+    grouped = frame.groupby(keys)['timestamp']
+    untyped = frame['type'] == ''
+    first = grouped.transform('min') == frame['timestamp']
+    last = grouped.transform('max') == frame['timestamp']
+    several = grouped.transform('count') > 1
+
+    frame['time_in'] = frame['timestamp'].where((frame['type'] == 'in') | (untyped & first))
+    frame['time_out'] = frame['timestamp'].where((frame['type'] == 'out') | (untyped & last & several & ~first))
+
+    days = frame.groupby(keys).agg(time_in=('time_in', 'min'), time_out=('time_out', 'max'),
+                                   department=('department', 'first')).reset_index()
+    # Judged on this batch's punches only; the rows are re-evaluated after
+    # the upsert has merged them with what was stored
+    days['status'] = rules.evaluate(pd.DataFrame({
+        'department': days['department'],
+        'status': 'present',
+        'time_in': days['time_in'] - days['day'],
+        'time_out': days['time_out'] - days['day'],
+    }))
+    days['date'] = days['day'].dt.date
+    for column in ('time_in', 'time_out'):
+        days[column] = [value.time() if pd.notna(value) else None for value in days[column]]
+    return days
+
+
+def ingest_events(connection, text, format_type, rules, chunk_size=5000, on_commit=None):
+    # on_commit(dates) runs after each chunk's commit, so a caller can
+    # invalidate what was written even when a later chunk fails
+    if format_type == 'csv':
+        frame, rejects = read_csv(text)
+    else:
+        frame, rejects = read_ndjson(text)
+    received = len(frame) + len(rejects)
+
+    frame, invalid = validate(frame)
+    rejects += invalid
+    frame, unknown = resolve_employees(connection, frame)
+    rejects += unknown
+    zoned = frame['zoned']
+    if zoned.any():
+        frame.loc[zoned, 'timestamp'] = rules.localize(frame.loc[zoned, 'timestamp'],
+                                                       frame.loc[zoned, 'department'])
+    frame, archived = reject_archived(connection, frame)
+    rejects += archived
+
+    days = fold_punches(frame, rules) if len(frame) else pd.DataFrame(
+        columns=['employee_pk', 'date', 'time_in', 'time_out', 'status'])
+    rows = [(int(employee_pk), day, time_in, time_out, status) for employee_pk, day, time_in, time_out, status
+            in days[['employee_pk', 'date', 'time_in', 'time_out', 'status']].itertuples(index=False, name=None)]
+
+    # Chunked transactions keep lock time and undo size bounded. Each chunk
+    # locks the days it touches, upserts them, re-evaluates their statuses
+    # and moves the rollups by the difference between the rows before and
+    # after.
+    cursor = connection.cursor()
+    try:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            keys = [(row[0], row[1]) for row in chunk]
+            old_rows = rollups.fetch_keys(connection, keys, lock=True)
+            cursor.executemany(UPSERT_QUERY, chunk)
+            new_rows = rollups.fetch_keys(connection, keys)
+            update_statuses(connection, new_rows, rules)
+            rollups.apply_changes(connection, old_rows, new_rows, rules)
+            connection.commit()
+            if on_commit:
+                on_commit({row[1] for row in chunk})
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    rejects.sort(key=lambda reject: reject['line'])
+    return {
+        'received': received,
+        'accepted': len(frame),
+        'days_written': len(rows),
+        'dates': sorted({str(value) for value in days['date']}),
+        'rejected': rejects,
+    }
@@ -0,0 +1,305 @@
+# Request instrumentation: wall time, SQL and template time per route,
+# exported as Prometheus text (`render_metrics`) and Server-Timing headers,
+# plus an opt-in sampling profiler for slow requests.
+#
+# SQL is timed by handing the connection pool a connection class whose
+# cursors time execute/executemany (and fetches on unbuffered cursors, where
+# MySQL does the work while rows are read). Only statements run inside a
+# request are counted; report workers and CLI commands are not.
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import MySQLdb.connections
+import MySQLdb.cursors
+from flask import before_render_template, g, has_app_context, request, template_rendered
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_TEXT_LIMIT = 200
+
+
+def clean_query(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return ' '.join(query.split())[:QUERY_TEXT_LIMIT]
+
+
+def record_query(query, seconds, count=1):
+    if not has_app_context():
+        return
+    stats = g.get('_request_stats')
+    if stats is None:
+        return
+    stats['sql_count'] += count
+    stats['sql_seconds'] += seconds
+    if query is not None and seconds > stats['slowest_seconds']:
+        stats['slowest_seconds'] = seconds
+        stats['slowest_query'] = query
+
+
+class TimedCursorMixin:
+    _timing = False
+
+    def _timed(self, method, query, *args):
+        # executemany may loop over execute; only the outer call is timed
+        if self._timing:
+            return method(query, *args)
+        self._timing = True
+        started = time.perf_counter()
+        try:
+            return method(query, *args)
+        finally:
+            self._timing = False
+            record_query(clean_query(query), time.perf_counter() - started)
+
+    def execute(self, query, args=None):
+        return self._timed(super().execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(super().executemany, query, args)
+
+    def _timed_fetch(self, method, *args):
+        if not isinstance(self, MySQLdb.cursors.CursorUseResultMixIn):
+            return method(*args)
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            # Time only: the statement was counted by execute
+            record_query(None, time.perf_counter() - started, count=0)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+@functools.lru_cache(maxsize=None)
+def timed_cursor_class(cursorclass):
+    return type('Timed' + cursorclass.__name__, (TimedCursorMixin, cursorclass), {})
+
+
+class TimedConnection(MySQLdb.connections.Connection):
+    def cursor(self, cursorclass=None):
+        return super().cursor(timed_cursor_class(cursorclass or self.cursorclass))
+
+
+class SamplingProfiler:
+    # One daemon thread samples the stacks of the threads currently serving
+    # requests every `interval` seconds. Stacks are kept as collapsed
+    # "outer;...;inner" strings, the input format of flamegraph.pl and
+    # speedscope.
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._samples = {}  # thread id -> Counter of collapsed stacks
+        self._thread = None
+
+    def start(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._samples[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            return self._samples.pop(threading.get_ident(), Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._samples:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self.collapse(frame)] += 1
+
+    def collapse(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+class Instrumentation:
+    def __init__(self, app=None, db=None):
+        self.routes = {}  # (endpoint, method) -> aggregated stats
+        self.lock = threading.Lock()
+        self.db = None
+        self.profiler = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        app.config.setdefault('SERVER_TIMING', True)
+        app.config.setdefault('PROFILE_SLOW_REQUESTS', None)  # seconds; None disables the profiler
+        app.config.setdefault('PROFILE_INTERVAL', 0.005)
+        app.config.setdefault('PROFILE_FOLDER', 'profiles')
+        self.app = app
+        self.db = db
+        if db is not None:
+            db.pool.factory = TimedConnection
+        if app.config['PROFILE_SLOW_REQUESTS'] is not None:
+            self.profiler = SamplingProfiler(app.config['PROFILE_INTERVAL'])
+            os.makedirs(app.config['PROFILE_FOLDER'], exist_ok=True)
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        # Teardown rather than after_request, so streamed responses are
+        # measured until their last chunk
+        app.teardown_request(self.teardown_request)
+        before_render_template.connect(self.before_render, app, weak=False)
+        template_rendered.connect(self.after_render, app, weak=False)
+
+    def before_request(self):
+        g._request_stats = {
+            'started': time.perf_counter(),
+            'sql_count': 0,
+            'sql_seconds': 0.0,
+            'slowest_seconds': 0.0,
+            'slowest_query': None,
+            'template_seconds': 0.0,
+            'template_started': None,
+        }
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def before_render(self, sender, template, context, **extra):
+        stats = g.get('_request_stats')
+        if stats is not None:
+            stats['template_started'] = time.perf_counter()
+
+    def after_render(self, sender, template, context, **extra):
+        stats = g.get('_request_stats')
+        if stats is not None and stats['template_started'] is not None:
+            stats['template_seconds'] += time.perf_counter() - stats['template_started']
+            stats['template_started'] = None
+
+    def after_request(self, response):
+        stats = g.get('_request_stats')
+        if stats is None or not self.app.config['SERVER_TIMING']:
+            return response
+        elapsed = time.perf_counter() - stats['started']
+        response.headers['Server-Timing'] = ', '.join([
+            f"sql;dur={stats['sql_seconds'] * 1000:.1f};desc=\"{stats['sql_count']} queries\"",
+            f"tpl;dur={stats['template_seconds'] * 1000:.1f}",
+            f"app;dur={elapsed * 1000:.1f}",
+        ])
+        return response
+
+    def teardown_request(self, exception):
+        stats = g.pop('_request_stats', None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats['started']
+        endpoint = request.endpoint or 'unmatched'
+        key = (endpoint, request.method)
+        with self.lock:
+            route = self.routes.get(key)
+            if route is None:
+                route = self.routes[key] = {
+                    'count': 0,
+                    'errors': 0,
+                    'seconds': 0.0,
+                    'buckets': [0] * len(DURATION_BUCKETS),
+                    'sql_count': 0,
+                    'sql_seconds': 0.0,
+                    'template_seconds': 0.0,
+                    'slowest_seconds': 0.0,
+                    'slowest_query': None,
+                }
+            route['count'] += 1
+            route['errors'] += exception is not None
+            route['seconds'] += elapsed
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if elapsed <= bound:
+                    route['buckets'][i] += 1
+            route['sql_count'] += stats['sql_count']
+            route['sql_seconds'] += stats['sql_seconds']
+            route['template_seconds'] += stats['template_seconds']
+            if stats['slowest_query'] and stats['slowest_seconds'] > route['slowest_seconds']:
+                route['slowest_seconds'] = stats['slowest_seconds']
+                route['slowest_query'] = stats['slowest_query']
+
+        if self.profiler is not None:
+            samples = self.profiler.stop()
+            if elapsed >= self.app.config['PROFILE_SLOW_REQUESTS'] and samples:
+                self.dump_profile(endpoint, elapsed, samples)
+
+    def dump_profile(self, endpoint, elapsed, samples):
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{int(elapsed * 1000)}ms.folded"
+        path = os.path.join(self.app.config['PROFILE_FOLDER'], filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        return path
+
+    def render_metrics(self):
+        # Prometheus text exposition format, version 0.0.4
+        def labels(**values):
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+                       for value in values.values())
+            return '{' + ','.join(f'{name}="{value}"' for name, value in zip(values, escaped)) + '}'
+
+        with self.lock:
+            routes = {key: dict(route, buckets=list(route['buckets'])) for key, route in self.routes.items()}
+
+        lines = [
+            '# HELP app_request_duration_seconds Wall time of requests, including streamed bodies.',
+            '# TYPE app_request_duration_seconds histogram',
+        ]
+        for (endpoint, method), route in sorted(routes.items()):
+            for bound, count in zip(DURATION_BUCKETS, route['buckets']):
+                lines.append(f"app_request_duration_seconds_bucket{labels(route=endpoint, method=method, le=bound)} {count}")
+            lines.append(f"app_request_duration_seconds_bucket{labels(route=endpoint, method=method, le='+Inf')} {route['count']}")
+            lines.append(f"app_request_duration_seconds_sum{labels(route=endpoint, method=method)} {route['seconds']:.6f}")
+            lines.append(f"app_request_duration_seconds_count{labels(route=endpoint, method=method)} {route['count']}")
+
+        counters = [
+            ('app_request_errors_total', 'Requests that raised an unhandled exception.', 'errors', '{}'),
+            ('app_sql_queries_total', 'SQL statements executed by requests.', 'sql_count', '{}'),
+            ('app_sql_duration_seconds_total', 'Time requests spent in SQL.', 'sql_seconds', '{:.6f}'),
+            ('app_template_duration_seconds_total', 'Time requests spent rendering templates.',
+             'template_seconds', '{:.6f}'),
+        ]
+        for name, help_text, field, number in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for (endpoint, method), route in sorted(routes.items()):
+                lines.append(f'{name}{labels(route=endpoint, method=method)} {number.format(route[field])}')
+
+        lines.append('# HELP app_sql_slowest_query_seconds Slowest single SQL statement seen per route.')
+        lines.append('# TYPE app_sql_slowest_query_seconds gauge')
+        for (endpoint, method), route in sorted(routes.items()):
+            if route['slowest_query']:
+                lines.append(f"app_sql_slowest_query_seconds"
+                             f"{labels(route=endpoint, method=method, query=route['slowest_query'])} "
+                             f"{route['slowest_seconds']:.6f}")
+
+        if self.db is not None:
+            pool = self.db.pool.stats()
+            lines.append('# HELP app_db_pool_connections Pooled MySQL connections by state.')
+            lines.append('# TYPE app_db_pool_connections gauge')
+            lines.append(f"app_db_pool_connections{labels(state='in_use')} {pool['in_use']}")
+            lines.append(f"app_db_pool_connections{labels(state='idle')} {pool['idle']}")
+            lines.append('# HELP app_db_pool_wait_seconds_total Time spent waiting for a pooled connection.')
+            lines.append('# TYPE app_db_pool_wait_seconds_total counter')
+            lines.append(f"app_db_pool_wait_seconds_total {pool['wait_seconds_total']:.6f}")
+            lines.append('# HELP app_db_pool_timeouts_total Requests that gave up waiting for a connection.')
+            lines.append('# TYPE app_db_pool_timeouts_total counter')
+            lines.append(f"app_db_pool_timeouts_total {pool['timeouts']}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,370 @@
+# Versioned database schema.
+#
+# Each migration is (version, description, function(cursor)); `upgrade`
+# applies the ones newer than the version recorded in schema_migrations, in
+# order. MySQL commits DDL implicitly, so every step is written to be safe to
+# re-run: tables are created IF NOT EXISTS and indexes/columns are only added
+# when information_schema says they are missing. That also lets a database
+# that was created by hand before this module existed be brought up to date.
+import MySQLdb.cursors
+
+import data_versions
+
+SCHEMA_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT NOT NULL PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+'''
+
+
+def table_exists(cursor, table):
+    cursor.execute('''
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = %s
+    ''', (table,))
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table, column):
+    cursor.execute('''
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    ''', (table, column))
+    return cursor.fetchone() is not None
+
+
+def index_columns(cursor, table):
+    # index name -> (unique, [columns in index order])
+    cursor.execute('''
+        SELECT index_name, non_unique, column_name
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        ORDER BY index_name, seq_in_index
+    ''', (table,))
+    indexes = {}
+    for name, non_unique, column in cursor.fetchall():
+        indexes.setdefault(name, (not non_unique, []))[1].append(column)
+    return indexes
+
+
+def add_column(cursor, table, column, definition):
+    if not column_exists(cursor, table, column):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def add_index(cursor, table, name, columns, unique=False):
+    # Skipped when an index with the same leading columns (and at least the
+    # same uniqueness) is already there, whatever it was called
+    for existing_unique, existing_columns in index_columns(cursor, table).values():
+        if existing_columns[:len(columns)] == columns and (existing_unique or not unique):
+            if not unique or len(existing_columns) == len(columns):
+                return
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    cursor.execute(f"ALTER TABLE {table} ADD {kind} {name} ({', '.join(columns)})")
+
+
+def create_tables(cursor):
+    # The tables as app.py originally used them
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL,
+            email VARCHAR(100) NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            role ENUM('admin', 'employee') NOT NULL DEFAULT 'employee',
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS employees (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NULL,
+            employee_id VARCHAR(20) NOT NULL,
+            full_name VARCHAR(100) NOT NULL,
+            department VARCHAR(50) NULL,
+            position VARCHAR(50) NULL,
+            hire_date DATE NULL,
+            contact_number VARCHAR(20) NULL,
+            email VARCHAR(100) NULL,
+            address TEXT NULL,
+            CONSTRAINT fk_employees_user FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE SET NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            employee_id INT NOT NULL,
+            date DATE NOT NULL,
+            time_in TIME NULL,
+            time_out TIME NULL,
+            status ENUM('present', 'late', 'absent', 'half-day') NOT NULL DEFAULT 'present',
+            notes TEXT NULL,
+            CONSTRAINT fk_attendance_employee FOREIGN KEY (employee_id) REFERENCES employees (id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            report_type VARCHAR(20) NOT NULL,
+            generated_by INT NULL,
+            file_path VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            CONSTRAINT fk_reports_user FOREIGN KEY (generated_by) REFERENCES users (id) ON DELETE SET NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+
+
+def add_lookup_indexes(cursor):
+    # Login and registration look users up by name
+    add_index(cursor, 'users', 'uq_users_username', ['username'], unique=True)
+    # Kiosk punches and bulk ingestion resolve badge codes
+    add_index(cursor, 'employees', 'uq_employees_employee_id', ['employee_id'], unique=True)
+    # Login and the employee dashboard find the employee row of a user
+    add_index(cursor, 'employees', 'ix_employees_user_id', ['user_id'])
+    # Department filter and its dropdown
+    add_index(cursor, 'employees', 'ix_employees_department', ['department'])
+    # One row per employee and day: the clock-in upsert and add_attendance's
+    # IntegrityError handling rely on it; it also serves the employee's own
+    # history (WHERE employee_id ORDER BY date DESC)
+    add_index(cursor, 'attendance', 'uq_attendance_employee_date', ['employee_id', 'date'], unique=True)
+    # Date range scans and the newest-first listings (InnoDB appends the
+    # primary key, so this also matches ORDER BY date, time_in, id)
+    add_index(cursor, 'attendance', 'ix_attendance_date_time_in', ['date', 'time_in'])
+
+
+def add_report_job_columns(cursor):
+    # Background report jobs (reporting.run_report_job) and the report cache
+    add_column(cursor, 'reports', 'format', "VARCHAR(10) NOT NULL DEFAULT 'pdf' AFTER report_type")
+    add_column(cursor, 'reports', 'start_date', 'DATE NULL AFTER format')
+    add_column(cursor, 'reports', 'end_date', 'DATE NULL AFTER start_date')
+    add_column(cursor, 'reports', 'status',
+               "ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'done' AFTER end_date")
+    add_column(cursor, 'reports', 'error', 'TEXT NULL AFTER status')
+    add_column(cursor, 'reports', 'completed_at', 'DATETIME NULL AFTER created_at')
+    # enqueue_report looks for a live job rendering the same file
+    add_index(cursor, 'reports', 'ix_reports_file_path_status', ['file_path', 'status'])
+
+
+def create_rollup_tables(cursor):
+    # Aggregates maintained by rollups.py; `flask db upgrade` fills them
+    # right after this migration runs
+    metrics = '''
+        days_recorded INT NOT NULL DEFAULT 0,
+        present_count INT NOT NULL DEFAULT 0,
+        late_count INT NOT NULL DEFAULT 0,
+        absent_count INT NOT NULL DEFAULT 0,
+        half_day_count INT NOT NULL DEFAULT 0,
+        worked_minutes INT NOT NULL DEFAULT 0,
+        late_minutes INT NOT NULL DEFAULT 0
+    '''
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS attendance_employee_monthly (
+            employee_id INT NOT NULL,
+            month DATE NOT NULL,
+            {metrics},
+            PRIMARY KEY (employee_id, month),
+            INDEX ix_employee_monthly_month (month),
+            CONSTRAINT fk_rollup_employee FOREIGN KEY (employee_id) REFERENCES employees (id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS attendance_department_daily (
+            department VARCHAR(50) NOT NULL,
+            date DATE NOT NULL,
+            {metrics},
+            PRIMARY KEY (department, date),
+            INDEX ix_department_daily_date (date)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS attendance_department_monthly (
+            department VARCHAR(50) NOT NULL,
+            month DATE NOT NULL,
+            {metrics},
+            PRIMARY KEY (department, month),
+            INDEX ix_department_monthly_month (month)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+
+
+def create_data_versions_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name VARCHAR(32) NOT NULL PRIMARY KEY,
+            version BIGINT UNSIGNED NOT NULL DEFAULT 0
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+    cursor.executemany('INSERT IGNORE INTO data_versions (name) VALUES (%s)',
+                       [(name,) for name in data_versions.DATASETS])
+
+
+def create_archive_table(cursor):
+    # Months moved to Parquet files by archive.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_archive (
+            month DATE NOT NULL PRIMARY KEY,
+            row_count INT NOT NULL,
+            file_path VARCHAR(255) NOT NULL,
+            archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+
+
+def create_audit_tables(cursor):
+    # Bulk attendance changes (attendance_bulk.py): one row per operation,
+    # with the before and after image of every row it targeted
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_audit (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            action VARCHAR(20) NOT NULL,
+            detail TEXT NOT NULL,
+            row_count INT NOT NULL DEFAULT 0,
+            performed_by INT NULL,
+            performed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX ix_attendance_audit_performed_at (performed_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+    # No foreign key to attendance: deleted rows keep their audit trail
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_audit_rows (
+            batch_id INT NOT NULL,
+            attendance_id INT NOT NULL,
+            employee_id INT NOT NULL,
+            date DATE NOT NULL,
+            created BOOLEAN NOT NULL DEFAULT FALSE,
+            old_time_in TIME NULL,
+            old_time_out TIME NULL,
+            old_status VARCHAR(20) NULL,
+            old_notes TEXT NULL,
+            new_time_in TIME NULL,
+            new_time_out TIME NULL,
+            new_status VARCHAR(20) NULL,
+            new_notes TEXT NULL,
+            PRIMARY KEY (batch_id, attendance_id),
+            INDEX ix_attendance_audit_rows_attendance (attendance_id),
+            CONSTRAINT fk_audit_rows_batch FOREIGN KEY (batch_id) REFERENCES attendance_audit (id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    ''')
+
+
+def add_attendance_updated_at(cursor):
+    # The edit watermark of reporting.DATA_VERSION_QUERY: MAX(updated_at)
+    # over a date range, read from the index without touching the rows
+    add_column(cursor, 'attendance', 'updated_at',
+               'TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)')
+    add_index(cursor, 'attendance', 'ix_attendance_date_updated_at', ['date', 'updated_at'])
+
+
+MIGRATIONS = [
+    (1, 'users, employees, attendance and reports tables', create_tables),
+    (2, 'lookup and attendance indexes', add_lookup_indexes),
+    (3, 'report job columns', add_report_job_columns),
+    (4, 'attendance rollup tables', create_rollup_tables),
+    (5, 'data version counters', create_data_versions_table),
+    (6, 'attendance archive registry', create_archive_table),
+    (7, 'bulk attendance audit tables', create_audit_tables),
+    (8, 'attendance change timestamps', add_attendance_updated_at),
+]
+
+ROLLUPS_VERSION = 4
+ARCHIVE_VERSION = 6
+
+
+def current_version(connection):
+    cursor = connection.cursor()
+    try:
+        if not table_exists(cursor, 'schema_migrations'):
+            return 0
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def upgrade(connection, target=None, log=print):
+    # Returns the list of versions applied
+    cursor = connection.cursor()
+    applied = []
+    try:
+        cursor.execute(SCHEMA_TABLE)
+        version = current_version(connection)
+        for number, description, migrate in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            log(f'Applying {number}: {description}')
+            migrate(cursor)
+            cursor.execute('INSERT INTO schema_migrations (version, description) VALUES (%s, %s)',
+                           (number, description))
+            connection.commit()
+            applied.append(number)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return applied
+
+
+def module_queries():
+    # Statements of the Flask-free modules, imported from them so the check
+    # runs exactly what they run, with representative parameters. app.py adds
+    # the SQL of its routes (ROUTE_QUERIES) in `flask db explain`. They are
+    # imported here so that migrating does not load pandas or the report
+    # writers.
+    # -> [(name, sql, params, tables allowed to be read in full)]
+    import rollups
+    from attendance_bulk import (AUDIT_AFTER_QUERY, AUDIT_BEFORE_QUERY, AUDIT_CHANGED_QUERY, AUDIT_CREATED_QUERY,
+                                 CORRECT_UPDATE_QUERY, CORRECT_UPSERT_QUERY, DEPARTMENT_DAY)
+    from reporting import (DATA_VERSION_QUERY, PRESENT_MONTHS_QUERY, PRESENT_RANGE_QUERY, REPORT_DETAIL_QUERY,
+                           REPORT_SUMMARY_QUERY)
+
+    return [
+        ('generate_report/details', REPORT_DETAIL_QUERY, ('2024-01-01', '2024-01-31'), ()),
+        ('generate_report/summary', REPORT_SUMMARY_QUERY, ('2024-01-01', '2024-01-31'), ()),
+        ('generate_report/present_months', PRESENT_MONTHS_QUERY, ('2024-01-01', '2024-01-01'), ()),
+        ('generate_report/present_range', PRESENT_RANGE_QUERY, ('2024-01-01', '2024-01-07'), ()),
+        ('rollups', rollups.ROW_QUERY + ' WHERE a.employee_id = %s AND a.date = %s', (1, '2024-01-01'), ()),
+        ('generate_report/version', DATA_VERSION_QUERY, ('2024-01-01', '2024-01-31', '2024-01-31', '2024-01-01'),
+         ('attendance_archive',)),
+        ('api/etag', data_versions.FETCH_QUERY.format(placeholders='%s, %s'), ('attendance', 'employees'), ()),
+        ('attendance_bulk/before', AUDIT_BEFORE_QUERY.format(where='a.id IN (%s, %s)'), (1, 1, 2), ()),
+        ('attendance_bulk/correct_before', AUDIT_BEFORE_QUERY.format(where=DEPARTMENT_DAY),
+         (1, '2024-01-01', 'Sales'), ()),
+        ('attendance_bulk/correct_upsert', CORRECT_UPSERT_QUERY,
+         ('2024-01-01', '09:00:00', None, 'present', None, 'Sales', '2024-01-01', None), ('employees',)),
+        ('attendance_bulk/correct_update', CORRECT_UPDATE_QUERY, (None, None, None, '2024-01-01', 'Sales'), ()),
+        ('attendance_bulk/after', AUDIT_AFTER_QUERY, (1,), ()),
+        ('attendance_bulk/created', AUDIT_CREATED_QUERY.format(where=DEPARTMENT_DAY),
+         (1, '2024-01-01', 'Sales', 1), ()),
+        ('attendance_bulk/changed', AUDIT_CHANGED_QUERY, (1,), ()),
+    ]
+
+
+def explain_queries(connection, queries=None):
+    # Checks `queries` (default: module_queries()). Returns (problems,
+    # warnings) as lists of (name, table, detail). A full scan of a table no
+    # index could serve is a problem. A full scan the optimizer chose despite
+    # a usable index is only a warning: on small tables that is the cheaper
+    # plan, so run this against production-sized data before reading much
+    # into warnings.
+    problems = []
+    warnings = []
+    if queries is None:
+        queries = module_queries()
+    cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        for name, sql, params, scans_ok in queries:
+            cursor.execute('EXPLAIN ' + sql, params)
+            for row in cursor.fetchall():
+                if row['type'] != 'ALL' or row['table'] in scans_ok:
+                    continue
+                detail = f"full scan of ~{row['rows']} rows"
+                if row['possible_keys']:
+                    warnings.append((name, row['table'], f"{detail}; possible keys: {row['possible_keys']}"))
+                else:
+                    problems.append((name, row['table'], f'{detail}; no usable index'))
+    finally:
+        cursor.close()
+    return problems, warnings
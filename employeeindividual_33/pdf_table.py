@@ -0,0 +1,182 @@
+# Batched table writer for FPDF reports.
+#
+# FPDF's cell() measures, escapes, positions and page-break-checks every
+# single cell. PdfTableWriter instead converts and truncates each column
+# once (over its unique values), lays the rows out page by page, and writes
+# all the text and grid operators of a page to the content stream at once.
+import pandas as pd
+
+
+class PdfTableWriter:
+    def __init__(self, pdf, columns, line_height=6, font_family='Arial', font_size=9, padding=1):
+        # columns: list of (key, label) pairs, in display order
+        self.pdf = pdf
+        self.columns = columns
+        self.line_height = line_height
+        self.font_family = font_family
+        self.font_size = font_size
+        self.padding = padding
+        self.widths = None
+
+    def prepare(self, rows):
+        # One pass per column: NULLs to '', values to latin-1 text (core fonts)
+        frame = pd.DataFrame(rows, columns=[key for key, _ in self.columns])
+        for key, _ in self.columns:
+            column = frame[key].astype(object).where(frame[key].notna(), '').astype(str)
+            mapping = {}
+            for value in column.unique():
+                try:
+                    value.encode('latin-1')
+                except UnicodeEncodeError:
+                    mapping[value] = value.encode('latin-1', 'replace').decode('latin-1')
+            frame[key] = column.replace(mapping) if mapping else column
+        return frame
+
+    def measure(self, frame):
+        # Column widths from the widest header or value, scaled down to fit
+        pdf = self.pdf
+        pdf.set_font(self.font_family, 'B', self.font_size)
+        header_widths = [pdf.get_string_width(label) for _, label in self.columns]
+        pdf.set_font(self.font_family, '', self.font_size)
+        widths = []
+        for (key, _), header_width in zip(self.columns, header_widths):
+            values = frame[key].unique()
+            content_width = max((pdf.get_string_width(value) for value in values), default=0)
+            widths.append(max(header_width, content_width) + 2 * self.padding)
+        available = pdf.w - pdf.l_margin - pdf.r_margin
+        total = sum(widths)
+        if total > available:
+            widths = [width * available / total for width in widths]
+        self.widths = widths
+        return widths
+
+    def truncate(self, frame):
+        # Cut values that do not fit their column, each distinct value once
+        pdf = self.pdf
+        pdf.set_font(self.font_family, '', self.font_size)
+        for (key, _), width in zip(self.columns, self.widths):
+            limit = width - 2 * self.padding
+            mapping = {}
+            for value in frame[key].unique():
+                if pdf.get_string_width(value) <= limit:
+                    continue
+                cut = value
+                while cut and pdf.get_string_width(cut + '...') > limit:
+                    cut = cut[:-1]
+                mapping[value] = cut + '...'
+            if mapping:
+                frame[key] = frame[key].replace(mapping)
+        return frame
+
+    def escape(self, series):
+        return (series.str.replace('\\', '\\\\', regex=False)
+                .str.replace('(', '\\(', regex=False)
+                .str.replace(')', '\\)', regex=False)
+                .str.replace('\r', ' ', regex=False))
+
+    def write_header(self):
+        pdf = self.pdf
+        pdf.set_font(self.font_family, 'B', self.font_size)
+        for (_, label), width in zip(self.columns, self.widths):
+            pdf.cell(width, self.line_height, label, 1, 0, 'L')
+        pdf.ln(self.line_height)
+        pdf.set_font(self.font_family, '', self.font_size)
+
+    def write_label(self, text, bold=True):
+        # Full-width line used for group headers and subtotals
+        pdf = self.pdf
+        pdf.set_font(self.font_family, 'B' if bold else 'I', self.font_size)
+        pdf.cell(sum(self.widths), self.line_height, text, 1, 1, 'L')
+        pdf.set_font(self.font_family, '', self.font_size)
+
+    def write_rows(self, cells, start, stop):
+        # Rows start..stop fit on the current page; emit them in one go
+        pdf = self.pdf
+        k = pdf.k
+        count = stop - start
+        top = pdf.y
+        left = pdf.l_margin
+        height = self.line_height
+        offset = top + 0.5 * height + 0.3 * pdf.font_size
+        ys = ['%.2f' % ((pdf.h - offset - i * height) * k) for i in range(count)]
+
+        operators = []
+        x = left
+        for values, width in zip(cells, self.widths):
+            pdf_x = '%.2f' % ((x + self.padding) * k)
+            operators.extend(f'BT {pdf_x} {y} Td ({value}) Tj ET'
+                             for y, value in zip(ys, values[start:stop]))
+            x += width
+
+        # Grid: one horizontal line per row boundary, one vertical per column
+        right = (left + sum(self.widths)) * k
+        bottom = top + count * height
+        for i in range(count + 1):
+            y = (pdf.h - top - i * height) * k
+            operators.append('%.2f %.2f m %.2f %.2f l S' % (left * k, y, right, y))
+        x = left
+        for width in [0] + self.widths:
+            x += width
+            operators.append('%.2f %.2f m %.2f %.2f l S' % (x * k, (pdf.h - top) * k, x * k, (pdf.h - bottom) * k))
+
+        pdf._out('\n'.join(operators))
+        pdf.set_y(bottom)
+
+    def rows_left_on_page(self):
+        return int((self.pdf.h - self.pdf.b_margin - self.pdf.y) // self.line_height)
+
+    def write(self, rows, group_by=None, group_label=None, count_column=None):
+        # group_by: column to group on, with a header before and a subtotal
+        # after each group; count_column: column whose values are tallied in
+        # the subtotal (e.g. the attendance status)
+        pdf = self.pdf
+        frame = self.prepare(rows)
+        if group_by:
+            frame = frame.sort_values(group_by, kind='stable')
+        frame = frame.reset_index(drop=True)
+        self.measure(frame)
+
+        # Layout plan: ('label', text) lines and ('rows', start, stop) runs
+        plan = []
+        if group_by:
+            groups = frame.groupby(group_by, sort=False).indices
+            tallies = (frame.groupby(group_by, sort=False)[count_column].value_counts()
+                       if count_column else None)
+            for name, positions in groups.items():
+                plan.append(('label', f'{group_label or group_by}: {name}', True))
+                plan.append(('rows', positions[0], positions[-1] + 1))
+                subtotal = f'Subtotal: {len(positions)} records'
+                if tallies is not None:
+                    subtotal += ''.join(f', {value}: {count}' for value, count in tallies[name].items())
+                plan.append(('label', subtotal, False))
+        else:
+            plan.append(('rows', 0, len(frame)))
+        self.truncate(frame)
+        # Escaped once for the whole table; pages only slice these lists
+        cells = [self.escape(frame[key]).tolist() for key, _ in self.columns]
+
+        auto_page_break = pdf.auto_page_break
+        pdf.set_auto_page_break(False, pdf.b_margin)
+        try:
+            if self.rows_left_on_page() < 3:
+                pdf.add_page()
+            self.write_header()
+            for item in plan:
+                if item[0] == 'label':
+                    if self.rows_left_on_page() < 1:
+                        pdf.add_page()
+                        self.write_header()
+                    self.write_label(item[1], item[2])
+                    continue
+                start, stop = item[1], item[2]
+                while start < stop:
+                    available = self.rows_left_on_page()
+                    if available < 1:
+                        pdf.add_page()
+                        self.write_header()
+                        available = self.rows_left_on_page()
+                    end = min(stop, start + available)
+                    self.write_rows(cells, start, end)
+                    start = end
+        finally:
+            pdf.set_auto_page_break(auto_page_break, pdf.b_margin)
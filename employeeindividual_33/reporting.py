@@ -0,0 +1,439 @@
+# Report rendering, kept free of Flask so it can run in worker processes.
+# Ranges that cover archived months (see archive.py) read those months
+# from their Parquet files and merge them into the rows from MySQL.
+import MySQLdb
+import MySQLdb.cursors
+import hashlib
+import heapq
+import os
+import re
+import time
+import xlsxwriter
+from fpdf import FPDF
+from datetime import date, timedelta
+from itertools import chain, islice
+from pdf_table import PdfTableWriter
+import archive
+
+REPORT_COLUMNS = ['employee_id', 'full_name', 'department', 'date', 'time_in', 'time_out', 'status']
+
+REPORT_MIMETYPES = {
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pdf': 'application/pdf',
+    'csv': 'text/csv',
+}
+
+REPORT_EXTENSIONS = {
+    'excel': 'xlsx',
+    'pdf': 'pdf',
+    'csv': 'csv',
+}
+
+PDF_COLUMNS = [
+    ('employee_id', 'Employee ID'),
+    ('full_name', 'Name'),
+    ('department', 'Department'),
+    ('date', 'Date'),
+    ('time_in', 'Time In'),
+    ('time_out', 'Time Out'),
+    ('status', 'Status'),
+]
+
+# PDF grouping option -> (column, label)
+PDF_GROUPS = {
+    'employee': ('full_name', 'Employee'),
+    'department': ('department', 'Department'),
+}
+
+REPORT_DETAIL_QUERY = '''
+    SELECT e.employee_id, e.full_name, e.department,
+           a.date, a.time_in, a.time_out, a.status
+    FROM attendance a
+    JOIN employees e ON a.employee_id = e.id
+    WHERE a.date BETWEEN %s AND %s
+    ORDER BY e.full_name, a.date
+'''
+
+# Status counts and minutes come from the department rollups (one row per
+# department and day) instead of re-aggregating attendance on every call
+REPORT_SUMMARY_QUERY = '''
+    SELECT
+        (SELECT COUNT(*) FROM employees) AS total_employees,
+        COALESCE(SUM(late_count), 0) AS late_count,
+        COALESCE(SUM(absent_count), 0) AS absent_count,
+        COALESCE(SUM(half_day_count), 0) AS half_day_count,
+        COALESCE(SUM(worked_minutes), 0) AS worked_minutes,
+        COALESCE(SUM(late_minutes), 0) AS late_minutes
+    FROM attendance_department_daily
+    WHERE date BETWEEN %s AND %s
+'''
+
+# Employees with any attendance in the range: from the monthly rollups when
+# the range is whole months, otherwise from attendance itself
+PRESENT_MONTHS_QUERY = '''
+    SELECT COUNT(DISTINCT employee_id) FROM attendance_employee_monthly
+    WHERE month BETWEEN %s AND %s AND days_recorded > 0
+'''
+
+PRESENT_RANGE_QUERY = '''
+    SELECT COUNT(DISTINCT employee_id) FROM attendance
+    WHERE date BETWEEN %s AND %s
+'''
+
+# Anything that changes what a report would contain moves this watermark:
+# inserts and deletes in the range (row count, highest id), edits (latest
+# updated_at), any change to employees (their data_versions counter), and
+# months of the range being archived or restored. The attendance part is
+# read from ix_attendance_date_updated_at alone. An edit committed with a
+# timestamp older than one already seen is still caught, because writers
+# also drop the cached files of the dates they change.
+DATA_VERSION_QUERY = '''
+    SELECT
+        (SELECT CONCAT_WS(':', COUNT(*), COALESCE(MAX(id), 0), COALESCE(MAX(updated_at), ''))
+         FROM attendance WHERE date BETWEEN %s AND %s) AS attendance_version,
+        (SELECT version FROM data_versions WHERE name = 'employees') AS employees_version,
+        (SELECT CONCAT_WS(':', COUNT(*), COALESCE(SUM(row_count), 0), COALESCE(MAX(archived_at), ''))
+         FROM attendance_archive WHERE month <= %s AND LAST_DAY(month) >= %s) AS archive_version
+'''
+
+REPORT_CACHE_PATTERN = re.compile(
+    r'^attendance_report_(\w+?)_(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})_([0-9a-f]+)\.(\w+)$')
+
+def format_time(value):
+    # MySQLdb returns TIME columns as timedelta
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return '%02d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+    return value
+
+def report_period(report_type, day):
+    # The day, week (Monday to Sunday) or month containing `day`
+    if report_type == 'daily':
+        return day, day
+    elif report_type == 'weekly':
+        start_date = day - timedelta(days=day.weekday())
+        return start_date, start_date + timedelta(days=6)
+    elif report_type == 'monthly':
+        start_date = date(day.year, day.month, 1)
+        next_month = (start_date + timedelta(days=32)).replace(day=1)
+        return start_date, next_month - timedelta(days=1)
+    return None
+
+def previous_period(report_type, day):
+    # The last period of `report_type` that closed before the one containing `day`
+    period = report_period(report_type, day)
+    if period is None:
+        return None
+    return report_period(report_type, period[0] - timedelta(days=1))
+
+def report_date_range(report_type, start_date=None, end_date=None, period='current'):
+    # Report types without a period use the given dates
+    today = date.today()
+    if period == 'previous':
+        dates = previous_period(report_type, today)
+    else:
+        dates = report_period(report_type, today)
+    return dates or (start_date, end_date)
+
+def report_row_values(row):
+    return [format_time(row[column]) for column in REPORT_COLUMNS]
+
+def fetch_summary(connection, start_date, end_date, archive_folder=None):
+    # Rollups are kept for archived months, so only a count of distinct
+    # employees over a partial month needs the archive files
+    months = archive.archived_months(connection, start_date, end_date) if archive_folder else []
+    cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        cursor.execute(REPORT_SUMMARY_QUERY, (start_date, end_date))
+        totals = cursor.fetchone()
+        start, end = date.fromisoformat(str(start_date)), date.fromisoformat(str(end_date))
+        if start.day == 1 and (end + timedelta(days=1)).day == 1:
+            cursor.execute(PRESENT_MONTHS_QUERY, (start, end.replace(day=1)))
+            present_employees = list(cursor.fetchone().values())[0]
+        elif months:
+            cursor.execute('SELECT DISTINCT employee_id FROM attendance WHERE date BETWEEN %s AND %s',
+                           (start_date, end_date))
+            present = {row['employee_id'] for row in cursor.fetchall()}
+            present |= archive.employee_ids(connection, archive_folder, months, start_date, end_date)
+            present_employees = len(present)
+        else:
+            cursor.execute(PRESENT_RANGE_QUERY, (start_date, end_date))
+            present_employees = list(cursor.fetchone().values())[0]
+    finally:
+        cursor.close()
+    # Same order as the Excel summary sheet's columns
+    return {
+        'total_employees': totals['total_employees'],
+        'present_employees': present_employees,
+        'late_count': totals['late_count'],
+        'absent_count': totals['absent_count'],
+        'half_day_count': totals['half_day_count'],
+        'worked_minutes': totals['worked_minutes'],
+        'late_minutes': totals['late_minutes'],
+    }
+
+def report_sort_key(row):
+    # REPORT_DETAIL_QUERY's order: name in the column's collation, then date
+    return archive.name_key(row['full_name']), row['date']
+
+def iter_report_rows(connection, start_date, end_date, chunk_size=1000, archive_folder=None):
+    # Archived rows are read (column-wise, only the months in range) before
+    # the unbuffered query starts, then merged into its stream in order
+    months = archive.archived_months(connection, start_date, end_date) if archive_folder else []
+    if not months:
+        yield from iter_live_report_rows(connection, start_date, end_date, chunk_size)
+        return
+    archived = archive.report_rows(connection, archive_folder, months, start_date, end_date)
+    live = iter_live_report_rows(connection, start_date, end_date, chunk_size)
+    try:
+        merged = heapq.merge(chain.from_iterable(live), archived, key=report_sort_key)
+        while True:
+            rows = list(islice(merged, chunk_size))
+            if not rows:
+                break
+            yield rows
+    finally:
+        live.close()
+
+def iter_live_report_rows(connection, start_date, end_date, chunk_size=1000):
+    # Unbuffered server-side cursor: MySQL hands rows over one chunk at a time
+    # instead of the whole range being materialized in the worker.
+    cursor = connection.cursor(MySQLdb.cursors.SSDictCursor)
+    try:
+        cursor.execute(REPORT_DETAIL_QUERY, (start_date, end_date))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+def write_excel_report(connection, filepath, start_date, end_date, summary_data, chunk_size=1000,
+                       archive_folder=None):
+    # constant_memory flushes each row to disk once the next row is started
+    workbook = xlsxwriter.Workbook(filepath, {'constant_memory': True,
+                                              'default_date_format': 'yyyy-mm-dd'})
+    try:
+        bold = workbook.add_format({'bold': True})
+
+        details = workbook.add_worksheet('Attendance Details')
+        details.write_row(0, 0, REPORT_COLUMNS, bold)
+        row_number = 1
+        for rows in iter_report_rows(connection, start_date, end_date, chunk_size, archive_folder):
+            for row in rows:
+                details.write_row(row_number, 0, report_row_values(row))
+                row_number += 1
+
+        summary = workbook.add_worksheet('Summary')
+        summary.write_row(0, 0, list(summary_data.keys()), bold)
+        summary.write_row(1, 0, [int(value or 0) for value in summary_data.values()])
+    finally:
+        workbook.close()
+
+def write_pdf_report(connection, filepath, title, start_date, end_date, summary_data,
+                     group_by=None, chunk_size=1000, archive_folder=None):
+    rows = [report_row_values(row)
+            for chunk in iter_report_rows(connection, start_date, end_date, chunk_size, archive_folder)
+            for row in chunk]
+
+    # Create PDF
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+
+    # Report title
+    pdf.cell(200, 10, txt=title, ln=1, align='C')
+    pdf.cell(200, 10, txt=f"Date Range: {start_date} to {end_date}", ln=1, align='C')
+    pdf.ln(10)
+
+    # Summary section
+    pdf.set_font("Arial", 'B', size=12)
+    pdf.cell(200, 10, txt="Summary", ln=1)
+    pdf.set_font("Arial", size=10)
+
+    pdf.cell(100, 10, txt=f"Total Employees: {summary_data['total_employees']}", ln=1)
+    pdf.cell(100, 10, txt=f"Present Employees: {summary_data['present_employees']}", ln=1)
+    pdf.cell(100, 10, txt=f"Late Count: {summary_data['late_count']}", ln=1)
+    pdf.cell(100, 10, txt=f"Absent Count: {summary_data['absent_count']}", ln=1)
+    pdf.cell(100, 10, txt=f"Half-Day Count: {summary_data['half_day_count']}", ln=1)
+    pdf.cell(100, 10, txt=f"Hours Worked: {int(summary_data['worked_minutes']) / 60:.1f}", ln=1)
+    pdf.cell(100, 10, txt=f"Minutes Late: {summary_data['late_minutes']}", ln=1)
+    pdf.ln(10)
+
+    # Details section
+    pdf.set_font("Arial", 'B', size=12)
+    pdf.cell(200, 10, txt="Attendance Details", ln=1)
+
+    group_column, group_label = PDF_GROUPS.get(group_by, (None, None))
+    PdfTableWriter(pdf, PDF_COLUMNS).write(rows, group_by=group_column, group_label=group_label,
+                                           count_column='status' if group_column else None)
+
+    pdf.output(filepath)
+
+# Report cache. Files in the report folder are named after the report
+# parameters plus a digest of the data version, so an unchanged range maps
+# to the file rendered last time and any change maps to a new name.
+def fetch_data_version(connection, start_date, end_date):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(DATA_VERSION_QUERY, (start_date, end_date, end_date, start_date))
+        return ':'.join(str(value) for value in cursor.fetchone())
+    finally:
+        cursor.close()
+
+def report_cache_path(folder, report_type, format_type, start_date, end_date, data_version, variant=''):
+    key = '|'.join(str(part) for part in (report_type, format_type, start_date, end_date, data_version, variant))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    filename = f"attendance_report_{report_type}_{start_date}_{end_date}_{digest}.{REPORT_EXTENSIONS[format_type]}"
+    return os.path.join(folder, filename)
+
+def touch_report(filepath):
+    # Refresh the mtime so eviction treats the file as recently used
+    try:
+        os.utime(filepath)
+        return True
+    except FileNotFoundError:
+        return False
+
+# folder -> (mtime_ns, dates with no cached report at that mtime)
+cleared_dates = {}
+
+def invalidate_report_cache(folder, *dates):
+    # Drop cached reports whose range covers any of the given dates.
+    # Reports only appear in the folder by being renamed into it, which
+    # moves its mtime, so dates already cleared at the current mtime are
+    # skipped without listing the folder. A folder changed within the last
+    # second is always listed, as mtimes are coarser than that on some
+    # filesystems.
+    dates = {str(value) for value in dates if value}
+    mtime = os.stat(folder).st_mtime_ns
+    cleared_at, cleared = cleared_dates.get(folder, (None, set()))
+    if cleared_at == mtime and dates <= cleared:
+        return
+    removed = False
+    for entry in os.scandir(folder):
+        match = REPORT_CACHE_PATTERN.match(entry.name)
+        if match and any(match.group(2) <= value <= match.group(3) for value in dates):
+            try:
+                os.remove(entry.path)
+                removed = True
+            except FileNotFoundError:
+                pass
+    # Removing files moves the mtime too; the next call lists the folder once more
+    if not removed and time.time_ns() - mtime > 1_000_000_000:
+        cleared_dates[folder] = (mtime, (dates | cleared) if cleared_at == mtime else dates)
+
+def evict_report_cache(folder, max_bytes):
+    # Least recently used files go first until the folder fits in max_bytes.
+    # Returns the number of files removed.
+    files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                   for entry in os.scandir(folder)
+                   if entry.is_file() and REPORT_CACHE_PATTERN.match(entry.name))
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return removed
+
+def apply_report_retention(connection, folder, max_age_days, max_bytes, stale_after):
+    # Retention for the report folder and the `reports` table:
+    # - files not used (rendered or downloaded) for max_age_days are removed,
+    #   then the least recently used ones until the folder fits in max_bytes;
+    # - .part files older than stale_after seconds, left by killed workers;
+    # - finished rows older than max_age_days, except the newest row of each
+    #   file still on disk, which the report files page lists.
+    # Returns (files removed, rows removed).
+    now = time.time()
+    removed = 0
+    for entry in os.scandir(folder):
+        if not entry.is_file():
+            continue
+        age = now - entry.stat().st_mtime
+        if ((REPORT_CACHE_PATTERN.match(entry.name) and age > max_age_days * 86400)
+                or (entry.name.endswith('.part') and age > stale_after)):
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    removed += evict_report_cache(folder, max_bytes)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT file_path, MAX(id) FROM reports WHERE status = 'done' GROUP BY file_path")
+        keep = [report_id for path, report_id in cursor.fetchall() if os.path.isfile(path)]
+        query = '''
+            DELETE FROM reports
+            WHERE status IN ('done', 'failed') AND created_at < NOW() - INTERVAL %s DAY
+        '''
+        if keep:
+            query += f" AND id NOT IN ({', '.join(['%s'] * len(keep))})"
+        cursor.execute(query, [max_age_days] + keep)
+        rows = cursor.rowcount
+        connection.commit()
+    finally:
+        cursor.close()
+    return removed, rows
+
+# Background jobs. Each job owns a row in `reports`, whose status moves
+# queued -> running -> done | failed; the web process only reads it.
+def set_report_status(connection, report_id, status, error=None):
+    cursor = connection.cursor()
+    cursor.execute('''
+        UPDATE reports SET status = %s, error = %s,
+        completed_at = IF(%s IN ('done', 'failed'), NOW(), NULL)
+        WHERE id = %s
+    ''', (status, error, status, report_id))
+    connection.commit()
+    cursor.close()
+
+def run_report_job(db_config, report_id, title, format_type, start_date, end_date, filepath,
+                   chunk_size=1000, group_by=None, archive_folder=None):
+    # Entry point for pool workers: opens its own connection
+    connection = MySQLdb.connect(**db_config)
+    try:
+        set_report_status(connection, report_id, 'running')
+        # Render next to the final name so a half-written file is never served
+        partial_path = filepath + '.part'
+        try:
+            summary_data = fetch_summary(connection, start_date, end_date, archive_folder)
+            if format_type == 'excel':
+                write_excel_report(connection, partial_path, start_date, end_date, summary_data, chunk_size,
+                                   archive_folder)
+            elif format_type == 'pdf':
+                write_pdf_report(connection, partial_path, title, start_date, end_date, summary_data,
+                                 group_by, chunk_size, archive_folder)
+            else:
+                raise ValueError(f'Unsupported report format: {format_type}')
+            os.replace(partial_path, filepath)
+        except Exception as e:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            connection.rollback()
+            set_report_status(connection, report_id, 'failed', str(e))
+            raise
+        set_report_status(connection, report_id, 'done')
+    finally:
+        connection.close()
+
+def fail_report_job(db_config, report_id, error):
+    # Used when a worker died before it could record the failure itself
+    connection = MySQLdb.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('''
+            UPDATE reports SET status = 'failed', error = %s, completed_at = NOW()
+            WHERE id = %s AND status IN ('queued', 'running')
+        ''', (error, report_id))
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
@@ -0,0 +1,212 @@
+# Attendance rollups: per-employee monthly and per-department daily and
+# monthly aggregates of status counts, worked minutes and late minutes.
+#
+# Writers keep them current with deltas: read the affected attendance rows
+# before and after the write, then `apply_changes` subtracts the old rows'
+# contribution and adds the new rows' in the same transaction. Rollup rows
+# are always updated in key order so concurrent writers cannot deadlock on
+# them. `backfill` rebuilds whole months from attendance with pandas.
+from datetime import date, datetime, timedelta
+
+import MySQLdb.cursors
+import pandas as pd
+
+METRICS = ['days_recorded', 'present_count', 'late_count', 'absent_count', 'half_day_count',
+           'worked_minutes', 'late_minutes']
+
+STATUS_METRICS = {
+    'present': 'present_count',
+    'late': 'late_count',
+    'absent': 'absent_count',
+    'half-day': 'half_day_count',
+}
+
+# (table, key columns); every table has the METRICS columns
+TABLES = [
+    ('attendance_employee_monthly', ('employee_id', 'month')),
+    ('attendance_department_daily', ('department', 'date')),
+    ('attendance_department_monthly', ('department', 'month')),
+]
+
+ROW_QUERY = '''
+    SELECT a.employee_id, COALESCE(e.department, '') AS department,
+           a.date, a.status, a.time_in, a.time_out
+    FROM attendance a
+    JOIN employees e ON a.employee_id = e.id
+'''
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def month_end(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def as_timedelta(value):
+    # MySQLdb returns TIME as timedelta; punches carry datetime.time
+    if value is None or isinstance(value, timedelta):
+        return value
+    return datetime.combine(date.min, value) - datetime.min
+
+
+def contribution(row, rules):
+    # What one attendance row adds to each metric. Minutes are floored per
+    # row, the same way `backfill` computes them; minutes late count from
+    # the department's shift start (rules.RuleSet).
+    values = dict.fromkeys(METRICS, 0)
+    values['days_recorded'] = 1
+    if row['status'] in STATUS_METRICS:
+        values[STATUS_METRICS[row['status']]] = 1
+    time_in = as_timedelta(row['time_in'])
+    time_out = as_timedelta(row['time_out'])
+    if time_in is not None and time_out is not None and time_out > time_in:
+        values['worked_minutes'] = int((time_out - time_in).total_seconds() // 60)
+    if row['status'] == 'late' and time_in is not None:
+        shift_start = rules.rule(row['department']).shift_start
+        values['late_minutes'] = max(0, int((time_in - shift_start).total_seconds() // 60))
+    return values
+
+
+def fetch_rows(connection, where, params=(), lock=False):
+    # Attendance rows with the employee's department, as rollups key them
+    cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        cursor.execute(f"{ROW_QUERY} WHERE {where}{' FOR UPDATE' if lock else ''}", params)
+        return list(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def fetch_keys(connection, keys, lock=False, chunk_size=1000):
+    # Rows for a list of (employee_id, date) pairs
+    rows = []
+    keys = list(keys)
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        placeholders = ', '.join(['(%s, %s)'] * len(chunk))
+        params = [value for key in chunk for value in key]
+        rows.extend(fetch_rows(connection, f'(a.employee_id, a.date) IN ({placeholders})', params, lock))
+    return rows
+
+
+def apply_changes(connection, old_rows, new_rows, rules):
+    # Does not commit: runs in the writer's transaction
+    deltas = {table: {} for table, _ in TABLES}
+    for rows, sign in ((old_rows, -1), (new_rows, 1)):
+        for row in rows:
+            values = contribution(row, rules)
+            month = month_start(row['date'])
+            keys = {
+                'attendance_employee_monthly': (row['employee_id'], month),
+                'attendance_department_daily': (row['department'] or '', row['date']),
+                'attendance_department_monthly': (row['department'] or '', month),
+            }
+            for table, key in keys.items():
+                totals = deltas[table].setdefault(key, dict.fromkeys(METRICS, 0))
+                for metric, value in values.items():
+                    totals[metric] += sign * value
+
+    cursor = connection.cursor()
+    try:
+        for table, key_columns in TABLES:
+            rows = [key + tuple(totals[metric] for metric in METRICS)
+                    for key, totals in sorted(deltas[table].items())
+                    if any(totals.values())]
+            if not rows:
+                continue
+            columns = list(key_columns) + METRICS
+            updates = ', '.join(f'{metric} = {metric} + VALUES({metric})' for metric in METRICS)
+            cursor.executemany(f'''
+                INSERT INTO {table} ({', '.join(columns)})
+                VALUES ({', '.join(['%s'] * len(columns))})
+                ON DUPLICATE KEY UPDATE {updates}
+            ''', rows)
+    finally:
+        cursor.close()
+
+
+def aggregate(frame, rules):
+    # Vectorized `contribution` summed per rollup key; frame has ROW_QUERY's
+    # columns with TIME values as timedeltas
+    frame = frame.copy()
+    frame['department'] = frame['department'].fillna('')
+    frame['date'] = pd.to_datetime(frame['date'])
+    frame['month'] = frame['date'].dt.to_period('M').dt.to_timestamp()
+    frame['days_recorded'] = 1
+    for status, metric in STATUS_METRICS.items():
+        frame[metric] = (frame['status'] == status).astype(int)
+    time_in = pd.to_timedelta(frame['time_in'])
+    time_out = pd.to_timedelta(frame['time_out'])
+    worked = (time_out - time_in).dt.total_seconds() // 60
+    frame['worked_minutes'] = worked.where(time_out > time_in, 0).fillna(0).astype(int)
+    shift_start = pd.to_timedelta(frame['department'].map(
+        {department: rules.rule(department).shift_start for department in frame['department'].unique()}))
+    late = (time_in - shift_start).dt.total_seconds() // 60
+    frame['late_minutes'] = late.clip(lower=0).where(frame['status'] == 'late', 0).fillna(0).astype(int)
+
+    frames = {}
+    for table, key_columns in TABLES:
+        grouped = frame.groupby(list(key_columns), as_index=False)[METRICS].sum()
+        for column in key_columns:
+            if column in ('date', 'month'):
+                grouped[column] = grouped[column].dt.date
+        frames[table] = grouped
+    return frames
+
+
+def backfill(connection, start, end, rules, log=None, skip_months=()):
+    # Rebuilds every month overlapping start..end, one transaction per month.
+    # Attendance writes during a rebuild can be lost from the rollups of the
+    # month being rebuilt, so run it while writes are quiet. `skip_months`
+    # (archived months, whose rows are no longer in attendance) keep their
+    # rollups as they are.
+    month = month_start(start)
+    rebuilt = []
+    while month <= end:
+        last = month_end(month)
+        if month in skip_months:
+            if log:
+                log(f'{month:%Y-%m}: archived, kept')
+            month = last + timedelta(days=1)
+            continue
+        rows = fetch_rows(connection, 'a.date BETWEEN %s AND %s', (month, last))
+        frame = pd.DataFrame(rows, columns=['employee_id', 'department', 'date', 'status', 'time_in', 'time_out'])
+        frames = aggregate(frame, rules) if rows else {}
+        cursor = connection.cursor()
+        try:
+            for table, key_columns in TABLES:
+                if 'date' in key_columns:
+                    cursor.execute(f'DELETE FROM {table} WHERE date BETWEEN %s AND %s', (month, last))
+                else:
+                    cursor.execute(f'DELETE FROM {table} WHERE month = %s', (month,))
+                if table not in frames:
+                    continue
+                columns = list(key_columns) + METRICS
+                values = list(frames[table][columns].itertuples(index=False, name=None))
+                cursor.executemany(f'''
+                    INSERT INTO {table} ({', '.join(columns)})
+                    VALUES ({', '.join(['%s'] * len(columns))})
+                ''', [tuple(value.item() if hasattr(value, 'item') else value for value in row)
+                      for row in values])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        if log:
+            log(f'{month:%Y-%m}: {len(rows)} attendance rows')
+        rebuilt.append(month)
+        month = last + timedelta(days=1)
+    return rebuilt
+
+
+def attendance_span(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT MIN(date), MAX(date) FROM attendance')
+        return cursor.fetchone()
+    finally:
+        cursor.close()
@@ -0,0 +1,144 @@
+# Attendance rules: shift start, grace period, half-day threshold, working
+# days and time zone, per department.
+#
+# ATTENDANCE_RULES holds a default rule and per-department overrides of it.
+# `RuleSet` compiles them once (times parsed, zones loaded) and the app
+# keeps one instance. Attendance dates and times are stored in the local
+# time of the employee's department.
+#
+# A time in after shift start + grace is late. A day with a time out
+# whose worked time is under the half-day threshold is a half-day, even if
+# it was also late. Rows without a time in (absent or set by hand) keep
+# their status. Changing the rules does not touch stored statuses: run
+# `flask attendance evaluate` for the affected range, then `flask rollups
+# rebuild` so minutes late follow the new shift starts.
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RULE = {
+    'shift_start': time(9, 0),
+    'grace_minutes': 0,
+    'half_day_hours': None,  # None: never set automatically
+    'workdays': (0, 1, 2, 3, 4),  # Monday = 0; days the absent job marks
+    'timezone': None,  # IANA name such as 'Asia/Manila'; None = server local time
+}
+
+# Times are timedeltas since midnight, as MySQLdb returns TIME columns
+Rule = namedtuple('Rule', ['shift_start', 'late_after', 'half_day', 'workdays', 'zone'])
+
+
+def since_midnight(value):
+    # time, timedelta or 'HH:MM[:SS]' -> timedelta
+    if isinstance(value, timedelta):
+        return value
+    if isinstance(value, str):
+        value = time.fromisoformat(value)
+    return timedelta(hours=value.hour, minutes=value.minute, seconds=value.second)
+
+
+def compile_rule(settings):
+    unknown = set(settings) - set(DEFAULT_RULE)
+    if unknown:
+        raise ValueError(f"Unknown attendance rule setting(s): {', '.join(sorted(unknown))}")
+    shift_start = since_midnight(settings['shift_start'])
+    half_day = settings['half_day_hours']
+    return Rule(
+        shift_start=shift_start,
+        late_after=shift_start + timedelta(minutes=settings['grace_minutes']),
+        half_day=timedelta(hours=half_day) if half_day is not None else None,
+        workdays=frozenset(settings['workdays']),
+        zone=ZoneInfo(settings['timezone']) if settings['timezone'] else None,
+    )
+
+
+class RuleSet:
+    def __init__(self, default=None, departments=None):
+        base = dict(DEFAULT_RULE, **(default or {}))
+        self.default = compile_rule(base)
+        self.departments = {name: compile_rule(dict(base, **overrides))
+                            for name, overrides in (departments or {}).items()}
+
+    def rule(self, department):
+        return self.departments.get(department or '', self.default)
+
+    def now(self, department):
+        # Wall-clock time in the department's zone, naive like stored times
+        zone = self.rule(department).zone
+        return datetime.now(zone).replace(tzinfo=None) if zone else datetime.now()
+
+    def status(self, department, time_in, time_out=None):
+        # Scalar version of `evaluate`, for single punches
+        rule = self.rule(department)
+        time_in = since_midnight(time_in)
+        if time_out is not None and rule.half_day is not None:
+            worked = since_midnight(time_out) - time_in
+            if timedelta(0) < worked < rule.half_day:
+                return 'half-day'
+        return 'late' if time_in > rule.late_after else 'present'
+
+    def evaluate(self, frame):
+        # frame: department, status, time_in, time_out (timedeltas or None)
+        # -> Series of statuses
+        departments = frame['department'].fillna('')
+        rules = {department: self.rule(department) for department in departments.unique()}
+        late_after = pd.to_timedelta(departments.map({d: r.late_after for d, r in rules.items()}))
+        half_day = pd.to_timedelta(departments.map(
+            {d: r.half_day if r.half_day is not None else pd.NaT for d, r in rules.items()}))
+        time_in = pd.to_timedelta(frame['time_in'])
+        time_out = pd.to_timedelta(frame['time_out'])
+        worked = time_out - time_in
+
+        status = np.where(time_in > late_after, 'late', 'present')
+        status = np.where((worked > pd.Timedelta(0)) & (worked < half_day), 'half-day', status)
+        return pd.Series(np.where(time_in.isna(), frame['status'], status), index=frame.index)
+
+    def working_departments(self, day):
+        # -> (whether the default rule works on `day`, departments that
+        # differ from the default on it)
+        weekday = day.weekday()
+        default = weekday in self.default.workdays
+        return default, sorted(name for name, rule in self.departments.items()
+                               if (weekday in rule.workdays) != default)
+
+    def localize(self, timestamps, departments):
+        # UTC timestamps (naive) -> each department's local time (naive).
+        # Departments without a zone use the server's local time, at the
+        # offset in effect at each timestamp.
+        local = timestamps.copy()
+        departments = departments.fillna('')
+        for department in departments.unique():
+            zone = self.rule(department).zone
+            rows = departments == department
+            converted = timestamps[rows].dt.tz_localize('UTC')
+            if zone:
+                local[rows] = converted.dt.tz_convert(zone).dt.tz_localize(None)
+            else:
+                local[rows] = converted.map(lambda value: value.to_pydatetime().astimezone().replace(tzinfo=None))
+        return local
+
+
+def update_statuses(connection, rows, rules):
+    # Re-evaluates attendance rows (rollups.fetch_rows dicts, locked by the
+    # caller) and writes the statuses that changed. `rows` is updated in
+    # place so it can go straight to rollups.apply_changes as the new rows.
+    # Does not commit; returns the number of rows changed.
+    if not rows:
+        return 0
+    frame = pd.DataFrame(rows, columns=['employee_id', 'department', 'date', 'status', 'time_in', 'time_out'])
+    statuses = rules.evaluate(frame)
+    changed = [(status, row) for status, row in zip(statuses, rows) if status != row['status']]
+    if not changed:
+        return 0
+    cursor = connection.cursor()
+    try:
+        cursor.executemany('UPDATE attendance SET status = %s WHERE employee_id = %s AND date = %s',
+                           [(status, row['employee_id'], row['date']) for status, row in changed])
+    finally:
+        cursor.close()
+    for status, row in changed:
+        row['status'] = status
+    return len(changed)
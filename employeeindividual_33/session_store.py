@@ -0,0 +1,199 @@
+# Server-side sessions. The cookie carries only a random session id; the
+# session data lives in a store:
+#
+#   MemoryStore  - LRU with TTL in this process; for a single worker
+#   SQLiteStore  - one SQLite file shared by every worker on the host
+#
+# Logged-in sessions keep only the user id. The user's profile (username,
+# role and the linked employee's internal id, code, name and department)
+# is cached in the same store under the user id, loaded once by
+# `profile_loader` and merged into the session on every request, so routes
+# and templates read session['role'] or session['employee_pk'] without a
+# query. Writers that change an employee drop its user's profile with
+# `invalidate_profile`; the next request reloads it. With MemoryStore that
+# only reaches the current process.
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+PROFILE_KEYS = ('username', 'role', 'employee_pk', 'employee_id', 'full_name', 'department')
+
+
+class MemoryStore:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires, value), least recently used first
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+
+class SQLiteStore:
+    def __init__(self, path, cleanup_every=1000):
+        self.path = path
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._writes = 0
+        connection = self._connection()
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        ''')
+        connection.execute('CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)')
+
+    def _connection(self):
+        # One connection per thread, in autocommit mode
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM sessions WHERE key = ? AND expires >= ?', (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO sessions (key, value, expires) VALUES (?, ?, ?)',
+                           (key, value, time.time() + ttl))
+        self._writes += 1
+        if self._writes % self.cleanup_every == 0:
+            connection.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),))
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM sessions WHERE key = ?', (key,))
+
+    def delete_prefix(self, prefix):
+        self._connection().execute('DELETE FROM sessions WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, saved_at=0.0):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.saved_at = saved_at
+        self.modified = False
+        self.rotated_from = None
+
+    def regenerate(self):
+        # New id on login, so a session id planted before login is useless
+        if self.rotated_from is None and not self.new:
+            self.rotated_from = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, profile_loader, ttl=8 * 3600):
+        # profile_loader(user_id) -> dict with PROFILE_KEYS, or None when
+        # the user no longer exists
+        self.store = store
+        self.profile_loader = profile_loader
+        self.ttl = ttl
+
+    def profile(self, user_id):
+        value = self.store.get(f'profile:{user_id}')
+        if value is not None:
+            return self.serializer.loads(value)
+        profile = self.profile_loader(user_id)
+        if profile is not None:
+            profile = {key: profile[key] for key in PROFILE_KEYS}
+            self.set_profile(user_id, profile)
+        return profile
+
+    def set_profile(self, user_id, profile):
+        self.store.set(f'profile:{user_id}', self.serializer.dumps(dict(profile)), self.ttl)
+
+    def invalidate_profile(self, user_id):
+        if user_id is not None:
+            self.store.delete(f'profile:{user_id}')
+
+    def clear_profiles(self):
+        self.store.delete_prefix('profile:')
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        value = self.store.get(f'session:{sid}') if sid else None
+        if value is None:
+            return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+        record = self.serializer.loads(value)
+        data = record['data']
+        if 'id' in data:
+            profile = self.profile(data['id'])
+            if profile is None:
+                # Account deleted: log the session out
+                session = ServerSideSession(sid=sid, saved_at=record['saved_at'])
+                session.modified = True
+                return session
+            data.update(profile)
+        return ServerSideSession(data, sid=sid, saved_at=record['saved_at'])
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.rotated_from is not None:
+            self.store.delete(f'session:{session.rotated_from}')
+        if not session:
+            if not session.new:
+                self.store.delete(f'session:{session.sid}')
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Unchanged sessions are rewritten only to slide their expiry
+        now = time.time()
+        if session.modified or now - session.saved_at > self.ttl / 2:
+            data = {key: value for key, value in session.items() if key not in PROFILE_KEYS}
+            self.store.set(f'session:{session.sid}', self.serializer.dumps({'data': data, 'saved_at': now}),
+                           self.ttl)
+        if session.new or session.rotated_from is not None or session.permanent:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
@@ -1,2 +1,236 @@
 // Future dynamic enhancements can go here (e.g., attendance filtering, modal confirmations, etc.)
 console.log("FemmeHR JS loaded.");
+
+// Attendance: one shared edit modal, filled in from the row that opened it
+document.addEventListener('DOMContentLoaded', function () {
+    var editModal = document.getElementById('editModal');
+    if (!editModal) {
+        return;
+    }
+    editModal.addEventListener('show.bs.modal', function (event) {
+        var data = event.relatedTarget.dataset;
+        editModal.querySelector('form').action = data.action;
+        editModal.querySelector('#edit_date').value = data.date;
+        editModal.querySelector('#edit_time_in').value = data.timeIn;
+        editModal.querySelector('#edit_time_out').value = data.timeOut;
+        editModal.querySelector('#edit_status').value = data.status;
+        editModal.querySelector('#edit_notes').value = data.notes;
+    });
+});
+
+// Attendance: bulk delete, bulk status change and department corrections.
+// The server answers with the rows that changed, which are patched into
+// the table in place.
+document.addEventListener('DOMContentLoaded', function () {
+    var bulk = document.getElementById('bulkActions');
+    if (!bulk) {
+        return;
+    }
+    var records = document.getElementById('attendanceRecords');
+    var result = document.getElementById('bulkResult');
+    var selectAll = document.getElementById('selectAll');
+
+    var selected = function () {
+        return Array.prototype.slice.call(records.querySelectorAll('input[name="ids"]:checked'));
+    };
+    var updateCount = function () {
+        bulk.querySelector('[data-selected-count]').textContent = selected().length;
+    };
+    var showResult = function (text, category) {
+        result.className = 'alert alert-' + category;
+        result.textContent = text;
+    };
+    var patchRow = function (record) {
+        var row = records.querySelector('tr[data-id="' + record.id + '"]');
+        if (!row) {
+            return false;
+        }
+        if (record.deleted) {
+            row.remove();
+            return true;
+        }
+        row.querySelector('[data-field="time_in"]').textContent = record.time_in || '-';
+        row.querySelector('[data-field="time_out"]').textContent = record.time_out || '-';
+        row.querySelector('[data-field="status"]').replaceChildren(statusBadge(record.status));
+        var edit = row.querySelector('[data-bs-target="#editModal"]');
+        if (edit) {
+            edit.dataset.timeIn = record.time_in || '';
+            edit.dataset.timeOut = record.time_out || '';
+            edit.dataset.status = record.status;
+            edit.dataset.notes = record.notes || '';
+        }
+        row.querySelector('input[name="ids"]').checked = false;
+        return true;
+    };
+    var send = function (url, body) {
+        return fetch(url, {method: 'POST', body: body, credentials: 'same-origin',
+                           headers: {'Accept': 'application/json'}})
+            .then(function (response) {
+                return response.json().then(function (data) {
+                    if (!response.ok) {
+                        throw new Error(data.error || response.statusText);
+                    }
+                    return data;
+                });
+            })
+            .then(function (data) {
+                var elsewhere = data.rows.filter(function (record) { return !patchRow(record); }).length;
+                showResult(data.affected + ' record(s) changed' +
+                           (elsewhere ? ', ' + elsewhere + ' of them not on this page' : '') + '.', 'success');
+                selectAll.checked = false;
+                updateCount();
+            })
+            .catch(function (error) { showResult(error.message, 'danger'); });
+    };
+    var selectionForm = function () {
+        var body = new FormData();
+        selected().forEach(function (box) { body.append('ids', box.value); });
+        return body;
+    };
+
+    records.addEventListener('change', updateCount);
+    selectAll.addEventListener('change', function () {
+        records.querySelectorAll('input[name="ids"]').forEach(function (box) { box.checked = selectAll.checked; });
+        updateCount();
+    });
+    bulk.querySelector('[data-bulk="delete"]').addEventListener('click', function () {
+        var count = selected().length;
+        if (count && confirm('Delete ' + count + ' attendance record(s)?')) {
+            send(bulk.dataset.deleteUrl, selectionForm());
+        }
+    });
+    bulk.querySelector('[data-bulk="status"]').addEventListener('click', function () {
+        if (selected().length) {
+            var body = selectionForm();
+            body.append('status', document.getElementById('bulk_status').value);
+            send(bulk.dataset.statusUrl, body);
+        }
+    });
+    var correction = document.getElementById('correctionForm');
+    correction.addEventListener('submit', function (event) {
+        event.preventDefault();
+        send(correction.action, new FormData(correction));
+    });
+});
+
+// Reports: poll a queued report job and download it once it is done
+document.addEventListener('DOMContentLoaded', function () {
+    var reportStatus = document.getElementById('reportStatus');
+    if (!reportStatus) {
+        return;
+    }
+    var statusUrl = reportStatus.dataset.statusUrl;
+    var poll = function () {
+        fetch(statusUrl, {headers: {'Accept': 'application/json'}})
+            .then(function (response) { return response.json(); })
+            .then(function (report) {
+                if (report.status === 'done') {
+                    reportStatus.querySelector('.spinner-border').remove();
+                    document.getElementById('reportStatusText').textContent = 'Your report is ready.';
+                    window.location = report.download_url;
+                } else if (report.status === 'failed') {
+                    reportStatus.querySelector('.spinner-border').remove();
+                    document.getElementById('reportStatusText').textContent = 'Report generation failed: ' + report.error;
+                } else {
+                    setTimeout(poll, 2000);
+                }
+            })
+            .catch(function () { setTimeout(poll, 5000); });
+    };
+    poll();
+});
+
+// Dashboards: poll the JSON API and patch the page in place. Each poll
+// sends the last ETag, so an unchanged dataset costs a bodiless 304.
+function pollJson(element, onChange) {
+    var interval = (parseInt(element.dataset.pollInterval, 10) || 15) * 1000;
+    var etag = null;
+    var poll = function () {
+        if (document.hidden) {
+            setTimeout(poll, interval);
+            return;
+        }
+        var headers = {'Accept': 'application/json'};
+        if (etag) {
+            headers['If-None-Match'] = etag;
+        }
+        fetch(element.dataset.url, {headers: headers, cache: 'no-store', credentials: 'same-origin'})
+            .then(function (response) {
+                if (response.status === 304) {
+                    return null;
+                }
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                etag = response.headers.get('ETag');
+                return response.json();
+            })
+            .then(function (data) {
+                if (data) {
+                    onChange(data);
+                }
+                setTimeout(poll, interval);
+            })
+            .catch(function () { setTimeout(poll, interval * 4); });
+    };
+    setTimeout(poll, interval);
+}
+
+function statusBadge(status) {
+    var colors = {'present': 'success', 'late': 'warning', 'absent': 'danger'};
+    var badge = document.createElement('span');
+    badge.className = 'badge bg-' + (colors[status] || 'info');
+    badge.textContent = status;
+    return badge;
+}
+
+function replaceRows(tbody, records, columns, emptyText) {
+    var rows = records.map(function (record) {
+        var row = document.createElement('tr');
+        columns.forEach(function (column) {
+            var cell = document.createElement('td');
+            if (column === 'status') {
+                cell.appendChild(statusBadge(record.status));
+            } else {
+                cell.textContent = record[column] || '-';
+            }
+            row.appendChild(cell);
+        });
+        return row;
+    });
+    if (!rows.length) {
+        var row = document.createElement('tr');
+        var cell = document.createElement('td');
+        cell.colSpan = columns.length;
+        cell.className = 'text-center';
+        cell.textContent = emptyText;
+        row.appendChild(cell);
+        rows.push(row);
+    }
+    tbody.replaceChildren.apply(tbody, rows);
+}
+
+document.addEventListener('DOMContentLoaded', function () {
+    var summary = document.getElementById('todaySummary');
+    if (summary) {
+        pollJson(summary, function (data) {
+            summary.querySelectorAll('[data-field]').forEach(function (field) {
+                field.textContent = data[field.dataset.field];
+            });
+        });
+    }
+    var recent = document.getElementById('recentAttendance');
+    if (recent) {
+        pollJson(recent, function (data) {
+            replaceRows(recent, data.records, ['employee_id', 'full_name', 'date', 'time_in', 'time_out', 'status'],
+                        'No attendance records found');
+        });
+    }
+    var history = document.getElementById('attendanceHistory');
+    if (history) {
+        pollJson(history, function (data) {
+            replaceRows(history, data.records, ['date', 'time_in', 'time_out', 'status'],
+                        'No attendance records found');
+        });
+    }
+});
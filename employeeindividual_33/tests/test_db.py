@@ -0,0 +1,202 @@
+# Tests for the connection pool and its Flask glue (db.py). They need a
+# MySQL database to connect to and are skipped without one:
+#
+#   TEST_MYSQL_DB=kate33_test TEST_MYSQL_USER=root python -m pytest tests
+#
+# TEST_MYSQL_HOST, TEST_MYSQL_PORT and TEST_MYSQL_PASSWORD are optional.
+# The tests create and drop a table named pool_test in that database.
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MySQLdb = pytest.importorskip('MySQLdb')
+from flask import Flask
+
+from db import ConnectionPool, Database, PoolTimeout
+
+if not os.environ.get('TEST_MYSQL_DB'):
+    pytest.skip('TEST_MYSQL_DB is not set', allow_module_level=True)
+
+CONNECT_ARGS = {
+    'host': os.environ.get('TEST_MYSQL_HOST', 'localhost'),
+    'port': int(os.environ.get('TEST_MYSQL_PORT', 3306)),
+    'user': os.environ.get('TEST_MYSQL_USER', 'root'),
+    'passwd': os.environ.get('TEST_MYSQL_PASSWORD', ''),
+    'db': os.environ['TEST_MYSQL_DB'],
+    'charset': 'utf8mb4',
+}
+
+
+def thread_id(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT CONNECTION_ID()')
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**options):
+        pool = ConnectionPool(**dict(options, **CONNECT_ARGS))
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+@pytest.fixture
+def table():
+    connection = MySQLdb.connect(**CONNECT_ARGS)
+    cursor = connection.cursor()
+    cursor.execute('CREATE TABLE IF NOT EXISTS pool_test (id INT NOT NULL PRIMARY KEY) ENGINE=InnoDB')
+    cursor.execute('DELETE FROM pool_test')
+    connection.commit()
+    yield 'pool_test'
+    cursor.execute('DROP TABLE IF EXISTS pool_test')
+    connection.close()
+
+
+def test_release_rolls_back_open_transaction(make_pool, table):
+    pool = make_pool(maxsize=1)
+    connection = pool.acquire()
+    connection.cursor().execute(f'INSERT INTO {table} (id) VALUES (1)')
+    pool.release(connection)
+
+    again = pool.acquire()
+    assert again is connection
+    cursor = again.cursor()
+    cursor.execute(f'SELECT COUNT(*) FROM {table}')
+    assert cursor.fetchone()[0] == 0
+    pool.release(again)
+
+
+def test_released_connection_is_reused(make_pool):
+    pool = make_pool(maxsize=2)
+    connection = pool.acquire()
+    first = thread_id(connection)
+    pool.release(connection)
+    connection = pool.acquire()
+    assert thread_id(connection) == first
+    pool.release(connection)
+    assert pool.stats()['created'] == 1
+
+
+def test_release_with_discard_closes_connection(make_pool):
+    pool = make_pool(maxsize=1)
+    connection = pool.acquire()
+    pool.release(connection, discard=True)
+    stats = pool.stats()
+    assert (stats['size'], stats['idle'], stats['discarded']) == (0, 0, 1)
+    with pytest.raises(MySQLdb.Error):
+        connection.ping()
+
+
+def test_connection_past_recycle_age_is_replaced(make_pool):
+    pool = make_pool(maxsize=1, recycle=0)
+    connection = pool.acquire()
+    first = thread_id(connection)
+    pool.release(connection)
+
+    connection = pool.acquire()
+    assert thread_id(connection) != first
+    pool.release(connection)
+    stats = pool.stats()
+    assert (stats['created'], stats['discarded'], stats['size']) == (2, 1, 1)
+
+
+def test_idle_connection_is_pinged_and_replaced_when_dead(make_pool):
+    pool = make_pool(maxsize=1, ping_after=0)
+    connection = pool.acquire()
+    first = thread_id(connection)
+    pool.release(connection)
+
+    killer = MySQLdb.connect(**CONNECT_ARGS)
+    try:
+        killer.cursor().execute(f'KILL {first}')
+    finally:
+        killer.close()
+
+    connection = pool.acquire()
+    assert thread_id(connection) != first
+    pool.release(connection)
+    assert pool.stats()['discarded'] == 1
+
+
+def test_live_idle_connection_survives_ping(make_pool):
+    pool = make_pool(maxsize=1, ping_after=0)
+    connection = pool.acquire()
+    pool.release(connection)
+    assert pool.acquire() is connection
+    pool.release(connection)
+    assert pool.stats()['discarded'] == 0
+
+
+def test_pool_never_exceeds_maxsize(make_pool):
+    pool = make_pool(maxsize=2, timeout=0.1)
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    stats = pool.stats()
+    assert (stats['size'], stats['in_use'], stats['timeouts']) == (2, 2, 1)
+    for connection in held:
+        pool.release(connection)
+
+
+def test_waiter_gets_released_connection(make_pool):
+    pool = make_pool(maxsize=1, timeout=5)
+    connection = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    pool.release(connection)
+    waiter.join(5)
+    assert acquired == [connection]
+    pool.release(connection)
+    assert pool.stats()['size'] == 1
+
+
+@pytest.fixture
+def app_db():
+    app = Flask(__name__)
+    app.config.update(MYSQL_HOST=CONNECT_ARGS['host'], MYSQL_PORT=CONNECT_ARGS['port'],
+                      MYSQL_USER=CONNECT_ARGS['user'], MYSQL_PASSWORD=CONNECT_ARGS['passwd'],
+                      MYSQL_DB=CONNECT_ARGS['db'], DB_POOL_SIZE=1)
+    db = Database(app)
+    yield app, db
+    db.pool.close()
+
+
+def test_teardown_closes_cursors_and_releases_connection(app_db):
+    app, db = app_db
+    with app.app_context():
+        connection = db.connection
+        cursors = [db.cursor(), db.cursor(MySQLdb.cursors.SSCursor)]
+        cursors[0].execute('SELECT 1')
+        cursors[1].execute('SELECT 1 UNION ALL SELECT 2')  # left unread
+        assert db.pool.stats()['in_use'] == 1
+    assert all(cursor.connection is None for cursor in cursors)
+    stats = db.pool.stats()
+    assert (stats['in_use'], stats['idle']) == (0, 1)
+
+    with app.app_context():
+        assert db.connection is connection
+        cursor = db.cursor()
+        cursor.execute('SELECT 2 AS value')
+        assert cursor.fetchone() == {'value': 2}
+
+
+def test_each_app_context_uses_one_connection(app_db):
+    app, db = app_db
+    with app.app_context():
+        assert db.connection is db.connection
+        assert db.pool.stats()['acquired'] == 1